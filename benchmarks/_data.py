@@ -0,0 +1,104 @@
+"""Synthetic Open511 documents for the benchmark scripts in this directory."""
+
+import datetime
+import random
+
+SEVERITIES = ('MINOR', 'MODERATE', 'MAJOR', 'UNKNOWN')
+EVENT_TYPES = ('CONSTRUCTION', 'SPECIAL_EVENT', 'INCIDENT', 'WEATHER_CONDITION', 'ROAD_CONDITION')
+ROADS = ['Highway %d' % i for i in range(1, 60)] + ['Rue %s' % n for n in (
+    'Sherbrooke', 'Saint-Denis', 'Notre-Dame', 'Sainte-Catherine', 'Papineau', 'Jean-Talon')]
+JURISDICTION = 'example.jurisdiction'
+JURISDICTION_URL = 'https://example.org/jurisdictions/' + JURISDICTION
+
+
+def _geography(rnd):
+    lon, lat = rnd.uniform(-79.5, -64.0), rnd.uniform(44.9, 50.0)
+    if rnd.random() < 0.5:
+        return {'type': 'Point', 'coordinates': [round(lon, 6), round(lat, 6)]}
+    coords = []
+    for _ in range(rnd.randint(2, 40)):
+        lon += rnd.uniform(-0.01, 0.01)
+        lat += rnd.uniform(-0.01, 0.01)
+        coords.append([round(lon, 6), round(lat, 6)])
+    return {'type': 'LineString', 'coordinates': coords}
+
+
+def _schedule(rnd, start):
+    if rnd.random() < 0.5:
+        intervals = []
+        for _ in range(rnd.randint(1, 4)):
+            end = start + datetime.timedelta(hours=rnd.randint(1, 72))
+            intervals.append('%s/%s' % (start.strftime('%Y-%m-%dT%H:%M'), end.strftime('%Y-%m-%dT%H:%M')))
+            start = end + datetime.timedelta(days=rnd.randint(1, 10))
+        return {'intervals': intervals}
+    sched = {
+        'start_date': start.strftime('%Y-%m-%d'),
+        'end_date': (start + datetime.timedelta(days=rnd.randint(30, 300))).strftime('%Y-%m-%d'),
+        'daily_start_time': '%02d:00' % rnd.randint(0, 11),
+        'daily_end_time': '%02d:30' % rnd.randint(12, 23),
+    }
+    if rnd.random() < 0.5:
+        sched['days'] = sorted(rnd.sample(range(1, 8), rnd.randint(1, 5)))
+    result = {'recurring_schedules': [sched]}
+    if rnd.random() < 0.3:
+        result['exceptions'] = [
+            (start + datetime.timedelta(days=rnd.randint(1, 30))).strftime('%Y-%m-%d') + ' 09:00-12:00'
+            for _ in range(rnd.randint(1, 5))
+        ]
+    return result
+
+
+def make_event(rnd, i):
+    created = datetime.datetime(2013, 1, 1) + datetime.timedelta(minutes=rnd.randint(0, 60 * 24 * 365))
+    updated = created + datetime.timedelta(minutes=rnd.randint(0, 60 * 24 * 30))
+    road = rnd.choice(ROADS)
+    event_type = rnd.choice(EVENT_TYPES)
+    event = {
+        'id': '%s/%d' % (JURISDICTION, i),
+        'url': '/events/%s/%d' % (JURISDICTION, i),
+        'jurisdiction_url': JURISDICTION_URL,
+        'status': 'ACTIVE' if rnd.random() < 0.8 else 'ARCHIVED',
+        'headline': '%s on %s' % (event_type.replace('_', ' ').title(), road),
+        'event_type': event_type,
+        'severity': rnd.choice(SEVERITIES),
+        'created': created.strftime('%Y-%m-%dT%H:%M:%S-05:00'),
+        'updated': updated.strftime('%Y-%m-%dT%H:%M:%S-05:00'),
+        'timezone': 'America/Montreal',
+        'geography': _geography(rnd),
+        'roads': [{'name': road, 'direction': rnd.choice(('N', 'S', 'E', 'W', 'BOTH'))}],
+        'schedule': _schedule(rnd, created),
+    }
+    if rnd.random() < 0.6:
+        event['description'] = ' '.join(rnd.choice(ROADS) for _ in range(rnd.randint(5, 30)))
+    if rnd.random() < 0.3:
+        event['roads'][0]['from'] = rnd.choice(ROADS)
+        event['roads'][0]['to'] = rnd.choice(ROADS)
+    if rnd.random() < 0.2:
+        event['certainty'] = rnd.choice(('OBSERVED', 'LIKELY', 'POSSIBLE'))
+    return event
+
+
+def make_document(n_events, seed=511):
+    """Returns an Open511 JSON document (a dict) containing n_events events."""
+    rnd = random.Random(seed)
+    return {
+        'meta': {'version': 'v1'},
+        'events': [make_event(rnd, i) for i in range(n_events)],
+    }
+
+
+def make_xml_document(n_events, seed=511):
+    from open511.converter import json_doc_to_xml
+    return json_doc_to_xml(make_document(n_events, seed))
+
+
+def timed(func, *args, **kwargs):
+    """Runs func once and returns (seconds, result)."""
+    import time
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def best_of(repeat, func, *args, **kwargs):
+    return min(timed(func, *args, **kwargs)[0] for _ in range(repeat))
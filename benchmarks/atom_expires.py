@@ -0,0 +1,41 @@
+"""Times convert_to_atom with include_expires, on a feed where every event has
+its own schedule and on one where events share a small set of schedules.
+
+    python benchmarks/atom_expires.py [number of events] [processes]
+"""
+import datetime
+import sys
+
+import pytz
+
+from _data import make_document, best_of
+
+from open511.converter import compiled_json_doc_to_xml
+from open511.converter.atom import convert_to_atom
+from open511.utils.schedule import NextIntervalCache
+
+# Around the middle of the synthetic documents' schedules
+TIMESTAMP = datetime.datetime(2013, 6, 1, 12, 0, tzinfo=pytz.utc)
+
+
+def main(n_events=20000, processes=2):
+    unique = make_document(n_events)
+    shared = make_document(n_events)
+    for i, event in enumerate(shared['events']):
+        event['schedule'] = shared['events'][i % 200]['schedule']
+
+    for label, json_doc in (('unique schedules', unique), ('200 shared schedules', shared)):
+        doc = compiled_json_doc_to_xml(json_doc)
+        print("%d events, %s" % (n_events, label))
+        expires = dict(include_expires=True, timestamp=TIMESTAMP)
+        rows = [
+            ('without include_expires', {}),
+            ('one next_interval per event', dict(expires, schedule_cache=NextIntervalCache(maxsize=0))),
+            ('shared cache', expires),
+            ('shared cache, %d processes' % processes, dict(expires, processes=processes)),
+        ]
+        for row_label, kwargs in rows:
+            print("  %-30s %7.3fs" % (row_label, best_of(3, convert_to_atom, doc, **kwargs)))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
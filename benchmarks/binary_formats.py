@@ -0,0 +1,42 @@
+"""Compares the size and speed of Open511 JSON with its MessagePack and CBOR
+equivalents, with and without a string table.
+
+    python benchmarks/binary_formats.py [number of events]
+"""
+import gzip
+import sys
+
+from _data import make_document, best_of
+
+from open511.utils import serialization
+from open511.utils.serialization import json_dumps, json_loads
+
+
+def main(n_events=20000):
+    doc = make_document(n_events)
+    formats = [
+        ('json (%s)' % serialization.json_backend.name, lambda d: json_dumps(d, compact=True), json_loads),
+    ]
+    if serialization.msgpack is not None:
+        formats += [
+            ('msgpack', serialization.msgpack_dumps, serialization.msgpack_loads),
+            ('msgpack+table', lambda d: serialization.msgpack_dumps(d, string_table=True), serialization.msgpack_loads),
+        ]
+    if serialization.cbor2 is not None:
+        formats += [
+            ('cbor', serialization.cbor_dumps, serialization.cbor_loads),
+            ('cbor+table', lambda d: serialization.cbor_dumps(d, string_table=True), serialization.cbor_loads),
+        ]
+
+    print("%d events" % n_events)
+    print("%-16s %10s %10s %10s %10s" % ('format', 'bytes', 'gzipped', 'encode', 'decode'))
+    for name, dumps, loads in formats:
+        encoded = dumps(doc)
+        assert loads(encoded) == doc
+        print("%-16s %10d %10d %9.3fs %9.3fs" % (
+            name, len(encoded), len(gzip.compress(encoded)) if hasattr(gzip, 'compress') else 0,
+            best_of(3, dumps, doc), best_of(3, loads, encoded)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
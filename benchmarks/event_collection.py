@@ -0,0 +1,31 @@
+"""Times building an in-memory EventCollection and answering API-style
+queries from it, against filtering the parsed document event by event.
+
+    python benchmarks/event_collection.py [number of events]
+"""
+import sys
+
+from _data import make_document, best_of, timed
+from event_store import QUERIES, _linear
+
+from open511.utils.collection import EventCollection
+
+MORE_QUERIES = [
+    {'severity': 'MAJOR,MODERATE', 'event_type': 'CONSTRUCTION', 'updated': '>2013-10-01'},
+    {'status': 'ALL', 'road_name': 'Highway 3', 'created': '<2013-04-01'},
+]
+
+def main(n_events=20000):
+    doc = make_document(n_events)
+    print("%d events" % n_events)
+    seconds, events = timed(EventCollection, doc)
+    print("  build                     %8.3fs" % seconds)
+    for params in QUERIES + MORE_QUERIES:
+        results = events.query(params)
+        assert [e['id'] for e in results] == [e['id'] for e in _linear(doc['events'], params)]
+        print("  %-60s %6d results  collection %.4fs  linear %.4fs" % (
+            ','.join('%s=%s' % p for p in params.items()), len(results),
+            best_of(3, events.query, params), best_of(1, _linear, doc['events'], params)))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,43 @@
+"""Times loading events into the SQLite EventStore and answering API-style
+queries from it, against filtering the parsed document event by event.
+
+    python benchmarks/event_store.py [number of events]
+"""
+import sys
+
+import pytz
+
+from _data import make_document, best_of, timed
+
+from open511.utils.filters import EventFilter
+from open511.utils.schedule import Schedule
+from open511.utils.store import EventStore
+
+QUERIES = [
+    {'severity': 'MAJOR'},
+    {'road_name': 'Highway 12', 'status': 'ALL'},
+    {'bbox': '-74,45.4,-73.4,45.7'},
+    {'updated': '>2013-12-01'},
+    {'in_effect_on': '2013-08-01T12:00'},
+]
+
+def _linear(events, params):
+    f = EventFilter.from_params(params)
+    return [e for e in events if f.matches(e, Schedule.from_json(
+        e['schedule'], pytz.timezone(e['timezone'])) if f.in_effect else None)]
+
+def main(n_events=20000):
+    doc = make_document(n_events)
+    store = EventStore()
+    print("%d events" % n_events)
+    print("  first upsert              %8.3fs" % timed(store.upsert, doc)[0])
+    print("  upsert, nothing changed   %8.3fs" % timed(store.upsert, doc)[0])
+    for params in QUERIES:
+        results = store.query(params)
+        assert sorted(e['id'] for e in results) == sorted(e['id'] for e in _linear(doc['events'], params))
+        print("  %-40s %6d results  store %.4fs  linear %.4fs" % (
+            ','.join('%s=%s' % p for p in params.items()), len(results),
+            best_of(3, store.query, params), best_of(1, _linear, doc['events'], params)))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
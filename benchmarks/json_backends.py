@@ -0,0 +1,29 @@
+"""Compares the JSON backends available to open511.utils.serialization.
+
+    python benchmarks/json_backends.py [number of events]
+"""
+import sys
+
+from _data import make_document, best_of
+
+from open511.utils.serialization import JSON_BACKENDS
+
+
+def main(n_events=20000):
+    doc = make_document(n_events)
+    print("%d events" % n_events)
+    print("%-8s %10s %10s %10s %12s" % ('backend', 'dumps', 'compact', 'loads', 'bytes'))
+    for name, backend in sorted(JSON_BACKENDS.items()):
+        encoded = backend.dumps_compact(doc)
+        assert JSON_BACKENDS['json'].loads(encoded) == backend.loads(JSON_BACKENDS['json'].dumps(doc))
+        print("%-8s %9.3fs %9.3fs %9.3fs %12d" % (
+            name,
+            best_of(3, backend.dumps, doc),
+            best_of(3, backend.dumps_compact, doc),
+            best_of(3, backend.loads, encoded),
+            len(encoded),
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
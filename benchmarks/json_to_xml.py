@@ -0,0 +1,25 @@
+"""Compares json_doc_to_xml with the cached compiled_json_doc_to_xml builder.
+
+    python benchmarks/json_to_xml.py [number of events]
+"""
+import sys
+
+from lxml import etree
+
+from _data import make_document, best_of
+
+from open511.converter import json_doc_to_xml, compiled_json_doc_to_xml
+
+
+def main(n_events=100000):
+    doc = make_document(n_events)
+    assert etree.tostring(json_doc_to_xml(doc)) == etree.tostring(compiled_json_doc_to_xml(doc))
+    recursive = best_of(3, json_doc_to_xml, doc)
+    compiled = best_of(3, compiled_json_doc_to_xml, doc)
+    print("%d events" % n_events)
+    print("json_doc_to_xml          %7.3fs" % recursive)
+    print("compiled_json_doc_to_xml %7.3fs  (%.1fx)" % (compiled, recursive / compiled))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,38 @@
+"""Times localizing naive wall-clock datetimes, as schedule expansion does for
+every interval, with pytz's localize and with open511.utils.timezone.localize.
+
+    python benchmarks/localize.py [number of datetimes]
+"""
+import datetime
+import random
+import sys
+
+import pytz
+
+from _data import best_of
+
+from open511.utils.timezone import localize
+
+def make_times(n):
+    rand = random.Random(511)
+    start = datetime.datetime(2010, 1, 1)
+    return [start + datetime.timedelta(minutes=rand.randrange(10 * 365 * 24 * 60)) for _ in range(n)]
+
+def with_pytz(tz, times):
+    for t in times:
+        tz.localize(t)
+
+def with_table(tz, times):
+    for t in times:
+        localize(t, tz)
+
+def main(n=100000):
+    times = make_times(n)
+    print("%d datetimes" % n)
+    for name in ('America/Montreal', 'Europe/London', 'UTC'):
+        tz = pytz.timezone(name)
+        print("  %-20s pytz %.3fs  table %.3fs" % (name, best_of(3, with_pytz, tz, times),
+            best_of(3, with_table, tz, times)))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
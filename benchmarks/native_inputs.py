@@ -0,0 +1,34 @@
+"""Compares converting to Atom and KML from each converter's native input
+against the old path, which first converted the whole document to the
+other format.
+
+    python benchmarks/native_inputs.py [number of events]
+"""
+import sys
+
+from _data import make_document, make_xml_document, best_of
+
+from open511.converter import compiled_json_doc_to_xml, compiled_xml_to_json
+from open511.converter.atom import convert_to_atom
+from open511.converter.kml import convert_to_kml
+
+
+def main(n_events=20000):
+    json_doc = make_document(n_events)
+    xml_doc = make_xml_document(n_events)
+    print("%d events" % n_events)
+    cases = [
+        ('JSON -> Atom', convert_to_atom, json_doc,
+            lambda doc: convert_to_atom(compiled_json_doc_to_xml(doc))),
+        ('XML -> KML', convert_to_kml, xml_doc,
+            lambda doc: convert_to_kml(compiled_xml_to_json(doc))),
+    ]
+    for label, native, doc, via_conversion in cases:
+        before = best_of(3, via_conversion, doc)
+        after = best_of(3, native, doc)
+        print("%-13s via conversion %7.3fs  native %7.3fs  (%.1fx)" % (
+            label, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,30 @@
+"""Times flattening events into Arrow record batches and writing them to
+Parquet, and compares the file size with compact Open511 JSON.
+
+    python benchmarks/parquet_export.py [number of events]
+"""
+import os
+import sys
+import tempfile
+
+from _data import make_document, best_of
+
+from open511.converter import arrow
+from open511.utils.serialization import json_dumps
+
+
+def main(n_events=50000):
+    if arrow.pa is None:
+        sys.exit("pyarrow isn't installed")
+    doc = make_document(n_events)
+    path = os.path.join(tempfile.mkdtemp(), 'events.parquet')
+    print("%d events" % n_events)
+    print("  record batches             %.3fs" % best_of(3, lambda: list(arrow.iter_record_batches([doc]))))
+    print("  write parquet              %.3fs" % best_of(3, arrow.write_parquet, [doc], path))
+    print("  parquet size          %10d bytes" % os.path.getsize(path))
+    print("  compact JSON size     %10d bytes" % len(json_dumps(doc, compact=True)))
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,48 @@
+"""Times repeated next_interval, includes and active_within_range calls on the
+same schedules with overlapping windows, as an API serving the same events
+over and over does.
+
+    python benchmarks/schedule_cache.py [number of events]
+"""
+import datetime
+import sys
+
+import pytz
+
+from _data import make_document, best_of
+
+from open511.utils.schedule import Schedule
+
+START = datetime.datetime(2013, 3, 1, tzinfo=pytz.utc)
+TIMES = [START + datetime.timedelta(hours=7 * i) for i in range(100)]
+
+def make_schedules(n_events):
+    tz = pytz.timezone('America/Montreal')
+    return [Schedule.from_json(e['schedule'], tz)
+        for e in make_document(n_events)['events']]
+
+def next_intervals(schedules):
+    for schedule in schedules:
+        for t in TIMES:
+            schedule.next_interval(t)
+
+def includes(schedules):
+    for schedule in schedules:
+        for t in TIMES:
+            schedule.includes(t)
+
+def windows(schedules):
+    for schedule in schedules:
+        for t in TIMES:
+            schedule.active_within_range(t, t + datetime.timedelta(days=14))
+
+def main(n_events=500):
+    print("%d schedules, %d calls each" % (n_events, len(TIMES)))
+    for name, func in (('next_interval', next_intervals), ('includes', includes),
+            ('active_within_range, 14 days', windows)):
+        # Fresh schedules for the first, uncached run
+        print("  %-30s first %.3fs  repeated %.3fs" % (name, best_of(1, func, make_schedules(n_events)),
+            best_of(3, func, make_schedules(n_events))))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
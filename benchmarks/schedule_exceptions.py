@@ -0,0 +1,41 @@
+"""Times range queries on a long recurring schedule with many exception dates.
+
+    python benchmarks/schedule_exceptions.py [number of exceptions]
+"""
+import datetime
+import sys
+
+from lxml import etree
+import pytz
+
+from _data import best_of
+
+from open511.utils.schedule import Schedule
+
+def make_schedule(n_exceptions):
+    start = datetime.date(2013, 1, 1)
+    exceptions = ''.join('<exception>%s 10:00-12:00</exception>' % (start + datetime.timedelta(days=2 * i))
+        for i in range(n_exceptions))
+    return Schedule.from_element(etree.fromstring(
+        '<schedule><recurring_schedules><recurring_schedule><start_date>2013-01-01</start_date>'
+        '<end_date>2016-12-31</end_date><daily_start_time>08:00</daily_start_time>'
+        '<daily_end_time>17:00</daily_end_time></recurring_schedule></recurring_schedules>'
+        '<exceptions>%s</exceptions></schedule>' % exceptions), pytz.timezone('America/Montreal'))
+
+def week_queries(schedule, n=200):
+    for i in range(n):
+        start = datetime.datetime(2013, 1, 1) + datetime.timedelta(days=3 * i)
+        list(schedule.intervals(start, start + datetime.timedelta(days=7)))
+
+def next_intervals(schedule, n=200):
+    for i in range(n):
+        schedule.next_interval(datetime.datetime(2013, 1, 1) + datetime.timedelta(days=3 * i, hours=18))
+
+def main(n_exceptions=500):
+    schedule = make_schedule(n_exceptions)
+    print("%d exception dates" % n_exceptions)
+    print("  200 week-long intervals() %8.4fs" % best_of(3, week_queries, schedule))
+    print("  200 next_interval()       %8.4fs" % best_of(3, next_intervals, schedule))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
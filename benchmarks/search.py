@@ -0,0 +1,36 @@
+"""Times building a SearchIndex and running text queries against it,
+compared with substring matching over the JSON events.
+
+    python benchmarks/search.py [number of events]
+"""
+import sys
+
+from _data import make_document, best_of, timed
+
+from open511.utils.search import SearchIndex
+
+QUERIES = ['highway 12', '"rue sherbrooke"', 'constr*', 'notre-dame papineau']
+
+def _substring(events, query):
+    words = query.replace('"', '').replace('*', '').lower().split()
+    results = []
+    for event in events:
+        text = ' '.join([event.get('headline', ''), event.get('description', '')] +
+            [road.get(k, '') for road in event.get('roads', []) for k in ('name', 'from', 'to')]).lower()
+        if all(w in text for w in words):
+            results.append(event)
+    return results
+
+def main(n_events=20000):
+    doc = make_document(n_events)
+    print("%d events" % n_events)
+    seconds, index = timed(SearchIndex, doc)
+    print("  build                     %8.3fs" % seconds)
+    print("  replace 100 events        %8.3fs" % timed(index.add, doc['events'][:100])[0])
+    for query in QUERIES:
+        print("  %-24s %6d results  index %.4fs  substring scan %.4fs (%d results)" % (
+            query, len(index.search(query, limit=None)), best_of(3, index.search, query),
+            best_of(3, _substring, doc['events'], query), len(_substring(doc['events'], query))))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,41 @@
+"""Times precomputing hourly active-event sets for a week with ActiveTimeline,
+against calling Schedule.active_within_range for every event and bucket.
+
+    python benchmarks/timeline.py [number of events]
+"""
+import datetime
+import sys
+
+import pytz
+
+from _data import make_document, best_of, timed
+
+from open511.utils.timeline import ActiveTimeline
+
+START = datetime.datetime(2013, 8, 1, tzinfo=pytz.utc)
+
+def _naive(timeline, n_buckets):
+    schedules = list(timeline._schedules.values())
+    return [
+        sum(1 for s in schedules if s.active_within_range(
+            START + datetime.timedelta(hours=i), START + datetime.timedelta(hours=i + 1)))
+        for i in range(n_buckets)
+    ]
+
+def main(n_events=5000):
+    doc = make_document(n_events)
+    print("%d events, hourly buckets for 7 days" % n_events)
+    seconds, timeline = timed(ActiveTimeline, doc, start=START)
+    print("  precompute                %8.3fs" % seconds)
+    when = START + datetime.timedelta(days=3, hours=5)
+    print("  lookup one hour           %8.6fs (%d active)" % (best_of(5, timeline.active, when), len(timeline.active(when))))
+    print("  counts for every hour     %8.4fs" % best_of(5, timeline.counts))
+    event = dict(doc['events'][0], schedule={'intervals': ['2013-08-02T08:00/2013-08-04T10:00']})
+    print("  update one event          %8.4fs" % best_of(5, timeline.update, [event]))
+    print("  advance one day           %8.3fs" % timed(timeline.advance, START + datetime.timedelta(days=1))[0])
+    # Scanning every schedule is slow; time a day's worth and scale it up
+    seconds, _ = timed(_naive, timeline, 24)
+    print("  per-bucket scan, 7 days   %8.3fs (estimated from one day)" % (seconds * 7))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,49 @@
+"""Compares validating a large Open511 XML document whole and with
+validate_stream, in time and peak memory. Generating the document and each
+validation run in their own processes, so that peak memory can be measured
+(Unix only).
+
+    python benchmarks/validate_stream.py [number of events]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from lxml import etree
+
+from _data import make_document, timed
+
+from open511.converter import compiled_json_doc_to_xml
+from open511.validator import validate, validate_stream
+
+def run(mode, path):
+    if mode == 'whole':
+        secs, _ = timed(lambda: validate(etree.parse(path).getroot()))
+    else:
+        secs, _ = timed(validate_stream, path)
+    # ru_maxrss is in kilobytes on Linux
+    print("  %-8s %.3fs  peak %d MB" % (mode, secs, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+
+def write(n_events, path):
+    doc = compiled_json_doc_to_xml(make_document(int(n_events)),
+        custom_namespace='http://validator.open511.org/custom-field')
+    etree.ElementTree(doc).write(path)
+
+def main(n_events=20000):
+    path = os.path.join(tempfile.mkdtemp(), 'events.xml')
+    subprocess.check_call([sys.executable, __file__, '--write', str(n_events), path])
+    print("%d events, %d bytes" % (n_events, os.path.getsize(path)))
+    for mode in ('whole', 'stream'):
+        subprocess.check_call([sys.executable, __file__, '--run', mode, path])
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--write']:
+        write(*sys.argv[2:])
+    elif sys.argv[1:2] == ['--run']:
+        run(*sys.argv[2:])
+    else:
+        main(*[int(a) for a in sys.argv[1:]])
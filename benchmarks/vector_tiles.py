@@ -0,0 +1,35 @@
+"""Times a full vector tile export, and an incremental update after a few
+events change.
+
+    python benchmarks/vector_tiles.py [number of events] [max zoom]
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+from _data import make_document, timed
+
+from open511.converter.mvt import write_vector_tiles
+
+
+def main(n_events=5000, maxzoom=10):
+    doc = make_document(n_events)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'events.mbtiles')
+    try:
+        elapsed, written = timed(write_vector_tiles, doc, path, maxzoom=maxzoom)
+        print("%d events, zooms 0-%d" % (n_events, maxzoom))
+        print("full export         %7.3fs  %6d tiles  %8d bytes" % (elapsed, len(written), os.path.getsize(path)))
+        for event in doc['events'][:10]:
+            event['headline'] += ' (updated)'
+        elapsed, written = timed(write_vector_tiles, doc, path, maxzoom=maxzoom)
+        print("10 events changed   %7.3fs  %6d tiles" % (elapsed, len(written)))
+        elapsed, written = timed(write_vector_tiles, doc, path, maxzoom=maxzoom)
+        print("nothing changed     %7.3fs  %6d tiles" % (elapsed, len(written)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,149 @@
+"""Load test for the web tools, with and without the worker process pool.
+
+Starts a stub upstream server holding a small and a large Open511 document,
+runs the web app against it in a subprocess, and fires a mix of /convert
+requests for both. Prints latency percentiles for each kind of request.
+
+    python benchmarks/webtools_load.py [seconds per mode] [concurrent clients]
+
+Requires the web interface's dependencies (see requirements.txt).
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+import requests
+
+from _data import make_document
+
+from open511.converter import open511_convert
+
+LARGE_FRACTION = 0.1
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_upstream(documents):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = documents.get(self.path)
+            self.send_response(200 if body else 404)
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def start_app(port, env):
+    env = dict(os.environ, **env)
+    code = ("from werkzeug.serving import run_simple; from open511.webtools import app; "
+        "run_simple('127.0.0.1', %d, app, threaded=True)" % port)
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get('http://127.0.0.1:%d/' % port, timeout=1)
+            return proc
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise Exception("Web app didn't start")
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def run_load(app_url, upstream_url, duration, clients):
+    results = {'small': [], 'large': []}
+    errors = {}
+    deadline = time.time() + duration
+    rnd = random.Random(1)
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while time.time() < deadline:
+            with lock:
+                kind = 'large' if rnd.random() < LARGE_FRACTION else 'small'
+            start = time.time()
+            resp = session.get(app_url + '/convert', params={
+                'url': upstream_url + '/' + kind, 'format': 'kml'})
+            elapsed = time.time() - start
+            with lock:
+                if resp.status_code == 200:
+                    results[kind].append(elapsed)
+                else:
+                    errors[resp.status_code] = errors.get(resp.status_code, 0) + 1
+            if resp.status_code == 503:
+                time.sleep(0.5)
+
+    with ThreadPoolExecutor(clients) as executor:
+        for _ in range(clients):
+            executor.submit(client)
+    return results, errors
+
+
+def main(duration=20, clients=16):
+    documents = {
+        '/small': open511_convert(make_document(5), 'json'),
+        '/large': open511_convert(make_document(5000), 'xml'),
+    }
+    upstream = start_upstream(documents)
+    upstream_url = 'http://127.0.0.1:%d' % upstream.server_address[1]
+    cpus = str(max(2, (os.cpu_count() or 2) - 1))
+
+    for mode, env in (('inline', {}), ('worker pool', {'OPEN511_WORKER_PROCESSES': cpus})):
+        port = _free_port()
+        app = start_app(port, env)
+        try:
+            results, errors = run_load('http://127.0.0.1:%d' % port, upstream_url, duration, clients)
+        finally:
+            app.terminate()
+            app.wait()
+        print("%s:" % mode)
+        for kind in ('small', 'large'):
+            latencies = results[kind]
+            print("  %-5s n=%-5d p50=%7.3fs p99=%7.3fs" % (
+                kind, len(latencies), percentile(latencies, 50), percentile(latencies, 99)))
+        if errors:
+            print("  errors: %s" % ', '.join('%s x%d' % e for e in sorted(errors.items())))
+
+    upstream.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
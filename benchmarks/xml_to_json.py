@@ -0,0 +1,23 @@
+"""Compares xml_to_json with the table-driven compiled_xml_to_json.
+
+    python benchmarks/xml_to_json.py [number of events]
+"""
+import sys
+
+from _data import make_xml_document, best_of
+
+from open511.converter import xml_to_json, compiled_xml_to_json
+
+
+def main(n_events=20000):
+    doc = make_xml_document(n_events)
+    assert xml_to_json(doc) == compiled_xml_to_json(doc)
+    recursive = best_of(3, xml_to_json, doc)
+    compiled = best_of(3, compiled_xml_to_json, doc)
+    print("%d events" % n_events)
+    print("xml_to_json          %7.3fs" % recursive)
+    print("compiled_xml_to_json %7.3fs  (%.1fx)" % (compiled, recursive / compiled))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -1,49 +1,84 @@
 from collections import namedtuple
-import json
 
 from lxml import etree
 
-from open511.converter.o5xml import (json_doc_to_xml, json_struct_to_xml,
-    geom_to_xml_element, json_link_key_to_xml_rel, geojson_to_gml)
-from open511.converter.o5json import xml_to_json, pluralize
+from open511.converter.o5xml import (json_doc_to_xml, compiled_json_doc_to_xml,
+    json_struct_to_xml, geom_to_xml_element, json_link_key_to_xml_rel, geojson_to_gml)
+from open511.converter.o5json import xml_to_json, compiled_xml_to_json, pluralize
 from open511.converter.atom import convert_to_atom
 from open511.converter.kml import convert_to_kml
+from open511.converter.geojson import convert_to_geojson, iter_geojson_features, serialize_geojson_lines
+from open511.converter.ical import convert_to_ical, serialize_ical
+from open511.utils import serialization
+from open511.utils.serialization import json_dumps, msgpack_dumps, cbor_dumps
 
 ConversionFormat = namedtuple('ConversionFormat', 'name full_name input_format func content_type serializer')
 
 noop = lambda x: x
-_serialize_xml = lambda x: etree.tostring(x, pretty_print=True)
+_serialize_xml = lambda x, compact=False: etree.tostring(x, pretty_print=not compact)
 
+# input_format is 'xml' or 'json', or a tuple of both if the converter
+# accepts either one directly
 FORMATS_LIST = [
     ConversionFormat('xml', 'XML', 'xml', noop, 'application/xml', _serialize_xml),
-    ConversionFormat('json', 'JSON', 'json', noop, 'application/json', lambda j: json.dumps(j, indent=4).encode('utf8')),
-    ConversionFormat('atom', 'Atom (GeoRSS, MASAS)', 'xml', convert_to_atom, 'application/atom+xml', _serialize_xml),
-    ConversionFormat('kml', 'KML', 'json', convert_to_kml, 'application/vnd.google-earth.kml+xml', _serialize_xml),
+    ConversionFormat('json', 'JSON', 'json', noop, 'application/json', json_dumps),
+    ConversionFormat('atom', 'Atom (GeoRSS, MASAS)', ('xml', 'json'), convert_to_atom, 'application/atom+xml', _serialize_xml),
+    ConversionFormat('kml', 'KML', ('json', 'xml'), convert_to_kml, 'application/vnd.google-earth.kml+xml', _serialize_xml),
+    ConversionFormat('geojson', 'GeoJSON', 'json', convert_to_geojson, 'application/geo+json', json_dumps),
+    # Serializes to an iterator of lines rather than a single string
+    ConversionFormat('geojsonl', 'Newline-delimited GeoJSON', 'json', iter_geojson_features,
+        'application/x-ndjson', serialize_geojson_lines),
+    ConversionFormat('ical', 'iCalendar', 'json', convert_to_ical, 'text/calendar', serialize_ical),
 ]
 
+# Formats whose output isn't text
+BINARY_FORMATS = set()
+
+# Binary versions of Open511 JSON, if the libraries are installed. For these,
+# compact output means deduplicating repeated strings with a string table.
+if serialization.msgpack is not None:
+    FORMATS_LIST.append(ConversionFormat('msgpack', 'MessagePack', 'json', noop, 'application/msgpack',
+        lambda obj, compact=False: msgpack_dumps(obj, string_table=compact)))
+    BINARY_FORMATS.add('msgpack')
+if serialization.cbor2 is not None:
+    FORMATS_LIST.append(ConversionFormat('cbor', 'CBOR', 'json', noop, 'application/cbor',
+        lambda obj, compact=False: cbor_dumps(obj, string_table=compact)))
+    BINARY_FORMATS.add('cbor')
+
 FORMATS = dict((cf.name, cf) for cf in FORMATS_LIST)
 
 def ensure_format(doc, format):
     """
     Ensures that the provided document is an lxml Element or json dict.
+
+    format is 'xml' or 'json', or a tuple of acceptable formats: a document
+    already in one of them is returned as is, and anything else is converted
+    to the first.
     """
-    assert format in ('xml', 'json')
+    formats = format if isinstance(format, tuple) else (format,)
+    assert all(f in ('xml', 'json') for f in formats)
     if getattr(doc, 'tag', None) == 'open511':
-        if format == 'json':
-            return xml_to_json(doc)
+        if 'xml' not in formats:
+            return compiled_xml_to_json(doc)
     elif isinstance(doc, dict) and 'meta' in doc:
-        if format == 'xml':
-            return json_doc_to_xml(doc)
+        if 'json' not in formats:
+            return compiled_json_doc_to_xml(doc)
     else:
         raise ValueError("Unrecognized input document")
     return doc
 
 
-def open511_convert(input_doc, output_format, serialize=True, **kwargs):
+def open511_convert(input_doc, output_format, serialize=True, compact=False, **kwargs):
     """
     Convert an Open511 document between formats.
     input_doc - either an lxml open511 Element or a deserialized JSON dict
     output_format - short string name of a valid output format, as listed above
+    compact - if serializing, omit indentation and other optional whitespace
+    Other keyword arguments are passed to the format's conversion function,
+    e.g. properties for the GeoJSON formats.
+
+    The serialized result is a bytestring, except for the streaming geojsonl
+    format, which gives an iterator of bytestrings.
     """
 
     try:
@@ -55,8 +90,8 @@ def open511_convert(input_doc, output_format, serialize=True, **kwargs):
 
     result = output_format_info.func(input_doc, **kwargs)
     if serialize:
-        result = output_format_info.serializer(result)
+        result = output_format_info.serializer(result, compact=compact)
     return result
 
 # Silence warnings
-geom_to_xml_element, json_struct_to_xml, pluralize, json_link_key_to_xml_rel, geojson_to_gml
+geom_to_xml_element, json_struct_to_xml, pluralize, json_link_key_to_xml_rel, geojson_to_gml, json_doc_to_xml, xml_to_json
@@ -0,0 +1,195 @@
+"""
+Flattens Open511 events into Apache Arrow record batches, one row per event,
+and writes them to Parquet for analytics tools (pandas, DuckDB, Spark...).
+
+    write_parquet(['bc.xml', 'quebec.json'], 'events.parquet')
+
+Requires the pyarrow package.
+"""
+try:
+    unicode
+except NameError:
+    unicode = str
+
+import pytz
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from open511.converter.o5json import compiled_xml_to_json
+from open511.utils.geometry import to_wkb
+from open511.utils.input import load_path
+from open511.utils.schedule import text_to_date, text_to_datetime
+from open511.utils.serialization import json_dumps
+from open511.utils.timezone import localize, parse_datetime
+
+# Number of events in each record batch (and so in each Parquet row group)
+BATCH_SIZE = 10000
+
+# Columns with a small set of repeated values, dictionary-encoded in Arrow and Parquet
+DICTIONARY_COLUMNS = ('source', 'jurisdiction_url', 'status', 'event_type', 'severity',
+    'certainty', 'timezone', 'geometry_type')
+
+_ROAD_FIELDS = ('name', 'from', 'to', 'direction', 'state')
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Arrow and Parquet export require the pyarrow package")
+
+def event_schema():
+    """The pyarrow Schema of the record batches produced here."""
+    _require_pyarrow()
+    timestamp = pa.timestamp('us', tz='UTC')
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        ('id', pa.string()),
+        ('source', dictionary),
+        ('jurisdiction_url', dictionary),
+        ('headline', pa.string()),
+        ('description', pa.string()),
+        ('status', dictionary),
+        ('event_type', dictionary),
+        ('event_subtypes', pa.list_(pa.string())),
+        ('severity', dictionary),
+        ('certainty', dictionary),
+        ('created', timestamp),
+        ('updated', timestamp),
+        ('timezone', dictionary),
+        ('roads', pa.list_(pa.struct([(f, pa.string()) for f in _ROAD_FIELDS]))),
+        ('geometry_type', dictionary),
+        ('geometry', pa.binary()),
+        ('schedule_start_date', pa.date32()),
+        ('schedule_end_date', pa.date32()),
+        ('schedule_intervals', pa.list_(pa.struct([('start', timestamp), ('end', timestamp)]))),
+        ('schedule', pa.string()),
+    ]
+    return pa.schema([pa.field(name, t) for name, t in fields])
+
+def _timestamp(value):
+    if not value:
+        return None
+    dt = parse_datetime(value)
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(pytz.utc)
+    return dt
+
+def _schedule_columns(schedule, tz):
+    """Returns (start_date, end_date, intervals) for a JSON schedule.
+
+    The dates are in the schedule's timezone, whatever the kind of schedule.
+    intervals lists the explicit intervals of an intervals-style schedule as
+    UTC datetimes; recurring schedules aren't expanded, since they can be
+    open-ended, and are only summarized by their first and last dates."""
+    if not schedule:
+        return None, None, None
+    if 'intervals' in schedule:
+        periods = []
+        for interval in schedule['intervals']:
+            start, _, end = interval.partition('/')
+            periods.append((text_to_datetime(start), text_to_datetime(end) if end else None))
+        intervals = [{
+            'start': localize(start, tz).astimezone(pytz.utc),
+            'end': localize(end, tz).astimezone(pytz.utc) if end is not None else None
+        } for start, end in periods]
+        if not periods:
+            return None, None, intervals
+        return (min(start for start, _ in periods).date(),
+            None if any(end is None for _, end in periods) else max(end for _, end in periods).date(),
+            intervals)
+    components = schedule.get('recurring_schedules', [])
+    start_dates = [text_to_date(c.get('start_date')) for c in components]
+    end_dates = [text_to_date(c.get('end_date')) for c in components]
+    return (
+        min(start_dates) if start_dates and None not in start_dates else None,
+        max(end_dates) if end_dates and None not in end_dates else None,
+        None
+    )
+
+def events_to_record_batch(doc, source=None, default_timezone='UTC'):
+    """Converts the events in an Open511 document, either an lxml Element or a
+    JSON dict, to a pyarrow RecordBatch with the schema from event_schema().
+
+    source is stored in each row's source column, e.g. the filename.
+    default_timezone is used to interpret the schedules of events without
+    a timezone field."""
+    _require_pyarrow()
+    if getattr(doc, 'tag', None) is not None:
+        doc = compiled_xml_to_json(doc)
+    schema = event_schema()
+    columns = dict((name, []) for name in schema.names)
+    timezones = {}
+    for event in doc.get('events', []):
+        for name in ('id', 'jurisdiction_url', 'headline', 'description', 'status',
+                'event_type', 'severity', 'certainty', 'timezone'):
+            columns[name].append(event.get(name))
+        columns['source'].append(source)
+        columns['event_subtypes'].append(event.get('event_subtypes'))
+        columns['created'].append(_timestamp(event.get('created')))
+        columns['updated'].append(_timestamp(event.get('updated')))
+        roads = event.get('roads')
+        columns['roads'].append([dict((f, road.get(f)) for f in _ROAD_FIELDS) for road in roads]
+            if roads is not None else None)
+        geography = event.get('geography')
+        columns['geometry_type'].append(geography['type'] if geography else None)
+        columns['geometry'].append(to_wkb(geography) if geography else None)
+
+        tz_name = event.get('timezone') or default_timezone
+        tz = timezones.get(tz_name)
+        if tz is None:
+            tz = timezones[tz_name] = pytz.timezone(tz_name)
+        schedule = event.get('schedule')
+        start_date, end_date, intervals = _schedule_columns(schedule, tz)
+        columns['schedule_start_date'].append(start_date)
+        columns['schedule_end_date'].append(end_date)
+        columns['schedule_intervals'].append(intervals)
+        columns['schedule'].append(json_dumps(schedule, compact=True).decode('utf8') if schedule else None)
+
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(columns[field.name], pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _split(doc, batch_size):
+    if getattr(doc, 'tag', None) is not None:
+        doc = compiled_xml_to_json(doc)
+    events = doc.get('events', [])
+    for i in range(0, max(len(events), 1), batch_size):
+        yield dict(doc, events=events[i:i + batch_size])
+
+def iter_record_batches(sources, batch_size=BATCH_SIZE, default_timezone='UTC'):
+    """Yields a RecordBatch for every batch_size events in the given sources.
+
+    Each source is either a path or URL, loaded with load_path, or an already
+    loaded Open511 document. Only one source is held in memory at a time."""
+    for source in sources:
+        if isinstance(source, (str, unicode)):
+            doc, _ = load_path(source)
+            name = source
+        else:
+            doc = source
+            name = None
+        for chunk in _split(doc, batch_size):
+            if chunk['events']:
+                yield events_to_record_batch(chunk, source=name, default_timezone=default_timezone)
+
+def write_parquet(sources, path, batch_size=BATCH_SIZE, default_timezone='UTC', compression='zstd'):
+    """Writes the events from sources (see iter_record_batches) to a Parquet
+    file at path, with one row group per batch. Returns the number of events
+    written."""
+    _require_pyarrow()
+    count = 0
+    writer = pq.ParquetWriter(path, event_schema(), compression=compression,
+        use_dictionary=list(DICTIONARY_COLUMNS))
+    try:
+        for batch in iter_record_batches(sources, batch_size=batch_size, default_timezone=default_timezone):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    finally:
+        writer.close()
+    return count
@@ -1,4 +1,13 @@
+try:
+    unicode
+except NameError:
+    unicode = str
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import datetime
+import hashlib
+import os
 import re
 try:
     from urlparse import urljoin
@@ -9,53 +18,148 @@ from lxml import etree
 from lxml.builder import ElementMaker
 import pytz
 
-from open511.utils.schedule import Schedule
-from open511.utils.serialization import NS_ATOM, NS_AGE, NS_XHTML, NS_GEORSS, NS_GML, XML_LANG, XML_BASE
+from open511.utils.schedule import Schedule, NextIntervalCache
+from open511.utils.serialization import get_lang, json_dumps, json_loads, NS_ATOM, NS_AGE, NS_FH, NS_XHTML, NS_GEORSS, NS_GML, XML_LANG, XML_BASE
 from open511.utils.timezone import now
 
 MASAS_EFFECTIVE = '{masas:experimental:time}effective'
 
-def _get_lang(tag):
-    if tag is None:
-        return None
-    lang = tag.get(XML_LANG)
-    return lang if lang else _get_lang(tag.getparent())
+# With include_expires and processes, feeds with at least this many events
+# compute their next intervals in a pool of worker processes
+PARALLEL_MIN_EVENTS = 5000
 
-def _el_to_html(source_el):
+def _text_to_html(text, lang):
     div = etree.Element('{%s}div' % NS_XHTML)
-    lang = _get_lang(source_el)
-    for graf in re.split(r'\n+', source_el.text):
+    for graf in re.split(r'\n+', text):
         p = etree.Element('{%s}div' % NS_XHTML)
         p.set(XML_LANG, lang)
         p.text = graf
         div.append(p)
     return div
 
-def convert_to_atom(input, feed_url="http://example.org/open511-feed", feed_title="Open511 Example Feed",
-        include_expires=False, default_timezone_name='UTC'):
+def _el_to_html(source_el):
+    return _text_to_html(source_el.text, get_lang(source_el))
+
+# The language json_doc_to_xml would assign to JSON text
+_JSON_LANG = 'en'
+
+def _xml_event_fields(event, base_url):
+    """Extracts what convert_to_atom needs from an XML <event>."""
+    return dict(
+        id_url=urljoin(base_url, event.xpath('link[@rel="self"]/@href')[0]),
+        status=event.findtext('status'),
+        timezone=event.findtext('timezone'),
+        schedule_key=lambda: ('xml', etree.tostring(event.find('schedule'))),
+        schedule=lambda tz: Schedule.from_element(event.find('schedule'), tz),
+        severity=event.findtext('severity'),
+        event_type=event.findtext('event_type'),
+        id=event.findtext('id'),
+        updated=event.findtext('updated'),
+        certainty=event.findtext('certainty'),
+        headlines=[_el_to_html(headline) for headline in event.xpath('headline')],
+        descriptions=[_el_to_html(description) for description in event.xpath('description')],
+        georss=lambda: _gml_to_georss(event.xpath('geography')[0][0])
+    )
+
+def _json_text(value):
+    return value if value is None else unicode(value)
+
+def _json_event_fields(event, base_url):
+    """Extracts what convert_to_atom needs from a JSON event."""
+    return dict(
+        id_url=urljoin(base_url, event['url']),
+        status=_json_text(event.get('status')),
+        timezone=_json_text(event.get('timezone')),
+        schedule_key=lambda: ('json', json_dumps(event['schedule'], compact=True)),
+        schedule=lambda tz: Schedule.from_json(event['schedule'], tz),
+        severity=_json_text(event.get('severity')),
+        event_type=_json_text(event.get('event_type')),
+        id=_json_text(event.get('id')),
+        updated=_json_text(event.get('updated')),
+        certainty=_json_text(event.get('certainty')),
+        headlines=[_text_to_html(unicode(event['headline']), _JSON_LANG)] if 'headline' in event else [],
+        descriptions=[_text_to_html(unicode(event['description']), _JSON_LANG)] if 'description' in event else [],
+        georss=lambda: _geojson_to_georss(event['geography'])
+    )
+
+def _schedule_from_key(schedule_key, tz):
+    source_format, content = schedule_key
+    if source_format == 'xml':
+        return Schedule.from_element(etree.fromstring(content), tz)
+    return Schedule.from_json(json_loads(content), tz)
+
+def _next_intervals(keys, timestamp):
+    """Returns next_interval(timestamp) for each (schedule key, timezone name)
+    in keys. Runs in the worker processes used for large feeds."""
+    return [_schedule_from_key(schedule_key, pytz.timezone(tz_name)).next_interval(timestamp)
+        for schedule_key, tz_name in keys]
+
+def _fill_next_intervals(events, timestamp, cache, processes, default_timezone_name):
+    """Computes every distinct next interval in events in parallel, and stores
+    them in cache."""
+    keys = []
+    seen = set()
+    for event in events:
+        key = (event['schedule_key'](), event['timezone'] or default_timezone_name)
+        if key not in seen and key + (timestamp,) not in cache:
+            seen.add(key)
+            keys.append(key)
+    chunk_size = max(1, len(keys) // (processes * 4))
+    chunks = [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+    with ProcessPoolExecutor(processes) as executor:
+        for chunk, periods in zip(chunks, executor.map(_next_intervals, chunks, [timestamp] * len(chunks))):
+            for key, period in zip(chunk, periods):
+                cache.set(key + (timestamp,), period)
 
-    A = ElementMaker(namespace=NS_ATOM, nsmap={None: NS_ATOM, 'html': NS_XHTML, 'georss': NS_GEORSS})
-    feed = A('feed',
+_A = ElementMaker(namespace=NS_ATOM, nsmap={None: NS_ATOM, 'html': NS_XHTML, 'georss': NS_GEORSS})
+
+def _feed_element(feed_url, feed_title, self_url=None):
+    A = _A
+    return A('feed',
         A('id', feed_url),
-        A('link', href=feed_url, rel='self'),
+        A('link', href=self_url or feed_url, rel='self'),
         A('title', feed_title, type='text'),
         A('updated', datetime.datetime.utcnow().isoformat() + 'Z')
     )
 
-    base_url = input.get(XML_BASE, feed_url)
+def _atom_entries(input, feed_url, include_expires=False, default_timezone_name='UTC', timestamp=None,
+        schedule_cache=None, processes=None):
+    """Yields an (event ID, Atom <entry>) tuple for each event in the input;
+    see convert_to_atom for the arguments."""
+    A = _A
+
+    if getattr(input, 'tag', None) is not None:
+        base_url = input.get(XML_BASE, feed_url)
+        events = (_xml_event_fields(event, base_url) for event in input.xpath('events/event'))
+    else:
+        events = (_json_event_fields(event, feed_url) for event in input.get('events', []))
 
-    for event in input.xpath('events/event'):
+    if include_expires:
+        if timestamp is None:
+            timestamp = now()
+        if schedule_cache is None:
+            schedule_cache = NextIntervalCache(maxsize=None)
+        timezones = {}
+        if processes:
+            events = list(events)
+            if len(events) >= PARALLEL_MIN_EVENTS:
+                _fill_next_intervals(events, timestamp, schedule_cache, processes, default_timezone_name)
+
+    for event in events:
         entry = A('entry',
-            A('id', urljoin(base_url, event.xpath('link[@rel="self"]/@href')[0]))
+            A('id', event['id_url'])
         )
-        active = event.findtext('status') == 'ACTIVE'
+        if event['updated']:
+            entry.append(A('updated', event['updated']))
+        active = event['status'] == 'ACTIVE'
 
         if include_expires:
-            tz = event.findtext('timezone')
-            tz = pytz.timezone(tz) if tz else pytz.timezone(default_timezone_name)
-            schedule = Schedule.from_element(event.find('schedules'), tz)
-            timestamp = now()
-            next_period = schedule.next_interval(timestamp)
+            tz_name = event['timezone'] or default_timezone_name
+            tz = timezones.get(tz_name)
+            if tz is None:
+                tz = timezones[tz_name] = pytz.timezone(tz_name)
+            next_period = schedule_cache.next_interval(event['schedule_key'](), tz_name, timestamp,
+                lambda: event['schedule'](tz))
             if next_period is None:
                 active = False
             else:
@@ -64,7 +168,7 @@ def convert_to_atom(input, feed_url="http://example.org/open511-feed", feed_titl
                     effective = etree.Element(MASAS_EFFECTIVE)
                     effective.text = next_period.start.isoformat()
                     entry.append(effective)
-                if next_period.end - timestamp < datetime.timedelta(days=14):
+                if next_period.end is not None and next_period.end - timestamp < datetime.timedelta(days=14):
                     expires = etree.Element('{%s}expires' % NS_AGE)
                     expires.text = next_period.end.isoformat()
                     entry.append(expires)
@@ -74,35 +178,192 @@ def convert_to_atom(input, feed_url="http://example.org/open511-feed", feed_titl
             A('category', label='Status', scheme='masas:category:status', 
                 term='Actual' if active else 'Draft'),
             A('category', label='Severity', scheme='masas:category:severity',
-                term=_cap_severity(event.findtext('severity'))),
+                term=_cap_severity(event['severity'])),
             A('category', label='Category', scheme='masas:category:category',
-                term=_cap_category(event.findtext('event_type'))),
+                term=_cap_category(event['event_type'])),
             A('category', label='Open511 ID', scheme='open511:event:id',
-                term=event.findtext('id'))
+                term=event['id'])
         ])
 
-        if event.xpath('certainty'):
+        if event['certainty'] is not None:
             entry.append(A('category', label='Certainty', scheme='masas:category:certainty',
-                term=event.findtext('certainty').title()))
+                term=event['certainty'].title()))
         
         title = A('title', type='xhtml')
-        for headline in event.xpath('headline'):
-            title.append(_el_to_html(headline))
+        title.extend(event['headlines'])
         entry.append(title)
 
-        if event.xpath('description'):
+        if event['descriptions']:
             content = A('content', type='xhtml')
-            for description in event.xpath('description'):
-                # FIXME HTML conversion?
-                content.append(_el_to_html(description))
+            # FIXME HTML conversion?
+            content.extend(event['descriptions'])
             entry.append(content)
 
-        entry.append(_gml_to_georss(event.xpath('geography')[0][0]))
+        entry.append(event['georss']())
 
-        feed.append(entry)
+        yield event['id'], entry
 
+def convert_to_atom(input, feed_url="http://example.org/open511-feed", feed_title="Open511 Example Feed",
+        include_expires=False, default_timezone_name='UTC', timestamp=None, schedule_cache=None,
+        processes=None):
+    """Converts an Open511 document to a MASAS-compatible Atom feed. The input can
+    be either an lxml Element or a JSON dict.
+
+    With include_expires, each event's next interval is computed relative to
+    timestamp (default: now), and events with identical schedules share one
+    computation. Pass a NextIntervalCache as schedule_cache to share that work
+    between feeds generated for the same timestamp, and a number of processes
+    to spread it over worker processes for large feeds."""
+    feed = _feed_element(feed_url, feed_title)
+    feed.extend(entry for _, entry in _atom_entries(input, feed_url, include_expires=include_expires,
+        default_timezone_name=default_timezone_name, timestamp=timestamp,
+        schedule_cache=schedule_cache, processes=processes))
     return feed
 
+def convert_to_paged_atom(input, page_size=500, feed_url="http://example.org/open511-feed",
+        feed_title="Open511 Example Feed", page_url=None, **kwargs):
+    """Converts an Open511 document to an RFC 5005 paged Atom feed: a list of
+    <feed> Elements with at most page_size entries each, linked with first,
+    last, next and previous links.
+
+    page_url is a function returning the URL for a 1-based page number; by
+    default the first page is at feed_url and the others at feed_url?page=N.
+    Other arguments are as for convert_to_atom."""
+    if page_url is None:
+        page_url = lambda n: feed_url if n == 1 else '%s%spage=%d' % (
+            feed_url, '&' if '?' in feed_url else '?', n)
+
+    pages = []
+    page = None
+    for _, entry in _atom_entries(input, feed_url, **kwargs):
+        if page is None or len(page) - _FEED_HEADER_LENGTH >= page_size:
+            page = _feed_element(feed_url, feed_title, self_url=page_url(len(pages) + 1))
+            pages.append(page)
+        page.append(entry)
+    if not pages:
+        pages.append(_feed_element(feed_url, feed_title))
+
+    for n, page in enumerate(pages, start=1):
+        links = [('first', 1), ('last', len(pages))]
+        if n > 1:
+            links.append(('previous', n - 1))
+        if n < len(pages):
+            links.append(('next', n + 1))
+        for i, (rel, target) in enumerate(links):
+            page.insert(_FEED_HEADER_LENGTH + i, _A('link', href=page_url(target), rel=rel))
+    return pages
+
+# The number of children of a new _feed_element
+_FEED_HEADER_LENGTH = 4
+
+class AtomArchiveWriter(object):
+    """Maintains an RFC 5005 archived feed in a directory.
+
+    The directory holds a subscription document, current.xml, with the most
+    recently changed entries, and archive documents archive-1.xml,
+    archive-2.xml... with page_size entries each. Each call to update() adds
+    entries for new or changed events to the subscription document, and once
+    it holds more than page_size entries the oldest are moved to a new archive
+    document. Archive documents are written once and never modified, so
+    consumers can cache them indefinitely: they link back with prev-archive,
+    but not forward with next-archive, which would mean rewriting them.
+
+    feed_url is the URL the subscription document is published at; archive
+    documents are expected alongside it. Events that disappear from the input
+    aren't removed from the feed."""
+
+    CURRENT_FILENAME = 'current.xml'
+    ARCHIVE_FILENAME = 'archive-%d.xml'
+    STATE_FILENAME = 'state.json'
+
+    def __init__(self, directory, feed_url, page_size=500, feed_title="Open511 Example Feed"):
+        self.directory = directory
+        self.feed_url = feed_url
+        self.page_size = page_size
+        self.feed_title = feed_title
+
+        # The number of archive documents already written. Taken from the
+        # files themselves, so that an archive can never be overwritten
+        self.archive_count = 0
+        while os.path.exists(self._path(self.ARCHIVE_FILENAME % (self.archive_count + 1))):
+            self.archive_count += 1
+
+        # Event ID -> digest of the entry we last published for it
+        self.versions = {}
+        if os.path.exists(self._path(self.STATE_FILENAME)):
+            with open(self._path(self.STATE_FILENAME), 'rb') as f:
+                self.versions = json_loads(f.read())['versions']
+
+        # Event ID -> entry, for the subscription document, oldest first
+        self.current = OrderedDict()
+        if os.path.exists(self._path(self.CURRENT_FILENAME)):
+            current = etree.parse(self._path(self.CURRENT_FILENAME)).getroot()
+            for entry in current.iterchildren('{%s}entry' % NS_ATOM):
+                event_id = entry.xpath('atom:category[@scheme="open511:event:id"]/@term',
+                    namespaces={'atom': NS_ATOM})[0]
+                self.current[event_id] = entry
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _url(self, filename):
+        return urljoin(self.feed_url, filename)
+
+    def _write(self, filename, content):
+        # Write to a temporary file first, so that readers never see a partial document
+        path = self._path(filename)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        getattr(os, 'replace', os.rename)(path + '.tmp', path)
+
+    def _feed(self, entries, archive_number=None):
+        """Serializes the subscription document, or the given archive document."""
+        if archive_number is None:
+            feed = _feed_element(self.feed_url, self.feed_title)
+            previous = self.archive_count
+        else:
+            feed = _feed_element(self.feed_url, self.feed_title,
+                self_url=self._url(self.ARCHIVE_FILENAME % archive_number))
+            feed.append(_A('link', href=self.feed_url, rel='current'))
+            feed.append(etree.Element('{%s}archive' % NS_FH, nsmap={'fh': NS_FH}))
+            previous = archive_number - 1
+        if previous:
+            feed.append(_A('link', rel='prev-archive', href=self._url(self.ARCHIVE_FILENAME % previous)))
+        feed.extend(entries)
+        return etree.tostring(feed, xml_declaration=True, encoding='utf-8')
+
+    def update(self, input, **kwargs):
+        """Adds entries for the events in an Open511 document that are new or
+        have changed since the last update, and writes any documents that
+        changed. Other arguments are as for convert_to_atom.
+
+        Returns a list of the filenames written."""
+        written = []
+        changed = False
+        for event_id, entry in _atom_entries(input, self.feed_url, **kwargs):
+            version = hashlib.sha1(etree.tostring(entry)).hexdigest()
+            if self.versions.get(event_id) == version:
+                continue
+            self.versions[event_id] = version
+            self.current.pop(event_id, None)
+            self.current[event_id] = entry
+            changed = True
+
+        if not changed:
+            return written
+
+        while len(self.current) > self.page_size:
+            entries = [self.current.popitem(last=False)[1] for _ in range(self.page_size)]
+            self.archive_count += 1
+            filename = self.ARCHIVE_FILENAME % self.archive_count
+            self._write(filename, self._feed(entries, archive_number=self.archive_count))
+            written.append(filename)
+
+        self._write(self.CURRENT_FILENAME, self._feed(self.current.values()))
+        written.append(self.CURRENT_FILENAME)
+        self._write(self.STATE_FILENAME, json_dumps({'versions': self.versions}))
+        return written
+
 def _gml_to_georss(gml):
     gml_name = gml.tag.partition('}')[2]
     name = '{%s}' % NS_GEORSS
@@ -119,6 +380,22 @@ def _gml_to_georss(gml):
     el.text = coords
     return el
 
+def _geojson_to_georss(geom):
+    # GeoRSS, like GML, puts latitude first
+    name = '{%s}' % NS_GEORSS
+    if geom['type'] == 'Point':
+        name += 'point'
+        coords = '%s %s' % (geom['coordinates'][1], geom['coordinates'][0])
+    elif geom['type'] == 'LineString':
+        name += 'line'
+        coords = ' '.join('%s %s' % (c[1], c[0]) for c in geom['coordinates'])
+    else:
+        # TODO split multi geometries
+        raise NotImplementedError("Cannot convert %s to GeoRSS" % geom['type'])
+    el = etree.Element(name)
+    el.text = coords
+    return el
+
 def _cap_severity(sev):
     return 'Severe' if sev == 'MAJOR' else sev.title()
 
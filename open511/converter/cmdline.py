@@ -2,7 +2,8 @@ import argparse
 import logging
 import sys
 
-from open511.converter import open511_convert, FORMATS_LIST
+from open511.converter import open511_convert, FORMATS_LIST, BINARY_FORMATS
+from open511.converter.atom import PARALLEL_MIN_EVENTS
 from open511.utils.input import load_path
 
 def convert_cmdline():
@@ -10,17 +11,54 @@ def convert_cmdline():
     parser = argparse.ArgumentParser(description='Convert an Open511 document to another format.')
     parser.add_argument('-f', '--format', type=str,
         help='Target format: ' + ', '.join(f.name for f in FORMATS_LIST))
+    parser.add_argument('--compact', action='store_true',
+        help="Don't indent the output; for msgpack and cbor, deduplicate repeated strings")
+    parser.add_argument('--properties', type=str,
+        help="For GeoJSON output, a comma-separated list of the event fields to include as properties")
+    parser.add_argument('--expires', action='store_true',
+        help="For Atom output, add when each event next takes effect and expires")
+    parser.add_argument('--processes', type=int,
+        help="With --expires, compute the events' next intervals in this many worker processes "
+            "(for feeds of at least %d events)" % PARALLEL_MIN_EVENTS)
     parser.add_argument('source', metavar='DOC', type=str,
         help='Document to validate: path, URL, or - to read from stdin')
     arguments = parser.parse_args()
+    if arguments.processes and not arguments.expires:
+        parser.error("--processes only applies with --expires")
     obj, obj_type = load_path(arguments.source)
     if arguments.format:
         output_format = arguments.format
     else:
         output_format = 'xml' if obj_type == 'json' else 'json'
-    result = open511_convert(obj, output_format, serialize=True)
-    stdout = sys.stdout
-    if hasattr(stdout, 'detach'):
-        stdout = stdout.detach()
-    stdout.write(result)
-    sys.stdout.write("\n")
+    kwargs = {}
+    if arguments.properties is not None:
+        kwargs['properties'] = [p for p in arguments.properties.split(',') if p]
+    if arguments.expires:
+        kwargs['include_expires'] = True
+        if arguments.processes:
+            kwargs['processes'] = arguments.processes
+    result = open511_convert(obj, output_format, serialize=True, compact=arguments.compact, **kwargs)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    if isinstance(result, bytes):
+        stdout.write(result)
+        if output_format not in BINARY_FORMATS:
+            stdout.write(b"\n")
+    else:
+        # Streaming formats give an iterator of chunks
+        for chunk in result:
+            stdout.write(chunk)
+    stdout.flush()
+
+def parquet_cmdline():
+    from open511.converter.arrow import write_parquet
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description='Write the events in Open511 documents to a Parquet file.')
+    parser.add_argument('-o', '--output', type=str, required=True,
+        help='Path of the Parquet file to write')
+    parser.add_argument('--timezone', type=str, default='UTC',
+        help='Timezone for the schedules of events without one')
+    parser.add_argument('sources', metavar='DOC', type=str, nargs='+',
+        help='Documents to read: paths, URLs, or - to read from stdin')
+    arguments = parser.parse_args()
+    count = write_parquet(arguments.sources, arguments.output, default_timezone=arguments.timezone)
+    sys.stderr.write("Wrote %d events to %s\n" % (count, arguments.output))
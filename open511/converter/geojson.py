@@ -0,0 +1,41 @@
+from open511.utils.serialization import json_dumps
+
+# The event fields included as Feature properties, unless others are requested
+DEFAULT_PROPERTIES = ('headline', 'status', 'severity', 'event_type', 'roads')
+
+def iter_geojson_features(input, properties=DEFAULT_PROPERTIES):
+    """Yields a GeoJSON Feature dict for each event in an Open511 JSON document.
+
+    properties is a list of the event fields to copy into each Feature's
+    properties, or None to copy all of them."""
+    for event in input.get('events', []):
+        if properties is None:
+            props = dict((k, v) for k, v in event.items() if k != 'geography')
+        else:
+            props = dict((k, event[k]) for k in properties if k in event)
+        feature = {
+            'type': 'Feature',
+            'geometry': event.get('geography'),
+            'properties': props
+        }
+        if 'id' in event:
+            feature['id'] = event['id']
+        yield feature
+
+def convert_to_geojson(input, properties=DEFAULT_PROPERTIES):
+    """Converts an Open511 JSON document to a GeoJSON FeatureCollection dict.
+    See iter_geojson_features for the arguments."""
+    return {
+        'type': 'FeatureCollection',
+        'features': list(iter_geojson_features(input, properties=properties))
+    }
+
+def serialize_geojson_lines(features, compact=False):
+    """Serializes an iterable of Features as newline-delimited GeoJSON, one
+    Feature per line. Returns an iterator of bytes, so that large collections
+    can be written out without holding the whole result in memory.
+
+    Lines are always compact, since a Feature can't span several; compact is
+    accepted like the other serializers' but has no effect."""
+    for feature in features:
+        yield json_dumps(feature, compact=True) + b'\n'
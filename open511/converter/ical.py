@@ -0,0 +1,243 @@
+"""
+Converts Open511 event schedules to iCalendar (RFC 5545).
+
+Recurring schedules become one VEVENT per <recurring_schedule>, with an RRULE
+for its weekdays and dates and an EXDATE for each exception date it would
+otherwise fall on; the periods given in exceptions go in one more VEVENT, as
+RDATEs. Interval schedules become a VEVENT per interval. So the output grows
+with the schedule's definition rather than with the number of days it covers.
+Times are local, with a VTIMEZONE for each timezone used.
+"""
+try:
+    unicode
+except NameError:
+    unicode = str
+
+from bisect import bisect_right
+import calendar
+import datetime
+
+import pytz
+
+from open511.utils.schedule import Schedule, _ScheduleIntervals
+from open511.utils.timezone import localize, now, parse_datetime
+
+PRODID = '-//Open511//open511 converter//EN'
+
+# Content lines are folded once they reach this many octets
+LINE_LENGTH = 75
+
+_WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+_STATUSES = {
+    'ACTIVE': 'CONFIRMED',
+    'ARCHIVED': 'CANCELLED',
+}
+
+# pytz lists the transitions of zones still observing DST up to this year
+_TRANSITIONS_END_YEAR = 2037
+
+def _escape(text):
+    return (unicode(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def _local(dt):
+    return dt.strftime('%Y%m%dT%H%M%S')
+
+def _utc(dt):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(pytz.utc)
+    return dt.strftime('%Y%m%dT%H%M%SZ')
+
+def _offset(delta):
+    seconds = int(delta.total_seconds())
+    sign = '-' if seconds < 0 else '+'
+    hours, rest = divmod(abs(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return '%s%02d%02d' % (sign, hours, minutes) + ('%02d' % seconds if seconds else '')
+
+def _observance(kind, onset, offset_from, offset_to, name, rrule=None):
+    lines = [
+        'BEGIN:' + kind,
+        'DTSTART:' + _local(onset),
+        'TZOFFSETFROM:' + _offset(offset_from),
+        'TZOFFSETTO:' + _offset(offset_to),
+    ]
+    if rrule:
+        lines.append('RRULE:' + rrule)
+    if name:
+        lines.append('TZNAME:' + _escape(name))
+    lines.append('END:' + kind)
+    return lines
+
+def _rule_day(onset):
+    """The BYDAY value for a yearly rule matching onset's weekday of the
+    month: e.g. 2SU for a second Sunday, -1SU for a last one."""
+    days_in_month = calendar.monthrange(onset.year, onset.month)[1]
+    nth = -1 if onset.day + 7 > days_in_month else (onset.day - 1) // 7 + 1
+    return '%d%s' % (nth, _WEEKDAYS[onset.weekday()])
+
+def vtimezone(tz, start):
+    """Returns the content lines of a VTIMEZONE describing a pytz timezone
+    from start, a naive UTC datetime, onward.
+
+    Transitions come from pytz's table; runs of them recurring on the same
+    weekday of the same month in consecutive years are written as one
+    observance with a yearly RRULE."""
+    lines = ['BEGIN:VTIMEZONE', 'TZID:' + tz.zone]
+    times = getattr(tz, '_utc_transition_times', None)
+    if not times or len(times) < 2:
+        epoch = datetime.datetime(1970, 1, 1)
+        offset = tz.utcoffset(epoch)
+        lines.extend(_observance('STANDARD', epoch, offset, offset, tz.tzname(epoch)))
+        lines.append('END:VTIMEZONE')
+        return lines
+
+    infos = tz._transition_info
+    groups = []
+    for i in range(max(bisect_right(times, start) - 1, 1), len(times)):
+        offset_to, dst, name = infos[i]
+        offset_from = infos[i - 1][0]
+        onset = times[i] + offset_from
+        key = ('DAYLIGHT' if dst else 'STANDARD', offset_from, offset_to, name,
+            onset.month, _rule_day(onset), onset.time())
+        # Groups are [key, first onset, last onset, last UTC transition time]
+        for group in groups:
+            if group[0] == key and group[2].year == onset.year - 1:
+                group[2] = onset
+                group[3] = times[i]
+                break
+        else:
+            groups.append([key, onset, onset, times[i]])
+
+    final_year = (times[-1] + infos[-1][0]).year
+    for key, first, last, last_utc in groups:
+        kind, offset_from, offset_to, name, month, day, _ = key
+        rrule = None
+        if last != first:
+            rrule = 'FREQ=YEARLY;BYMONTH=%d;BYDAY=%s' % (month, day)
+            if not (final_year >= _TRANSITIONS_END_YEAR and last.year >= final_year - 1):
+                rrule += ';UNTIL=' + _utc(last_utc)
+        lines.extend(_observance(kind, first, offset_from, offset_to, name, rrule))
+    lines.append('END:VTIMEZONE')
+    return lines
+
+def _recurring_vevents(schedule, tzid):
+    """Yields (DTSTART, DTEND, [extra lines]) for each VEVENT of a recurring schedule."""
+    tz = schedule.timezone
+    exception_dates = sorted(schedule.exception_dates)
+    for component in schedule._recurring_schedules:
+        weekdays = component.weekdays
+        if not weekdays or component.start_date is None:
+            continue
+        # DTSTART has to be the first occurrence of the rule
+        first = component.start_date
+        while first.weekday() not in weekdays:
+            first += datetime.timedelta(days=1)
+        if component.end_date is not None and first > component.end_date:
+            continue
+        period = component.period
+        if len(weekdays) == 7:
+            rrule = 'FREQ=DAILY'
+        else:
+            rrule = 'FREQ=WEEKLY;BYDAY=' + ','.join(_WEEKDAYS[d] for d in sorted(weekdays))
+        if component.end_date is not None:
+            rrule += ';UNTIL=' + _utc(localize(datetime.datetime.combine(component.end_date, period.start), tz))
+        extra = ['RRULE:' + rrule]
+        excluded = [
+            _local(datetime.datetime.combine(d, period.start)) for d in exception_dates
+            if d >= first and (component.end_date is None or d <= component.end_date) and d.weekday() in weekdays
+        ]
+        if excluded:
+            extra.append('EXDATE;TZID=%s:%s' % (tzid, ','.join(excluded)))
+        yield (datetime.datetime.combine(first, period.start), datetime.datetime.combine(first, period.end), extra)
+
+    exception_periods = schedule.exception_periods()
+    if exception_periods:
+        extra = []
+        if len(exception_periods) > 1:
+            extra.append('RDATE;TZID=%s;VALUE=PERIOD:%s' % (tzid, ','.join(
+                '%s/%s' % (_local(p.start), _local(p.end)) for p in exception_periods[1:])))
+        yield exception_periods[0].start, exception_periods[0].end, extra
+
+def _event_lines(event, schedule, tzid):
+    common = []
+    updated = parse_datetime(event['updated']) if event.get('updated') else None
+    if updated is None or updated.tzinfo is None:
+        updated = now()
+    common.append('DTSTAMP:' + _utc(updated))
+    if event.get('headline'):
+        common.append('SUMMARY:' + _escape(event['headline']))
+    if event.get('description'):
+        common.append('DESCRIPTION:' + _escape(event['description']))
+    roads = [road['name'] for road in event.get('roads', []) if road.get('name')]
+    if roads:
+        common.append('LOCATION:' + _escape(', '.join(roads)))
+    if event.get('event_type'):
+        common.append('CATEGORIES:' + _escape(event['event_type']))
+    if event.get('status') in _STATUSES:
+        common.append('STATUS:' + _STATUSES[event['status']])
+
+    if isinstance(schedule, _ScheduleIntervals):
+        # An open-ended interval has no DTEND
+        vevents = ((p.start, p.end, []) for p in schedule._intervals)
+    else:
+        vevents = _recurring_vevents(schedule, tzid)
+    lines = []
+    for i, (start, end, extra) in enumerate(vevents):
+        lines.extend(['BEGIN:VEVENT', 'UID:%s/%d' % (_escape(event['id']), i)] + common)
+        lines.append('DTSTART;TZID=%s:%s' % (tzid, _local(start)))
+        if end is not None:
+            lines.append('DTEND;TZID=%s:%s' % (tzid, _local(end)))
+        lines.extend(extra)
+        lines.append('END:VEVENT')
+    return lines
+
+def convert_to_ical(input, default_timezone='UTC'):
+    """Converts an Open511 JSON document to a list of iCalendar content lines,
+    unfolded; see serialize_ical. Events without a schedule are left out.
+    Schedules of events without a timezone field are interpreted in
+    default_timezone."""
+    timezones = {}
+    starts = {}
+    event_lines = []
+    for event in input.get('events', []):
+        if not event.get('schedule'):
+            continue
+        tz_name = event.get('timezone') or default_timezone
+        tz = timezones.get(tz_name)
+        if tz is None:
+            tz = timezones[tz_name] = pytz.timezone(tz_name)
+        schedule = Schedule.from_json(event['schedule'], tz)
+        start = schedule.bounds().start
+        if start is not None:
+            start = start.astimezone(pytz.utc).replace(tzinfo=None)
+            starts[tz_name] = min(start, starts.get(tz_name, start))
+        event_lines.extend(_event_lines(event, schedule, tz.zone))
+
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:' + PRODID, 'CALSCALE:GREGORIAN']
+    for tz_name in sorted(starts):
+        lines.extend(vtimezone(timezones[tz_name], starts[tz_name]))
+    lines.extend(event_lines)
+    lines.append('END:VCALENDAR')
+    return lines
+
+def _fold(line):
+    data = line.encode('utf8')
+    chunks = []
+    limit = LINE_LENGTH
+    while len(data) > limit:
+        cut = limit
+        # Don't split a UTF-8 sequence
+        while 0x80 <= bytearray(data[cut:cut + 1])[0] < 0xC0:
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+        # Continuation lines start with a space
+        limit = LINE_LENGTH - 1
+    chunks.append(data)
+    return b'\r\n '.join(chunks)
+
+def serialize_ical(lines, compact=False):
+    """Folds and joins iCalendar content lines into a UTF-8 bytestring."""
+    return b''.join(_fold(line) + b'\r\n' for line in lines)
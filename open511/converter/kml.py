@@ -1,35 +1,201 @@
+import os
+
+from lxml import etree
 from lxml.builder import ElementMaker
 
+from open511.converter.o5json import gml_to_geojson
+from open511.utils.geometry import bbox, simplify_geometry, vertex_count
 from open511.utils.serialization import NS_KML
 
 K = ElementMaker(namespace=NS_KML, nsmap={None: NS_KML})
 
+def _event_fields(input):
+    """Yields a dict of _placemark arguments for each event in the input."""
+    if getattr(input, 'tag', None) is not None:
+        return (_xml_event_fields(event) for event in input.xpath('events/event'))
+    return (_json_event_fields(event) for event in input.get('events', []))
+
 def convert_to_kml(input):
+    """Converts an Open511 document to KML. The input can be either an lxml
+    Element or a JSON dict."""
+    return K('kml', K('Document', *[_placemark(**fields) for fields in _event_fields(input)]))
+
+def _json_event_fields(event):
+    return dict(
+        headline=event.get('headline', ''),
+        description=event.get('description', ''),
+        geography=event['geography'],
+        severity=event.get('severity'),
+        status=event.get('status'),
+        event_type=event.get('event_type'),
+        detour=event.get('detour')
+    )
+
+def _xml_event_fields(event):
+    return dict(
+        headline=event.findtext('headline', ''),
+        description=event.findtext('description', ''),
+        geography=gml_to_geojson(event.find('geography')[0]),
+        severity=event.findtext('severity'),
+        status=event.findtext('status'),
+        event_type=event.findtext('event_type'),
+        detour=event.findtext('detour')
+    )
+
+# A tile's contents are loaded once its region takes up this many pixels on screen
+TILE_MIN_LOD_PIXELS = 128
+# Until a tile's region takes up this many pixels, its lines are drawn
+# simplified to about a pixel's accuracy
+SIMPLIFIED_MAX_LOD_PIXELS = 1024
+# Tiles are never smaller than this, in degrees (about 100 m), so that their
+# regions always cover enough of the screen to be loaded
+MIN_TILE_SIZE = 0.001
+
+def write_kml_tiles(input, directory, max_features=200, max_depth=16, root_filename='doc.kml'):
+    """Writes an Open511 document as a tree of KML files in a directory, so
+    that clients only load the events in the area they're looking at.
+
+    Events are stored in a loose quadtree: a tile is split into four once it
+    holds more than max_features events, unless it's already MIN_TILE_SIZE
+    or all its events are at the same spot; each event goes in the smallest
+    tile whose region (the tile's area, extended by half its size on every
+    side) fits it. Each tile file links to its children with <NetworkLink>s,
+    which clients load when the child's <Region> is big enough on screen.
+    Lines in a tile are drawn simplified until the tile is viewed up close.
+
+    Open root_filename to view the result. Returns a list of the filenames written."""
+    features = [(fields, bbox(fields['geography'])) for fields in _event_fields(input)]
+
+    if features:
+        west = min(f[1][0] for f in features)
+        south = min(f[1][1] for f in features)
+        east = max(f[1][2] for f in features)
+        north = max(f[1][3] for f in features)
+    else:
+        west = south = east = north = 0.0
+    size = max(east - west, north - south, MIN_TILE_SIZE)
+    center_x, center_y = (west + east) / 2.0, (south + north) / 2.0
+    root_bounds = (center_x - size / 2.0, center_y - size / 2.0, center_x + size / 2.0, center_y + size / 2.0)
+
+    tiles = {}
+    _build_tiles('', root_bounds, features, max_features, max_depth, tiles)
+
+    written = []
+    for key, (bounds, tile_features) in sorted(tiles.items()):
+        children = [key + q for q in '0123' if key + q in tiles]
+        doc = _tile_document(key, bounds, tile_features, [(child, tiles[child][0]) for child in children])
+        filename = _tile_filename(key, root_filename)
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(etree.tostring(K('kml', doc), xml_declaration=True, encoding='utf-8'))
+        written.append(filename)
+    return written
+
+def _tile_filename(key, root_filename):
+    return '%s.kml' % key if key else root_filename
+
+def _build_tiles(key, bounds, features, max_features, max_depth, tiles):
+    """Assigns features to tiles: fills the tiles dict with quadkey ->
+    (bounds, features) for this tile and its descendants."""
+    west, south, east, north = bounds
+    half = (east - west) / 2.0
+    # Events that all share a center would land in the same quadrant however
+    # far the tile was split
+    if (len(features) <= max_features or len(key) >= max_depth or half < MIN_TILE_SIZE
+            or len(set(_center(f[1]) for f in features)) == 1):
+        tiles[key] = (bounds, features)
+        return
+
+    mid_x, mid_y = west + half, south + half
+    here = []
+    quadrants = [[], [], [], []]
+    for feature in features:
+        f_west, f_south, f_east, f_north = feature[1]
+        if max(f_east - f_west, f_north - f_south) > half:
+            # Too big for a child tile's region
+            here.append(feature)
+        else:
+            # Quadrants are numbered NW, NE, SW, SE
+            center_x, center_y = _center(feature[1])
+            q = (1 if center_x >= mid_x else 0) + (2 if center_y < mid_y else 0)
+            quadrants[q].append(feature)
+
+    tiles[key] = (bounds, here)
+    child_bounds = [
+        (west, mid_y, mid_x, north), (mid_x, mid_y, east, north),
+        (west, south, mid_x, mid_y), (mid_x, south, east, mid_y),
+    ]
+    for q, quadrant_features in enumerate(quadrants):
+        if quadrant_features:
+            _build_tiles(key + str(q), child_bounds[q], quadrant_features, max_features, max_depth, tiles)
+
+def _center(bounds):
+    return (bounds[0] + bounds[2]) / 2.0, (bounds[1] + bounds[3]) / 2.0
+
+def _loose_bounds(bounds):
+    west, south, east, north = bounds
+    margin = (east - west) / 2.0
+    return (max(-180.0, west - margin), max(-90.0, south - margin),
+        min(180.0, east + margin), min(90.0, north + margin))
+
+def _region(bounds, min_lod_pixels, max_lod_pixels=-1):
+    west, south, east, north = _loose_bounds(bounds)
+    return K('Region',
+        K('LatLonAltBox', K('north', repr(north)), K('south', repr(south)),
+            K('east', repr(east)), K('west', repr(west))),
+        K('Lod', K('minLodPixels', str(min_lod_pixels)), K('maxLodPixels', str(max_lod_pixels)))
+    )
+
+def _tile_document(key, bounds, features, children):
+    doc = K('Document', K('name', 'Open511 tile %s' % key if key else 'Open511'))
+    if key:
+        # The root tile is always loaded
+        doc.append(_region(bounds, TILE_MIN_LOD_PIXELS))
+
+    tolerance = (bounds[2] - bounds[0]) / SIMPLIFIED_MAX_LOD_PIXELS
+    simplified = []
+    detailed = []
+    for fields, _ in features:
+        simple = simplify_geometry(fields['geography'], tolerance)
+        if vertex_count(simple) < vertex_count(fields['geography']):
+            simplified.append(_placemark(**dict(fields, geography=simple)))
+            detailed.append(_placemark(**fields))
+        else:
+            doc.append(_placemark(**fields))
+    if simplified:
+        doc.append(K('Folder', K('name', 'Simplified'),
+            _region(bounds, 0, SIMPLIFIED_MAX_LOD_PIXELS), *simplified))
+        doc.append(K('Folder', K('name', 'Detailed'),
+            _region(bounds, SIMPLIFIED_MAX_LOD_PIXELS), *detailed))
+
+    for child_key, child_bounds in children:
+        doc.append(K('NetworkLink',
+            K('name', child_key),
+            _region(child_bounds, TILE_MIN_LOD_PIXELS),
+            K('Link', K('href', _tile_filename(child_key, None)), K('viewRefreshMode', 'onRegion'))
+        ))
+    return doc
+
+def _placemark(headline, description, geography, severity, status, event_type, detour=None):
+    e = K('Placemark',
+        K('name', headline),
+        K('description', description),
+        _geojson_to_kml(geography)
+    )
+
+    data = {
+        'Severity': severity.title(),
+        'Status': status.title(),
+        'Type': event_type.title()
+    }
+    if detour is not None:
+        data['Detour'] = detour
+
+    if data:
+        e.append(K('ExtendedData', *[
+            K('Data', K('value', value), name=key) for key, value in data.items()
+        ]))
 
-    placemarks = []
-    for event in input.get('events', []):
-        e = K('Placemark',
-            K('name', event.get('headline', '')),
-            K('description', event.get('description', '')),
-            _geojson_to_kml(event['geography'])
-        )
-
-        data = {
-            'Severity': event.get('severity').title(),
-            'Status': event.get('status').title(),
-            'Type': event.get('event_type').title()
-        }
-        if 'detour' in event:
-            data['Detour'] = event['detour']
-
-        if data:
-            e.append(K('ExtendedData', *[
-                K('Data', K('value', value), name=key) for key, value in data.items()
-            ]))
-
-        placemarks.append(e)
-
-    return K('kml', K('Document', *placemarks))
+    return e
 
 def _geojson_to_kml(geog):
     t = geog['type']
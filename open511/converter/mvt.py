@@ -0,0 +1,616 @@
+"""
+Exports event geographies as Mapbox Vector Tiles (https://github.com/mapbox/vector-tile-spec),
+to a z/x/y directory or an MBTiles file.
+
+    write_vector_tiles(doc, 'tiles.mbtiles', maxzoom=12)
+
+Keeping the same VectorTileWriter (or the same output path) between runs
+regenerates only the tiles touched by events that were added, changed or
+removed since the last run.
+"""
+try:
+    unicode
+except NameError:
+    unicode = str
+
+try:
+    long
+except NameError:
+    long = int
+
+from collections import defaultdict
+import gzip
+import hashlib
+import io
+import math
+import os
+import sqlite3
+import struct
+
+from open511.converter.o5json import gml_to_geojson
+from open511.utils.geometry import bbox, simplify
+from open511.utils.serialization import json_dumps, json_loads
+
+DEFAULT_PROPERTIES = ('id', 'headline', 'status', 'severity', 'event_type')
+
+# Web Mercator doesn't reach the poles
+MAX_LATITUDE = 85.0511287798
+
+### Protocol buffer encoding, for the few message types in vector_tile.proto
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+def _bytes_field(field, data):
+    return _key(field, _LENGTH_DELIMITED) + _varint(len(data)) + data
+
+def _varint_field(field, n):
+    return _key(field, _VARINT) + _varint(n)
+
+def _packed_field(field, values):
+    return _bytes_field(field, b''.join(_varint(v) for v in values))
+
+def _encode_value(value):
+    """Encodes a property value as a vector_tile Value message."""
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    elif isinstance(value, (int, long)) and -2 ** 63 <= value < 2 ** 64:
+        if value >= 0:
+            return _varint_field(5, value)
+        return _varint_field(6, _zigzag(value))
+    elif isinstance(value, float):
+        return _key(3, _FIXED64) + struct.pack('<d', value)
+    if isinstance(value, bytes):
+        value = value.decode('utf8')
+    elif not isinstance(value, unicode):
+        # Lists and objects, e.g. roads, are stored as JSON
+        value = json_dumps(value, compact=True).decode('utf8')
+    return _bytes_field(1, value.encode('utf8'))
+
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+_POINT = 1
+_LINESTRING = 2
+_POLYGON = 3
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+def _encode_geometry(geom_type, parts):
+    """Returns the command integers for a geometry. parts is a list of
+    lists of integer (x, y) tile coordinates: one list of points for a
+    point geometry, or a list per line or polygon ring."""
+    commands = []
+    cx = cy = 0
+    if geom_type == _POINT:
+        parts = [parts]
+    for part in parts:
+        if geom_type == _POINT:
+            commands.append(_command(_MOVE_TO, len(part)))
+        for i, (x, y) in enumerate(part):
+            if geom_type != _POINT and i < 2:
+                commands.append(_command(_MOVE_TO, 1) if i == 0 else _command(_LINE_TO, len(part) - 1))
+            commands.append(_zigzag(x - cx))
+            commands.append(_zigzag(y - cy))
+            cx, cy = x, y
+        if geom_type == _POLYGON:
+            commands.append(_command(_CLOSE_PATH, 1))
+    return commands
+
+def encode_tile(layer_name, features, extent=4096):
+    """Encodes a single-layer vector tile. features is a list of
+    (geometry type, parts, properties dict) tuples; see _encode_geometry.
+    Returns the tile as bytes."""
+    keys = []
+    key_index = {}
+    values = []
+    value_index = {}
+    encoded_features = []
+    for geom_type, parts, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            value_key = (type(value), value) if isinstance(value, (unicode, int, float, bool)) else repr(value)
+            if value_key not in value_index:
+                value_index[value_key] = len(values)
+                values.append(_encode_value(value))
+            tags.append(key_index[key])
+            tags.append(value_index[value_key])
+        encoded_features.append(b''.join([
+            _packed_field(2, tags),
+            _varint_field(3, geom_type),
+            _packed_field(4, _encode_geometry(geom_type, parts))
+        ]))
+
+    layer = b''.join(
+        [_varint_field(15, 2), _bytes_field(1, layer_name.encode('utf8'))]
+        + [_bytes_field(2, f) for f in encoded_features]
+        + [_bytes_field(3, k.encode('utf8')) for k in keys]
+        + [_bytes_field(4, v) for v in values]
+        + [_varint_field(5, extent)]
+    )
+    return _bytes_field(3, layer)
+
+### Projection and clipping
+
+def _project(lon, lat):
+    """Converts a WGS84 position to Web Mercator, scaled to 0-1 on both axes,
+    with y increasing southwards."""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    sin_lat = math.sin(math.radians(lat))
+    return ((lon + 180.0) / 360.0,
+        0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi))
+
+def _project_geometry(geometry):
+    """Returns (geometry type, list of parts, exterior flags) for a GeoJSON
+    geometry, with coordinates projected by _project. Multi-geometries are
+    flattened; for polygons, the flags say which parts are exterior rings,
+    and for other types they're None."""
+    t = geometry['type']
+    coords = geometry['coordinates']
+    if t == 'Point':
+        return _POINT, [[_project(*coords[:2])]], None
+    elif t == 'MultiPoint':
+        return _POINT, [[_project(*c[:2]) for c in coords]], None
+    elif t == 'LineString':
+        return _LINESTRING, [[_project(*c[:2]) for c in coords]], None
+    elif t == 'MultiLineString':
+        return _LINESTRING, [[_project(*c[:2]) for c in line] for line in coords], None
+    elif t in ('Polygon', 'MultiPolygon'):
+        polygons = [coords] if t == 'Polygon' else coords
+        rings = [[_project(*c[:2]) for c in ring] for polygon in polygons for ring in polygon]
+        exteriors = [i == 0 for polygon in polygons for i in range(len(polygon))]
+        return _POLYGON, rings, exteriors
+    raise NotImplementedError("Can't make vector tiles from %s" % t)
+
+def _clip_segment(a, b, low, high):
+    """Liang-Barsky clipping of the segment a-b to the square low-high.
+    Returns the clipped (start, end), or None if it's entirely outside."""
+    x0, y0 = a
+    dx = b[0] - x0
+    dy = b[1] - y0
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, x0 - low), (dx, high - x0), (-dy, y0 - low), (dy, high - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+        else:
+            t = q / p
+            if p < 0:
+                if t > t1:
+                    return None
+                t0 = max(t0, t)
+            else:
+                if t < t0:
+                    return None
+                t1 = min(t1, t)
+    start = a if t0 == 0 else (x0 + t0 * dx, y0 + t0 * dy)
+    end = b if t1 == 1 else (x0 + t1 * dx, y0 + t1 * dy)
+    return start, end
+
+def _clip_line(line, low, high):
+    """Clips a line to a square, returning a list of the lines left."""
+    lines = []
+    current = []
+    for a, b in zip(line, line[1:]):
+        segment = _clip_segment(a, b, low, high)
+        if segment is None:
+            if current:
+                lines.append(current)
+                current = []
+            continue
+        start, end = segment
+        if current and current[-1] != start:
+            lines.append(current)
+            current = []
+        if not current:
+            current.append(start)
+        current.append(end)
+        if end != b:
+            lines.append(current)
+            current = []
+    if current:
+        lines.append(current)
+    return lines
+
+def _clip_ring(ring, low, high):
+    """Sutherland-Hodgman clipping of a polygon ring to a square."""
+    edges = (
+        (lambda p: p[0] >= low, lambda a, b: (low, a[1] + (b[1] - a[1]) * (low - a[0]) / (b[0] - a[0]))),
+        (lambda p: p[0] <= high, lambda a, b: (high, a[1] + (b[1] - a[1]) * (high - a[0]) / (b[0] - a[0]))),
+        (lambda p: p[1] >= low, lambda a, b: (a[0] + (b[0] - a[0]) * (low - a[1]) / (b[1] - a[1]), low)),
+        (lambda p: p[1] <= high, lambda a, b: (a[0] + (b[0] - a[0]) * (high - a[1]) / (b[1] - a[1]), high)),
+    )
+    points = ring[:-1] if ring[0] == ring[-1] else ring
+    for inside, intersection in edges:
+        if not points:
+            break
+        clipped = []
+        previous = points[-1]
+        for point in points:
+            if inside(point):
+                if not inside(previous):
+                    clipped.append(intersection(previous, point))
+                clipped.append(point)
+            elif inside(previous):
+                clipped.append(intersection(previous, point))
+            previous = point
+        points = clipped
+    return points
+
+def _quantize(points):
+    """Rounds to integer tile coordinates, dropping repeated points."""
+    result = []
+    for x, y in points:
+        point = (int(round(x)), int(round(y)))
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+def _ring_area(ring):
+    return sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(ring, ring[1:] + ring[:1]))
+
+def _tile_geometry(geom_type, parts, exteriors, zoom, x, y, extent, buffer):
+    """Transforms projected parts into the coordinates of tile zoom/x/y,
+    clipped to the tile plus buffer. Returns the list of parts, which is
+    empty if nothing is left."""
+    scale = (1 << zoom) * extent
+    origin_x = x * extent
+    origin_y = y * extent
+    low = -buffer
+    high = extent + buffer
+    transform = lambda part: [(px * scale - origin_x, py * scale - origin_y) for px, py in part]
+
+    if geom_type == _POINT:
+        return [p for p in _quantize(transform(parts[0])) if low <= p[0] <= high and low <= p[1] <= high]
+
+    result = []
+    keep_interiors = False
+    for i, part in enumerate(parts):
+        part = transform(part)
+        if geom_type == _LINESTRING:
+            for line in _clip_line(part, low, high):
+                line = _quantize(line)
+                if len(line) >= 2:
+                    result.append(line)
+            continue
+
+        exterior = exteriors[i]
+        if not exterior and not keep_interiors:
+            continue
+        ring = _quantize(_clip_ring(part, low, high))
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring.pop()
+        if len(ring) < 3 or _ring_area(ring) == 0:
+            if exterior:
+                # No polygon left, so no holes in it either
+                keep_interiors = False
+            continue
+        keep_interiors = keep_interiors or exterior
+        # Exterior rings wind clockwise in tile coordinates, which is a
+        # positive area since y points down; interior rings the other way
+        if (_ring_area(ring) > 0) != exterior:
+            ring.reverse()
+        result.append(ring)
+    return result
+
+def _tile_range(box, zoom, extent, buffer):
+    """Returns the (min x, min y, max x, max y) tile numbers at zoom that
+    a projected bounding box (plus buffer) touches."""
+    n = 1 << zoom
+    margin = float(buffer) / extent / n
+    clamp = lambda v: max(0, min(n - 1, int(math.floor(v * n))))
+    west, north = box[0] - margin, box[1] - margin
+    east, south = box[2] + margin, box[3] + margin
+    return clamp(west), clamp(north), clamp(east), clamp(south)
+
+### Events
+
+def _event_features(input, properties):
+    """Yields (event ID, GeoJSON geometry, properties dict) for each event
+    in a document, in either format."""
+    if getattr(input, 'tag', None) is not None:
+        for event in input.xpath('events/event'):
+            props = {}
+            for name in properties:
+                value = event.findtext(name)
+                if value is not None:
+                    props[name] = value
+            yield event.findtext('id'), gml_to_geojson(event.find('geography')[0]), props
+    else:
+        for event in input.get('events', []):
+            yield (event.get('id'), event['geography'],
+                dict((name, event[name]) for name in properties if name in event))
+
+class _Event(object):
+
+    def __init__(self, order, geometry, properties, settings):
+        self.order = order
+        self.geometry = geometry
+        self.properties = properties
+        # The writer's settings change how every event is drawn
+        self.digest = hashlib.sha1(json_dumps([settings, geometry, properties], compact=True)).hexdigest()
+        self._projected = None
+        self._simplified = {}
+
+    @property
+    def projected(self):
+        if self._projected is None:
+            self._projected = _project_geometry(self.geometry)
+        return self._projected
+
+    def at_zoom(self, zoom, extent):
+        """The projected geometry, simplified to within about a tile unit at zoom."""
+        if zoom not in self._simplified:
+            geom_type, parts, exteriors = self.projected
+            if geom_type != _POINT:
+                tolerance = 1.0 / ((1 << zoom) * extent)
+                parts = [simplify(part, tolerance) for part in parts]
+            self._simplified[zoom] = (geom_type, parts, exteriors)
+        return self._simplified[zoom]
+
+    def projected_bbox(self):
+        west, south, east, north = bbox(self.geometry)
+        x0, y0 = _project(west, north)
+        x1, y1 = _project(east, south)
+        return (x0, y0, x1, y1)
+
+class VectorTileWriter(object):
+    """Generates vector tiles for the events in Open511 documents.
+
+    store - a DirectoryTileStore or MBTilesStore
+    minzoom, maxzoom - the range of zoom levels to generate
+    properties - the event fields to include as feature attributes
+    layer_name - the name of the tiles' single layer
+    extent, buffer - the tile coordinate space, and how far beyond it
+        geometries are kept to avoid seams
+
+    The store remembers which tiles each event was drawn in, and a digest of
+    each event and the settings above, so that update() only regenerates
+    tiles whose events or settings changed. Events without an ID are known
+    by their content."""
+
+    def __init__(self, store, minzoom=0, maxzoom=14, properties=DEFAULT_PROPERTIES,
+            layer_name='events', extent=4096, buffer=64):
+        self.store = store
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+        self.properties = list(properties)
+        self.layer_name = layer_name
+        self.extent = extent
+        self.buffer = buffer
+
+    def _cover(self, event):
+        """All the tiles an event's bounding box touches."""
+        box = event.projected_bbox()
+        for zoom in range(self.minzoom, self.maxzoom + 1):
+            x0, y0, x1, y1 = _tile_range(box, zoom, self.extent, self.buffer)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    yield (zoom, x, y)
+
+    def update(self, input):
+        """Brings the tiles up to date with the events in an Open511 document
+        (an lxml Element or a JSON dict). Returns a sorted list of the
+        (zoom, x, y) tiles written or deleted."""
+        state = self.store.load_state()
+
+        settings = [self.layer_name, self.extent, self.buffer, self.minzoom, self.maxzoom]
+        events = {}
+        for order, (event_id, geometry, properties) in enumerate(_event_features(input, self.properties)):
+            event = _Event(order, geometry, properties, settings)
+            if event_id is None:
+                key = event_id = '#' + event.digest
+                copies = 1
+                while event_id in events:
+                    # Identical events are each drawn
+                    event_id = '%s/%d' % (key, copies)
+                    copies += 1
+            events[event_id] = event
+
+        dirty = set()
+        candidates = defaultdict(list)
+        changed = set()
+        for event_id, event in events.items():
+            previous = state.get(event_id)
+            if previous is not None and previous[0] == event.digest:
+                continue
+            changed.add(event_id)
+            if previous is not None:
+                dirty.update(tuple(t) for t in previous[1])
+            for tile in self._cover(event):
+                dirty.add(tile)
+                candidates[tile].append(event_id)
+        for event_id, (digest, tiles) in state.items():
+            if event_id not in events:
+                dirty.update(tuple(t) for t in tiles)
+
+        # Unchanged events only need drawing in the dirty tiles they were in before
+        for event_id, (digest, tiles) in state.items():
+            if event_id in events and event_id not in changed:
+                for tile in tiles:
+                    tile = tuple(tile)
+                    if tile in dirty:
+                        candidates[tile].append(event_id)
+
+        new_state = dict((event_id, state[event_id]) for event_id in events if event_id not in changed)
+        for event_id in changed:
+            new_state[event_id] = [events[event_id].digest, []]
+
+        for tile in sorted(dirty):
+            zoom, x, y = tile
+            features = []
+            for event_id in sorted(candidates.get(tile, ()), key=lambda e: events[e].order):
+                event = events[event_id]
+                geom_type, parts, exteriors = event.at_zoom(zoom, self.extent)
+                parts = _tile_geometry(geom_type, parts, exteriors, zoom, x, y, self.extent, self.buffer)
+                if parts:
+                    features.append((geom_type, parts, event.properties))
+                    if event_id in changed:
+                        new_state[event_id][1].append(list(tile))
+            if features:
+                self.store.put(zoom, x, y, encode_tile(self.layer_name, features, self.extent))
+            else:
+                self.store.delete(zoom, x, y)
+
+        self.store.save_state(new_state)
+        self.store.set_metadata(self._metadata(events))
+        return sorted(dirty)
+
+    def _metadata(self, events):
+        boxes = [bbox(e.geometry) for e in events.values()]
+        if boxes:
+            bounds = [min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes)]
+        else:
+            bounds = [-180.0, -MAX_LATITUDE, 180.0, MAX_LATITUDE]
+        return {
+            'name': self.layer_name,
+            'format': 'pbf',
+            'minzoom': self.minzoom,
+            'maxzoom': self.maxzoom,
+            'bounds': bounds,
+            'vector_layers': [{
+                'id': self.layer_name,
+                'fields': dict((name, 'String') for name in self.properties),
+                'minzoom': self.minzoom,
+                'maxzoom': self.maxzoom
+            }]
+        }
+
+### Storage
+
+class DirectoryTileStore(object):
+    """Stores tiles as uncompressed zoom/x/y.pbf files in a directory, with a
+    TileJSON-style metadata.json alongside."""
+
+    STATE_FILENAME = 'open511-tiles.json'
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _tile_path(self, zoom, x, y):
+        return os.path.join(self.path, str(zoom), str(x), '%d.pbf' % y)
+
+    def put(self, zoom, x, y, data):
+        path = self._tile_path(zoom, x, y)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def delete(self, zoom, x, y):
+        path = self._tile_path(zoom, x, y)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def load_state(self):
+        path = os.path.join(self.path, self.STATE_FILENAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'rb') as f:
+            return json_loads(f.read())
+
+    def save_state(self, state):
+        with open(os.path.join(self.path, self.STATE_FILENAME), 'wb') as f:
+            f.write(json_dumps(state, compact=True))
+
+    def set_metadata(self, metadata):
+        with open(os.path.join(self.path, 'metadata.json'), 'wb') as f:
+            f.write(json_dumps(dict(metadata, tilejson='2.2.0')))
+
+    def close(self):
+        pass
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+class MBTilesStore(object):
+    """Stores gzipped tiles in an MBTiles (SQLite) file. Call close() when done."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER,
+                tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+            CREATE TABLE IF NOT EXISTS open511_event_tiles (event_id TEXT PRIMARY KEY, digest TEXT,
+                tiles TEXT);
+        """)
+
+    def put(self, zoom, x, y, data):
+        # MBTiles numbers rows from the south
+        self.db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+            (zoom, x, (1 << zoom) - 1 - y, sqlite3.Binary(_gzip(data))))
+
+    def delete(self, zoom, x, y):
+        self.db.execute("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (zoom, x, (1 << zoom) - 1 - y))
+
+    def load_state(self):
+        return dict(
+            (event_id, [digest, json_loads(tiles)])
+            for event_id, digest, tiles in self.db.execute("SELECT event_id, digest, tiles FROM open511_event_tiles")
+        )
+
+    def save_state(self, state):
+        self.db.execute("DELETE FROM open511_event_tiles")
+        self.db.executemany("INSERT INTO open511_event_tiles VALUES (?, ?, ?)", [
+            (event_id, digest, json_dumps(tiles, compact=True).decode('utf8'))
+            for event_id, (digest, tiles) in state.items()
+        ])
+
+    def set_metadata(self, metadata):
+        metadata = dict(metadata)
+        rows = [
+            ('name', metadata['name']),
+            ('format', metadata['format']),
+            ('minzoom', str(metadata['minzoom'])),
+            ('maxzoom', str(metadata['maxzoom'])),
+            ('bounds', ','.join(repr(b) for b in metadata['bounds'])),
+            ('json', json_dumps({'vector_layers': metadata['vector_layers']}, compact=True).decode('utf8')),
+        ]
+        self.db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", rows)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+def write_vector_tiles(input, path, **kwargs):
+    """Writes vector tiles for an Open511 document to path: an MBTiles file if
+    it ends in .mbtiles, a directory otherwise. If path holds tiles from a
+    previous run, only the tiles affected by changed events are regenerated.
+    Other arguments are as for VectorTileWriter. Returns the tiles written
+    or deleted."""
+    store = MBTilesStore(path) if path.endswith('.mbtiles') else DirectoryTileStore(path)
+    try:
+        return VectorTileWriter(store, **kwargs).update(input)
+    finally:
+        store.close()
@@ -63,6 +63,117 @@ def xml_to_json(root):
     return j
 
 
+# Kinds of element, for XMLToJSONConverter
+_PLAIN, _LINK, _GROUPED_EVENTS, _VERBOSE_LINKS = range(4)
+
+class XMLToJSONConverter(object):
+    """A faster equivalent of xml_to_json.
+
+    Everything xml_to_json works out from an element's tag -- its JSON key,
+    whether it's a link, a link list, GML or a namespaced field, and what
+    its plural form is -- is computed once per tag and kept in a lookup table,
+    so that converting a large document is mostly dict lookups.
+
+    The output is identical to xml_to_json's. Use the module-level
+    compiled_xml_to_json rather than creating instances."""
+
+    def __init__(self):
+        self.rules = {}
+        self.convert = self._make_converter()
+
+    def _compile(self, tag):
+        """Returns a tuple of (json_name, kind, plural, is_gml, json_name_is_plural)
+        for elements with the given tag, and adds it to the lookup table."""
+        name = tag
+        kind = _PLAIN
+        if tag == 'link':
+            kind = _LINK
+        elif tag.startswith('{' + NS_PROTECTED):
+            name = '!' + tag[tag.index('}') + 1:]
+        elif tag[0] == '{':
+            name = '+' + tag[tag.index('}') + 1:]
+        if name == 'grouped_events':
+            kind = _GROUPED_EVENTS
+        elif name in ('attachments', 'media_files'):
+            kind = _VERBOSE_LINKS
+        rule = self.rules[tag] = (name, kind, pluralize(tag), tag.startswith('{' + NS_GML), name.endswith('s'))
+        return rule
+
+    def _make_converter(self):
+        # Everything the conversion needs is bound to local variables of
+        # this closure, to keep lookups out of the inner loop
+        rules = self.rules
+        get_rule = rules.get
+        compile_rule = self._compile
+
+        def convert(root):
+            """Convert an Open511 XML document or document fragment to JSON.
+
+            Takes an lxml Element object. Returns a dict ready to be JSON-serialized."""
+            n = len(root)
+            if n == 0:  # Tag with no children, return str/int
+                t = root.text
+                return int(t) if t is not None and t.isdigit() else t
+
+            if n == 1:
+                first = root[0]
+                if (get_rule(first.tag) or compile_rule(first.tag))[3]:  # GML
+                    return gml_to_geojson(first)
+
+            j = {}
+            is_document = root.tag == 'open511'
+            if is_document:
+                meta = j['meta'] = {'version': root.get('version')}
+
+            for elem in root:
+                name, kind, _, _, name_is_plural = get_rule(elem.tag) or compile_rule(elem.tag)
+                if kind == _LINK:
+                    rel = elem.get('rel')
+                    if rel:
+                        name = 'url' if rel == 'self' else rel + '_url'
+                        if is_document:
+                            meta[name] = elem.get('href')
+                            continue
+                        name_is_plural = False
+                    if name in j:
+                        continue  # duplicate
+                    if not elem.text:
+                        j[name] = elem.get('href')
+                        continue
+                elif name in j:
+                    continue  # duplicate
+
+                if len(elem):
+                    if kind == _GROUPED_EVENTS:
+                        # An array of URLs
+                        j[name] = [child.get('href') for child in elem]
+                    elif kind == _VERBOSE_LINKS:
+                        # An array of JSON objects
+                        j[name] = [xml_link_to_json(child, to_dict=True) for child in elem]
+                    else:
+                        children = list(elem)
+                        for child in children:
+                            if (get_rule(child.tag) or compile_rule(child.tag))[2] != name:
+                                j[name] = convert(elem)
+                                break
+                        else:
+                            # <something><somethings> serializes to a JSON array
+                            j[name] = [convert(child) for child in children]
+                else:
+                    t = elem.text
+                    if is_document and name_is_plural and not t:
+                        # Special case: an empty e.g. <events /> container at the root level
+                        # should be serialized to [], not null
+                        j[name] = []
+                    else:
+                        j[name] = int(t) if t is not None and t.isdigit() else t
+
+            return j
+
+        return convert
+
+compiled_xml_to_json = XMLToJSONConverter().convert
+
 def xml_link_to_json(link, to_dict=False):
     if to_dict:
         d = {'url': link.get('href')}
@@ -78,11 +189,10 @@ def xml_link_to_json(link, to_dict=False):
 ##########
 
 def _reverse_gml_coords(s):
-    coords = s.split(' ')
-    gj = []
-    for i in range(0, len(coords), 2):
-        gj.append((float(coords[i+1]), float(coords[i])))
-    return gj
+    coords = [float(c) for c in s.split(' ')]
+    if len(coords) % 2:
+        raise ValueError("Odd number of GML coordinates: %s" % s)
+    return list(zip(coords[1::2], coords[0::2]))
 
 def gml_to_geojson(el):
     """Given an lxml Element of a GML geometry, returns a dict in GeoJSON format."""
@@ -1,2 +1,13 @@
+from open511.tests.collection import *
+from open511.tests.converter import *
+from open511.tests.geometry import *
+from open511.tests.input import *
+from open511.tests.mvt import *
 from open511.tests.schedule import *
-from open511.tests.tmdd import *
\ No newline at end of file
+from open511.tests.search import *
+from open511.tests.serialization import *
+from open511.tests.store import *
+from open511.tests.timeline import *
+from open511.tests.tmdd import *
+from open511.tests.validator import *
+from open511.tests.webtools import *
@@ -0,0 +1,77 @@
+import copy
+from unittest import TestCase
+
+from open511.converter import compiled_json_doc_to_xml
+from open511.tests.converter import load_fixture
+from open511.utils.bitset import bitset, count, positions
+from open511.utils.collection import EventCollection
+from open511.utils.filters import EventFilter
+
+class EventCollectionTest(TestCase):
+
+    def setUp(self):
+        self.doc = load_fixture()
+        self.events = EventCollection(compiled_json_doc_to_xml(copy.deepcopy(self.doc)),
+            default_timezone='America/Edmonton')
+
+    def ids(self, params):
+        return [e['id'] for e in self.events.query(params)]
+
+    def test_bitsets(self):
+        self.assertEqual(bitset([0, 3, 9]), 0b1000001001)
+        self.assertEqual(list(positions(0b1000001001)), [0, 3, 9])
+        self.assertEqual(list(positions(0)), [])
+        self.assertEqual(count(bitset(range(0, 1000, 7))), 143)
+
+    def test_query(self):
+        for params in ({}, {'status': 'ALL'}, {'severity': 'MAJOR,MODERATE', 'status': 'ALL'},
+                {'event_type': 'construction'}, {'bbox': '-124,48,-122,50'}, {'jurisdiction': '511.alberta.ca'},
+                {'road_name': 'rue jeanne-mance'}, {'updated': '2013-06-12T17:05:00-07:00'},
+                {'updated': ['>=2013-02-01', '<2013-06-01T00:00Z'], 'status': 'ALL'},
+                {'created': '<2013-02-02T13:00-07:00'}, {'id': 'quebec511.info/1802,nothing/1'}):
+            f = EventFilter.from_params(params)
+            self.assertEqual(self.ids(params), [e['id'] for e in self.doc['events'] if f.matches(e)], params)
+
+    def test_in_effect(self):
+        self.assertEqual(self.ids({'in_effect_on': '2013-07-01'}),
+            ['drivebc.ca/DBC-11240', 'quebec511.info/1802', '511.alberta.ca/44'])
+        self.assertEqual(self.ids({'in_effect_on': '2013-07-02'}),
+            ['drivebc.ca/DBC-11012', 'drivebc.ca/DBC-11240', 'quebec511.info/1802', '511.alberta.ca/44'])
+
+    def test_replace(self):
+        event = copy.deepcopy(self.doc['events'][0])
+        event['severity'] = 'MINOR'
+        self.events.add([event])
+        self.assertEqual(len(self.events), 6)
+        self.assertEqual(self.ids({'severity': 'MINOR'}), ['quebec511.info/1802', 'drivebc.ca/DBC-11012'])
+        self.assertEqual(self.ids({'severity': 'MODERATE'}), ['511.alberta.ca/44'])
+        doc = self.events.export({'road_name': 'Highway 1'}, 'json', serialize=False)
+        self.assertEqual(doc['events'], [event])
+
+    def test_refresh(self):
+        # Re-adding the same feed doesn't grow the collection or its indexes
+        expected = self.ids({'status': 'ALL'})
+        for i in range(10):
+            self.events.add(copy.deepcopy(self.doc))
+            self.assertEqual(len(self.events), 6)
+            self.assertTrue(len(self.events._events) <= 12)
+            self.assertEqual(len(self.events._updated.entries), 6)
+            self.assertTrue(all(bits.bit_length() <= 12 for index in self.events._index.values()
+                for bits in index.values()))
+        self.assertEqual(sorted(self.ids({'status': 'ALL'})), sorted(expected))
+        self.assertEqual(self.ids({'in_effect_on': '2013-07-01'}),
+            ['drivebc.ca/DBC-11240', 'quebec511.info/1802', '511.alberta.ca/44'])
+        self.assertEqual(self.ids({'severity': 'MAJOR,MODERATE', 'status': 'ALL'}),
+            [e['id'] for e in self.doc['events'] if e.get('severity') in ('MAJOR', 'MODERATE')])
+
+    def test_remove(self):
+        self.events.remove(['drivebc.ca/DBC-11240', 'quebec511.info/1802', 'nothing/1'])
+        self.assertEqual(len(self.events), 4)
+        self.assertEqual(self.ids({'in_effect_on': '2013-07-01'}), ['511.alberta.ca/44'])
+        self.assertEqual(self.ids({'id': 'quebec511.info/1802'}), [])
+        # Removed events' bits are cleared, not just masked
+        self.assertEqual(self.events._index['jurisdiction'].get('quebec511.info', 0) & ~self.events._live, 0)
+        self.events.remove([e['id'] for e in self.doc['events']])
+        self.assertEqual((len(self.events), self.events._events, self.events._index['status']), (0, [], {}))
+        self.events.add(self.doc)
+        self.assertEqual(self.ids({'status': 'ALL'}), [e['id'] for e in self.doc['events']])
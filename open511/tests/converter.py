@@ -0,0 +1,392 @@
+import copy
+import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+from lxml import etree
+import pytz
+
+from open511.converter import (xml_to_json, compiled_xml_to_json, json_doc_to_xml,
+    compiled_json_doc_to_xml, open511_convert)
+from open511.converter import arrow, atom, kml
+from open511.converter.ical import vtimezone
+from open511.converter.kml import convert_to_kml, write_kml_tiles
+from open511.utils.serialization import NS_GML, NS_KML, NS_PROTECTED
+
+TAGS = ['event', 'events', 'road', 'roads', 'area', 'areas', 'geography', 'geographies',
+    'headline', 'grouped_events', 'attachments', 'media_files', 'link', 'days', 'day',
+    '{%s}secret' % NS_PROTECTED, '{http://example.com/custom}field', '{http://example.com/custom}fields']
+TEXTS = [None, '', 'ACTIVE', '12', '007', '2013-01-01', 'Highway 1\n\nDetour']
+RELS = [None, 'self', 'jurisdiction', 'related', 'area']
+
+def _random_gml(rnd):
+    if rnd.random() < 0.5:
+        el = etree.Element('{%s}Point' % NS_GML)
+        etree.SubElement(el, '{%s}pos' % NS_GML).text = '%s %s' % (rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+    else:
+        el = etree.Element('{%s}LineString' % NS_GML)
+        etree.SubElement(el, '{%s}posList' % NS_GML).text = ' '.join(
+            str(rnd.uniform(-90, 90)) for _ in range(2 * rnd.randint(2, 5)))
+    return el
+
+def _random_element(rnd, tag, depth):
+    el = etree.Element(tag)
+    if tag == 'link':
+        rel = rnd.choice(RELS)
+        if rel:
+            el.set('rel', rel)
+        el.set('href', 'http://example.com/%d' % rnd.randint(0, 5))
+        if rnd.random() < 0.3:
+            el.text = rnd.choice(TEXTS)
+        return el
+    if tag in ('attachments', 'media_files', 'grouped_events') and rnd.random() < 0.8:
+        for i in range(rnd.randint(1, 3)):
+            link = etree.SubElement(el, 'link', rel='related', href='http://example.com/%d' % i)
+            if rnd.random() < 0.5:
+                link.set('title', 'Title %d' % i)
+        return el
+    if tag == 'geography' and rnd.random() < 0.7:
+        el.append(_random_gml(rnd))
+        return el
+    if depth > 3 or rnd.random() < 0.3:
+        el.text = rnd.choice(TEXTS)
+        return el
+    if rnd.random() < 0.4:
+        # A plural container
+        child_tag = rnd.choice(('road', 'area', 'geography', 'day', '{http://example.com/custom}field'))
+        el.tag = child_tag[:-1] + 'ies' if child_tag.endswith('phy') else child_tag + 's'
+        children = [child_tag] * rnd.randint(0, 3)
+        if rnd.random() < 0.2:
+            children.append(rnd.choice(TAGS))
+    else:
+        children = [rnd.choice(TAGS) for _ in range(rnd.randint(1, 6))]
+    for child_tag in children:
+        el.append(_random_element(rnd, child_tag, depth + 1))
+    return el
+
+def random_document(rnd):
+    root = _random_element(rnd, 'open511', 0)
+    root.set('version', 'v1')
+    for _ in range(rnd.randint(0, 3)):
+        root.append(_random_element(rnd, 'link', 1))
+    if rnd.random() < 0.5:
+        etree.SubElement(root, rnd.choice(('events', 'areas')))
+    return root
+
+class CompiledXMLToJSONTest(TestCase):
+    maxDiff = None
+
+    def test_random_documents(self):
+        rnd = random.Random(511)
+        for i in range(500):
+            doc = random_document(rnd)
+            fragment = doc if i % 2 else _random_element(rnd, rnd.choice(TAGS), 1)
+            self.assertEqual(compiled_xml_to_json(fragment), xml_to_json(fragment),
+                etree.tostring(fragment))
+
+    def test_fixtures(self):
+        for filename in ('tmdd-output-1.json', 'tmdd-output-2.json'):
+            with open(os.path.join(os.path.dirname(__file__), 'fixtures', filename)) as f:
+                doc = json_doc_to_xml(json.load(f))
+            self.assertEqual(compiled_xml_to_json(doc), xml_to_json(doc))
+
+def _random_json_value(rnd, depth):
+    r = rnd.random()
+    if depth > 3 or r < 0.3:
+        return rnd.choice(['ACTIVE', u'\xc9v\xe9nement', 12, 2.5, True, None, ''])
+    if r < 0.45:
+        return {'type': 'Point', 'coordinates': [rnd.uniform(-180, 180), rnd.uniform(-90, 90)]}
+    if r < 0.6:
+        return [_random_json_value(rnd, depth + 1) for _ in range(rnd.randint(0, 3))]
+    return _random_json_object(rnd, depth + 1)
+
+def _random_json_object(rnd, depth):
+    obj = {}
+    for _ in range(rnd.randint(0, 5)):
+        key = rnd.choice(['headline', 'roads', 'areas', 'geographies', 'days', '!secret', '+custom',
+            '+customs', 'pagination'])
+        obj[key] = _random_json_value(rnd, depth)
+    r = rnd.random()
+    if r < 0.2:
+        obj[rnd.choice(['url', 'jurisdiction_url', 'area_url'])] = 'http://example.com/%d' % rnd.randint(0, 9)
+    elif r < 0.3:
+        obj[rnd.choice(['attachments', 'media_files'])] = [
+            {'url': 'http://example.com/a', 'title': 'A', 'length': 10}, 'http://example.com/b']
+    elif r < 0.4:
+        obj['grouped_events'] = ['http://example.com/events/1', 'http://example.com/events/2']
+    return obj
+
+def random_json_document(rnd):
+    doc = {
+        'meta': {'version': 'v1', 'url': '/events/', 'up_url': '/'},
+        'events': [_random_json_object(rnd, 1) for _ in range(rnd.randint(0, 5))],
+    }
+    if rnd.random() < 0.3:
+        doc['pagination'] = {'offset': 0, 'next_url': '/events/?offset=20'}
+    return doc
+
+class CompiledJSONToXMLTest(TestCase):
+    maxDiff = None
+
+    def _compare(self, doc):
+        expected = etree.tostring(json_doc_to_xml(doc, custom_namespace='http://example.com/custom'))
+        self.assertEqual(
+            etree.tostring(compiled_json_doc_to_xml(doc, custom_namespace='http://example.com/custom')),
+            expected)
+
+    def test_random_documents(self):
+        rnd = random.Random(511)
+        for _ in range(300):
+            self._compare(random_json_document(rnd))
+
+    def test_fixtures(self):
+        for filename in ('tmdd-output-1.json', 'tmdd-output-2.json', 'open511-events.json'):
+            with open(os.path.join(os.path.dirname(__file__), 'fixtures', filename)) as f:
+                self._compare(json.load(f))
+
+    def test_custom_namespace_required(self):
+        self.assertRaises(Exception, compiled_json_doc_to_xml, {'meta': {'version': 'v1'}, '+custom': 1})
+
+def load_fixture(filename='open511-events.json'):
+    with open(os.path.join(os.path.dirname(__file__), 'fixtures', filename)) as f:
+        return json.load(f)
+
+class NativeInputTest(TestCase):
+    """The Atom and KML converters should give the same output from either input format."""
+
+    def setUp(self):
+        self.json_doc = load_fixture()
+        self.xml_doc = json_doc_to_xml(copy.deepcopy(self.json_doc))
+
+    def _atom(self, doc, **kwargs):
+        if kwargs.get('include_expires'):
+            kwargs['timestamp'] = datetime.datetime(2013, 5, 6, 12, 0, tzinfo=pytz.utc)
+        feed = atom.convert_to_atom(doc, **kwargs)
+        feed.remove(feed.find('{%s}updated' % atom.NS_ATOM))
+        return etree.tostring(feed)
+
+    def test_atom(self):
+        self.assertEqual(self._atom(self.json_doc), self._atom(self.xml_doc))
+        with_expires = self._atom(self.json_doc, include_expires=True)
+        self.assertEqual(with_expires, self._atom(self.xml_doc, include_expires=True))
+        self.assertIn(b'expires', with_expires)
+
+    def test_atom_parallel(self):
+        expected = self._atom(self.xml_doc, include_expires=True)
+        min_events = atom.PARALLEL_MIN_EVENTS
+        atom.PARALLEL_MIN_EVENTS = 1
+        try:
+            self.assertEqual(self._atom(self.xml_doc, include_expires=True, processes=2), expected)
+            # As the command line's --expires --processes asks for it
+            feed = open511_convert(self.json_doc, 'atom', serialize=False, include_expires=True, processes=2,
+                timestamp=datetime.datetime(2013, 5, 6, 12, 0, tzinfo=pytz.utc))
+            feed.remove(feed.find('{%s}updated' % atom.NS_ATOM))
+            self.assertEqual(etree.tostring(feed), expected)
+        finally:
+            atom.PARALLEL_MIN_EVENTS = min_events
+
+    def test_kml(self):
+        self.assertEqual(etree.tostring(convert_to_kml(self.json_doc)),
+            etree.tostring(convert_to_kml(self.xml_doc)))
+
+class AtomArchiveTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.doc = load_fixture()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _read(self, filename):
+        with open(os.path.join(self.directory, filename), 'rb') as f:
+            return f.read()
+
+    def test_paged(self):
+        pages = atom.convert_to_paged_atom(self.doc, page_size=4)
+        self.assertEqual([len(page.findall('{%s}entry' % atom.NS_ATOM)) for page in pages], [4, 2])
+        links = dict((link.get('rel'), link.get('href')) for link in pages[1].findall('{%s}link' % atom.NS_ATOM))
+        self.assertEqual(links['previous'], 'http://example.org/open511-feed')
+        self.assertEqual(links['self'], 'http://example.org/open511-feed?page=2')
+        self.assertNotIn('next', links)
+
+    def test_archive(self):
+        feed_url = 'http://example.com/feed/current.xml'
+        writer = atom.AtomArchiveWriter(self.directory, feed_url, page_size=2)
+        self.assertEqual(writer.update(self.doc), ['archive-1.xml', 'archive-2.xml', 'current.xml'])
+        self.assertEqual(writer.update(self.doc), [])
+        archives = [self._read('archive-1.xml'), self._read('archive-2.xml')]
+
+        # Pick up where the last writer left off
+        self.doc['events'][0]['updated'] = '2013-06-01T00:00:00-07:00'
+        writer = atom.AtomArchiveWriter(self.directory, feed_url, page_size=2)
+        self.assertEqual(writer.update(self.doc), ['archive-3.xml', 'current.xml'])
+        self.assertEqual([self._read('archive-1.xml'), self._read('archive-2.xml')], archives)
+
+        current = etree.fromstring(self._read('current.xml'))
+        self.assertEqual(current.find('{%s}link[@rel="prev-archive"]' % atom.NS_ATOM).get('href'),
+            'http://example.com/feed/archive-3.xml')
+        self.assertEqual(current.findtext('{%s}entry/{%s}updated' % (atom.NS_ATOM, atom.NS_ATOM)),
+            '2013-06-01T00:00:00-07:00')
+        archive = etree.fromstring(self._read('archive-3.xml'))
+        self.assertIsNotNone(archive.find('{%s}archive' % atom.NS_FH))
+        self.assertIsNone(archive.find('{%s}link[@rel="next-archive"]' % atom.NS_ATOM))
+
+class KMLTilesTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_tiles(self):
+        doc = load_fixture()
+        filenames = write_kml_tiles(doc, self.directory, max_features=1)
+        self.assertIn('doc.kml', filenames)
+        names = []
+        for filename in filenames:
+            tile = etree.parse(os.path.join(self.directory, filename)).getroot()
+            for link in tile.iterfind('.//{%s}Link/{%s}href' % (NS_KML, NS_KML)):
+                self.assertIn(link.text, filenames)
+            # Each event is drawn once, or twice if it has a simplified version
+            names.extend(tile.xpath('k:Document/k:Placemark/k:name/text()'
+                ' | k:Document/k:Folder[k:name="Detailed"]/k:Placemark/k:name/text()', namespaces={'k': NS_KML}))
+        self.assertEqual(sorted(names), sorted(event['headline'] for event in doc['events']))
+
+    def _tile_regions(self, filenames):
+        regions = []
+        for filename in filenames:
+            tile = etree.parse(os.path.join(self.directory, filename)).getroot()
+            for box in tile.iterfind('.//{%s}NetworkLink/{%s}Region/{%s}LatLonAltBox' % (NS_KML, NS_KML, NS_KML)):
+                regions.append(float(box.findtext('{%s}east' % NS_KML)) - float(box.findtext('{%s}west' % NS_KML)))
+        return regions
+
+    def test_shared_point(self):
+        doc = load_fixture()
+        events = [dict(doc['events'][0], headline='Event %d' % i,
+            geography={'type': 'Point', 'coordinates': [-123.1, 49.2]}) for i in range(5)]
+        # Events at one spot stay in the root tile instead of splitting to max_depth
+        self.assertEqual(write_kml_tiles(dict(doc, events=events), self.directory, max_features=1), ['doc.kml'])
+
+        # Nearly overlapping events are split no further than the minimum tile size
+        for i, event in enumerate(events):
+            event['geography'] = {'type': 'Point', 'coordinates': [-123.1 + (i % 2) * 1e-7 + (i // 4), 49.2]}
+        filenames = write_kml_tiles(dict(doc, events=events), self.directory, max_features=1)
+        self.assertTrue(len(filenames) > 1)
+        self.assertTrue(max(len(f) for f in filenames) < len('0123456789.kml'))
+        self.assertTrue(min(self._tile_regions(filenames)) >= kml.MIN_TILE_SIZE)
+
+class GeoJSONTest(TestCase):
+
+    def test_feature_collection(self):
+        doc = load_fixture()
+        collection = json.loads(open511_convert(doc, 'geojson').decode('utf8'))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        feature = collection['features'][0]
+        self.assertEqual(feature['id'], 'drivebc.ca/DBC-11012')
+        self.assertEqual(feature['geometry'], doc['events'][0]['geography'])
+        self.assertEqual(sorted(feature['properties']), ['event_type', 'headline', 'roads', 'severity', 'status'])
+
+    def test_lines(self):
+        doc = load_fixture()
+        lines = b''.join(open511_convert(json_doc_to_xml(copy.deepcopy(doc)), 'geojsonl',
+            properties=['severity'])).decode('utf8').splitlines()
+        self.assertEqual(len(lines), len(doc['events']))
+        self.assertEqual([json.loads(line)['properties'] for line in lines],
+            [{'severity': event['severity']} for event in doc['events']])
+        # Each feature has to stay on one line, whether or not compact is asked for
+        self.assertEqual(b''.join(open511_convert(doc, 'geojsonl', compact=True)),
+            b''.join(open511_convert(doc, 'geojsonl')))
+
+class ICalTest(TestCase):
+
+    def _vevents(self, doc):
+        text = open511_convert(doc, 'ical').decode('utf8')
+        self.assertTrue(all(len(line.encode('utf8')) <= 75 for line in text.split('\r\n')))
+        lines = text.replace('\r\n ', '').split('\r\n')
+        self.assertEqual(lines[0], 'BEGIN:VCALENDAR')
+        vevents = []
+        for line in lines:
+            if line == 'BEGIN:VEVENT':
+                vevents.append({})
+            elif vevents and ':' in line:
+                name, _, value = line.partition(':')
+                vevents[-1][name] = value
+        return lines, vevents
+
+    def test_recurring(self):
+        lines, vevents = self._vevents(json_doc_to_xml(load_fixture()))
+        self.assertEqual(len(vevents), 9)
+        self.assertEqual(vevents[0]['UID'], 'drivebc.ca/DBC-11012/0')
+        self.assertEqual(vevents[0]['DTSTART;TZID=America/Vancouver'], '20130501T200000')
+        self.assertEqual(vevents[0]['RRULE'], 'FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR;UNTIL=20130901T030000Z')
+        self.assertEqual(vevents[0]['EXDATE;TZID=America/Vancouver'], '20130701T200000,20130805T200000')
+        # The second component doesn't recur on Mondays, so neither exception date is excluded
+        self.assertTrue('EXDATE;TZID=America/Vancouver' not in vevents[1])
+        self.assertEqual(vevents[2]['DTSTART;TZID=America/Vancouver'], '20130805T220000')
+        self.assertEqual(vevents[2]['DTEND;TZID=America/Vancouver'], '20130805T235900')
+        self.assertEqual(vevents[6]['RRULE'], 'FREQ=DAILY;UNTIL=20130706T150000Z')
+        self.assertEqual(vevents[7]['RRULE'], 'FREQ=DAILY')
+        self.assertEqual(vevents[7]['DTSTART;TZID=UTC'], '20130110T000000')
+        self.assertTrue('TZID:America/Montreal' in lines)
+
+    def test_intervals(self):
+        _, vevents = self._vevents(load_fixture())
+        self.assertEqual(vevents[3]['DTSTART;TZID=America/Vancouver'], '20130612T164000')
+        self.assertTrue('DTEND;TZID=America/Vancouver' not in vevents[3])
+        self.assertEqual(vevents[4]['STATUS'], 'CANCELLED')
+        self.assertEqual(vevents[5]['DTEND;TZID=America/Montreal'], '20130430T170000')
+        self.assertEqual(vevents[4]['SUMMARY'], u'Fermeture complète de la rue Sherbrooke')
+
+    def test_vtimezone(self):
+        lines = vtimezone(pytz.timezone('Europe/London'), datetime.datetime(2013, 1, 1))
+        self.assertEqual(lines.count('BEGIN:DAYLIGHT'), 1)
+        self.assertTrue('RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU' in lines)
+        self.assertTrue('RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU' in lines)
+        self.assertEqual(lines[lines.index('BEGIN:DAYLIGHT') + 1], 'DTSTART:20130331T010000')
+        lines = vtimezone(pytz.timezone('Asia/Kolkata'), datetime.datetime(2013, 1, 1))
+        self.assertEqual(lines[2:5], ['BEGIN:STANDARD', 'DTSTART:19451015T000000', 'TZOFFSETFROM:+0630'])
+
+@skipIf(arrow.pa is None, "pyarrow isn't installed")
+class ArrowTest(TestCase):
+
+    def test_record_batch(self):
+        doc = load_fixture()
+        batch = arrow.events_to_record_batch(doc, source='fixture')
+        self.assertEqual(batch.num_rows, len(doc['events']))
+        self.assertTrue(batch.equals(arrow.events_to_record_batch(json_doc_to_xml(copy.deepcopy(doc)), source='fixture')))
+        rows = batch.to_pylist()
+        self.assertEqual(rows[0]['id'], 'drivebc.ca/DBC-11012')
+        self.assertEqual(rows[0]['updated'], datetime.datetime(2013, 5, 3, 17, 15, tzinfo=pytz.utc))
+        self.assertEqual(rows[0]['roads'][0]['direction'], 'E')
+        self.assertEqual(rows[0]['schedule_end_date'], datetime.date(2013, 8, 31))
+        self.assertEqual(rows[1]['schedule_intervals'], [
+            {'start': datetime.datetime(2013, 6, 12, 23, 40, tzinfo=pytz.utc), 'end': None}])
+        self.assertEqual(rows[5]['geometry_type'], 'Point')
+
+    def test_local_dates(self):
+        doc = load_fixture()
+        doc['events'][1]['schedule'] = {'intervals': ['2013-06-12T20:00/2013-06-12T22:00']}
+        row = arrow.events_to_record_batch(doc).to_pylist()[1]
+        # Local dates, as for recurring schedules, though the interval is on the next day in UTC
+        self.assertEqual(row['schedule_intervals'][0]['start'], datetime.datetime(2013, 6, 13, 3, 0, tzinfo=pytz.utc))
+        self.assertEqual((row['schedule_start_date'], row['schedule_end_date']),
+            (datetime.date(2013, 6, 12), datetime.date(2013, 6, 12)))
+
+    def test_parquet(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'events.parquet')
+            self.assertEqual(arrow.write_parquet([load_fixture(), load_fixture()], path, batch_size=4), 12)
+            parquet_file = arrow.pq.ParquetFile(path)
+            self.assertEqual(parquet_file.metadata.num_row_groups, 4)
+            table = parquet_file.read()
+            self.assertEqual(table.num_rows, 12)
+            self.assertTrue(arrow.pa.types.is_dictionary(table.schema.field('severity').type))
+        finally:
+            shutil.rmtree(directory)
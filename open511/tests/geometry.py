@@ -0,0 +1,29 @@
+import binascii
+from unittest import TestCase
+
+from open511.utils.geometry import bbox, simplify, simplify_geometry, to_wkb
+
+class GeometryTest(TestCase):
+
+    def test_bbox(self):
+        self.assertEqual(bbox({'type': 'Point', 'coordinates': [-73.5, 45.5]}), (-73.5, 45.5, -73.5, 45.5))
+        self.assertEqual(bbox({'type': 'LineString', 'coordinates': [[0, 1], [2, -1], [1, 3]]}), (0, -1, 2, 3))
+
+    def test_simplify(self):
+        line = [[0, 0], [1, 0.01], [2, -0.01], [3, 5], [4, 6], [5, 7]]
+        self.assertEqual(simplify(line, 0.1), [[0, 0], [2, -0.01], [3, 5], [5, 7]])
+        self.assertEqual(simplify(line, 0), line)
+        self.assertEqual(simplify(line, 100), [[0, 0], [5, 7]])
+
+    def test_simplify_polygon(self):
+        ring = [[0, 0], [1, 0.001], [2, 0], [2, 2], [0, 0]]
+        polygon = simplify_geometry({'type': 'Polygon', 'coordinates': [ring]}, 1000)
+        self.assertEqual(polygon['coordinates'], [ring])
+
+    def test_wkb(self):
+        self.assertEqual(binascii.hexlify(to_wkb({'type': 'Point', 'coordinates': [1, 2]})),
+            b'0101000000000000000000f03f0000000000000040')
+        line = to_wkb({'type': 'MultiLineString', 'coordinates': [[[0, 0], [1, 1]]]})
+        self.assertEqual(line[:9], b'\x01\x05\x00\x00\x00\x01\x00\x00\x00')
+        self.assertEqual(line[9:18], b'\x01\x02\x00\x00\x00\x02\x00\x00\x00')
+        self.assertEqual(len(line), 18 + 4 * 8)
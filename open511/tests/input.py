@@ -0,0 +1,105 @@
+import bz2
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, skipIf
+
+from open511.utils import input as input_utils
+from open511.utils import serialization
+from open511.utils.input import load_path, open_path
+from open511.tests.serialization import JSON_DOC, XML_DOC
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+JSON_RESULT = ({'meta': {'version': 'v1'}, 'events': []}, 'json')
+
+class _Stdin(object):
+
+    def __init__(self, content):
+        self.buffer = io.BytesIO(content)
+
+class LoadPathTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, content, opener=open):
+        path = os.path.join(self.dir, name)
+        f = opener(path, 'wb')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+        return path
+
+    def _check_compressed(self, opener):
+        self.assertEqual(load_path(self._write('doc.json', JSON_DOC, opener)), JSON_RESULT)
+        path = self._write('doc.xml', XML_DOC.lstrip(), opener)
+        doc, doc_format = load_path(path)
+        self.assertEqual((doc.tag, doc_format), ('open511', 'xml'))
+        with open_path(path) as f:
+            self.assertEqual(f.read(), XML_DOC.lstrip())
+
+    def test_gzip(self):
+        self._check_compressed(gzip.GzipFile)
+
+    def test_bz2(self):
+        self._check_compressed(bz2.BZ2File)
+
+    @skipIf(lzma is None, "lzma isn't available")
+    def test_xz(self):
+        self._check_compressed(lzma.LZMAFile)
+
+    def test_plain(self):
+        doc, doc_format = load_path(self._write('doc.xml', XML_DOC))
+        self.assertEqual((doc.tag, doc_format), ('open511', 'xml'))
+        self.assertEqual(load_path(self._write('doc.json', JSON_DOC)), JSON_RESULT)
+        self.assertRaises(Exception, load_path, self._write('empty', b''))
+
+    def _deserialized_types(self, path):
+        types = []
+        def deserialize(content):
+            types.append(type(content))
+            return serialization.deserialize(content)
+        original = input_utils.deserialize
+        input_utils.deserialize = deserialize
+        try:
+            self.assertEqual(load_path(path), JSON_RESULT)
+        finally:
+            input_utils.deserialize = original
+        return types
+
+    def test_mmap(self):
+        path = self._write('doc.json', JSON_DOC)
+        original = serialization.json_backend.name
+        try:
+            for name, backend in serialization.JSON_BACKENDS.items():
+                serialization.set_json_backend(name)
+                # Only backends that parse buffers in place get the mapped file
+                mapped = self._deserialized_types(path) == [memoryview]
+                self.assertEqual(mapped, backend.loads_buffers)
+        finally:
+            serialization.set_json_backend(original)
+
+    def test_stdin(self):
+        stdin = sys.stdin
+        try:
+            sys.stdin = _Stdin(JSON_DOC)
+            self.assertEqual(load_path('-'), JSON_RESULT)
+            compressed = io.BytesIO()
+            with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+                f.write(XML_DOC)
+            sys.stdin = _Stdin(compressed.getvalue())
+            doc, doc_format = load_path('-')
+            self.assertEqual((doc.tag, doc_format), ('open511', 'xml'))
+        finally:
+            sys.stdin = stdin
@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from open511.converter import mvt
+
+class VectorTileTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'open511-events.json')) as f:
+            self.doc = json.load(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_geometry_encoding(self):
+        # The examples from the vector tile specification
+        self.assertEqual(mvt._encode_geometry(mvt._POINT, [(25, 17)]), [9, 50, 34])
+        self.assertEqual(mvt._encode_geometry(mvt._LINESTRING, [[(2, 2), (2, 10), (10, 10)]]),
+            [9, 4, 4, 18, 0, 16, 16, 0])
+        self.assertEqual(mvt._encode_geometry(mvt._POLYGON, [[(3, 6), (8, 12), (20, 34)]]),
+            [9, 6, 12, 18, 10, 12, 24, 44, 15])
+
+    def test_clip_line(self):
+        self.assertEqual(mvt._clip_line([(-10, 5), (5, 5), (5, 20), (5, 30)], 0, 10),
+            [[(0.0, 5.0), (5, 5), (5.0, 10.0)]])
+
+    def test_incremental(self):
+        path = os.path.join(self.directory, 'tiles')
+        written = mvt.write_vector_tiles(self.doc, path, maxzoom=6)
+        self.assertIn((0, 0, 0), written)
+        self.assertTrue(os.path.exists(os.path.join(path, '0', '0', '0.pbf')))
+        self.assertEqual(mvt.write_vector_tiles(self.doc, path, maxzoom=6), [])
+
+        # Moving one point only touches the tiles it was and is in
+        self.doc['events'][5]['geography']['coordinates'] = [-114.5, 49.5]
+        written = mvt.write_vector_tiles(self.doc, path, maxzoom=6)
+        self.assertIn((0, 0, 0), written)
+        self.assertTrue(len(written) <= 2 * 7)
+
+        del self.doc['events'][5]
+        self.assertTrue(mvt.write_vector_tiles(self.doc, path, maxzoom=6))
+
+    def test_settings(self):
+        path = os.path.join(self.directory, 'tiles')
+        written = mvt.write_vector_tiles(self.doc, path, maxzoom=3)
+        self.assertEqual(mvt.write_vector_tiles(self.doc, path, maxzoom=3), [])
+        # Every tile is redrawn when the way it's drawn changes
+        for kwargs in ({'extent': 512}, {'extent': 512, 'buffer': 8}, {'extent': 512, 'buffer': 8, 'layer_name': 'roads'}):
+            kwargs['maxzoom'] = 3
+            self.assertEqual(mvt.write_vector_tiles(self.doc, path, **kwargs), written)
+            self.assertEqual(mvt.write_vector_tiles(self.doc, path, **kwargs), [])
+        # Dropping zoom levels deletes their tiles
+        self.assertEqual(mvt.write_vector_tiles(self.doc, path, maxzoom=2, extent=512, buffer=8, layer_name='roads'), written)
+        self.assertFalse(any(files for _, _, files in os.walk(os.path.join(path, '3'))))
+
+    def test_without_ids(self):
+        path = os.path.join(self.directory, 'tiles')
+        events = self.doc['events'][:3]
+        for event in events:
+            del event['id']
+        # The same event twice, and two more, which would all share a key of None
+        self.doc['events'] = events + [dict(events[0])]
+        mvt.write_vector_tiles(self.doc, path, maxzoom=3)
+        with open(os.path.join(path, mvt.DirectoryTileStore.STATE_FILENAME)) as f:
+            self.assertEqual(len(json.load(f)), 4)
+        self.assertEqual(mvt.write_vector_tiles(self.doc, path, maxzoom=3), [])
+
+        # Changing an event without an ID replaces it
+        events[1]['geography'] = {'type': 'Point', 'coordinates': [-114.5, 49.5]}
+        self.assertTrue(mvt.write_vector_tiles(self.doc, path, maxzoom=3))
+        with open(os.path.join(path, mvt.DirectoryTileStore.STATE_FILENAME)) as f:
+            self.assertEqual(len(json.load(f)), 4)
+
+    def test_mbtiles(self):
+        path = os.path.join(self.directory, 'events.mbtiles')
+        written = mvt.write_vector_tiles(self.doc, path, maxzoom=4)
+        db = sqlite3.connect(path)
+        self.assertEqual(db.execute("SELECT count(*) FROM tiles").fetchone()[0], len(written))
+        self.assertEqual(db.execute("SELECT tile_row FROM tiles WHERE zoom_level = 1").fetchone()[0], 1)
+        self.assertEqual(dict(db.execute("SELECT * FROM metadata"))['format'], 'pbf')
+        db.close()
@@ -1,20 +1,33 @@
 import datetime
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 from lxml import etree
 import pytz
 
-from open511.utils.schedule import Schedule
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None
+
+from open511.converter.o5json import xml_to_json
+from open511.utils.schedule import Schedule, INTERVAL_CACHE_MAX_CHUNKS
+from open511.utils.timezone import localize, make_aware
 
 class BaseScheduleTest(TestCase):
 
     tzname = 'America/Montreal'
+    # Each test runs against a Schedule built from the XML, and again (in the
+    # JSON* subclasses) from its JSON equivalent
+    from_json = False
 
     def setUp(self):
         self.timezone = pytz.timezone(self.tzname)
         self.elem = etree.fromstring(self.data)
         assert self.elem.tag == 'schedule'
-        self.sched = Schedule.from_element(self.elem, self.timezone)
+        if self.from_json:
+            self.sched = Schedule.from_json(xml_to_json(self.elem), self.timezone)
+        else:
+            self.sched = Schedule.from_element(self.elem, self.timezone)
 
 class SimpleScheduleTest(BaseScheduleTest):
 
@@ -43,6 +56,7 @@ class SimpleIntervalScheduleTest(BaseScheduleTest):
         n = sc.next_interval()
         self.assertEquals(n.start.date(), datetime.date(2013, 2, 1))
         self.assertEquals(n.end, None)
+        self.assertEquals(sc.bounds(), (sc._intervals[0].start, None))
 
         assert sc.includes(datetime.datetime.now())
 
@@ -56,6 +70,9 @@ class AncientScheduleTest(BaseScheduleTest):
         assert not list(self.sched.intervals(range_start=datetime.datetime.now()))
         assert self.sched.next_interval() is None
         assert not self.sched.includes(datetime.datetime.now())
+        self.assertEquals(self.sched.bounds(), (
+            self.timezone.localize(datetime.datetime(2010, 1, 1, 0, 0)),
+            self.timezone.localize(datetime.datetime(2010, 2, 1, 23, 59))))
 
 class FutureScheduleTest(BaseScheduleTest):
 
@@ -88,6 +105,143 @@ class ExceptionsScheduleTest(BaseScheduleTest):
         assert sc.active_within_range(datetime.datetime(2010,1,2,9,30), datetime.datetime(2010,1,2,12,0))
         assert sc.active_within_range(datetime.datetime(2010,1,2,9,30), datetime.datetime(2010,1,2,9,40))
         assert sc.next_interval(datetime.datetime(2010,1,2,8,30)).end.time() == datetime.time(10,0)
+        self.assertEquals(sc.bounds(), (self.timezone.localize(datetime.datetime(2010, 1, 1, 0, 0)), None))
+
+
 
 
+class ManyExceptionsScheduleTest(BaseScheduleTest):
+    data = """<schedule><recurring_schedules><recurring_schedule><start_date>2013-01-01</start_date><end_date>2014-12-31</end_date>
+        <daily_start_time>08:00</daily_start_time><daily_end_time>17:00</daily_end_time></recurring_schedule></recurring_schedules>
+        <exceptions>%s</exceptions></schedule>""" % ''.join(
+            '<exception>%s 10:00-12:00 09:00-09:30</exception>' % (datetime.date(2013, 1, 1) + datetime.timedelta(days=d))
+            for d in range(0, 700, 3))
 
+    def test_exception_periods(self):
+        sc = self.sched
+        periods = sc.exception_periods(datetime.date(2013, 2, 1), datetime.date(2013, 2, 10))
+        self.assertEqual([p.start.date() for p in periods], [datetime.date(2013, 2, d) for d in (3, 3, 6, 6, 9, 9)])
+        self.assertEqual(periods, sorted(periods))
+        self.assertEqual(periods[0], (self.timezone.localize(datetime.datetime(2013, 2, 3, 9, 0)),
+            self.timezone.localize(datetime.datetime(2013, 2, 3, 9, 30))))
+        self.assertEqual(len(sc.exception_periods()), 2 * len(sc.exception_dates))
+        assert sc.includes(datetime.datetime(2013, 2, 3, 9, 15))
+        assert not sc.includes(datetime.datetime(2013, 2, 3, 9, 45))
+        assert sc.includes(datetime.datetime(2013, 2, 4, 9, 45))
+
+    def test_interval_cache(self):
+        sc = self.sched
+        week = list(sc.intervals(datetime.datetime(2013, 1, 28), datetime.datetime(2013, 2, 4)))
+        self.assertEqual(len(week), 10)
+        self.assertEqual(week[0].start, self.timezone.localize(datetime.datetime(2013, 1, 28, 9, 0)))
+        self.assertEqual(list(sc.intervals(datetime.datetime(2013, 1, 28), datetime.datetime(2013, 2, 4))), week)
+        self.assertEqual(len(list(sc.intervals(datetime.datetime(2013, 1, 1), datetime.datetime(2099, 1, 1)))), 964)
+        self.assertTrue(len(sc._chunks) <= INTERVAL_CACHE_MAX_CHUNKS)
+        self.assertEqual(sc.next_interval(datetime.datetime(2014, 12, 31, 18, 0)), None)
+
+class WeekdaysScheduleTest(BaseScheduleTest):
+    data = """<schedule><recurring_schedules><recurring_schedule><start_date>2013-01-01</start_date>
+        <end_date>2013-03-31</end_date><days><day>1</day><day>3</day></days>
+        <daily_start_time>22:00</daily_start_time><daily_end_time>23:59</daily_end_time></recurring_schedule>
+        <recurring_schedule><start_date>2013-03-01</start_date><days><day>7</day></days></recurring_schedule>
+        </recurring_schedules><exceptions><exception>2013-01-07</exception></exceptions></schedule>"""
+
+    def test_weekdays(self):
+        sc = self.sched
+        week = list(sc.intervals(datetime.datetime(2013, 1, 6), datetime.datetime(2013, 1, 13)))
+        self.assertEqual(week, [(self.timezone.localize(datetime.datetime(2013, 1, 9, 22, 0)),
+            self.timezone.localize(datetime.datetime(2013, 1, 9, 23, 59)))])
+        assert sc.includes(datetime.datetime(2013, 1, 14, 22, 30))
+        assert not sc.includes(datetime.datetime(2013, 1, 14, 21, 30))
+        assert not sc.includes(datetime.datetime(2013, 3, 2, 12, 0))
+        assert sc.includes(datetime.datetime(2013, 3, 3, 12, 0))
+        assert sc.includes(datetime.datetime(2014, 3, 2, 12, 0))
+        self.assertEqual(sc.bounds(), (self.timezone.localize(datetime.datetime(2013, 1, 1, 22, 0)), None))
+
+class JSONSimpleScheduleTest(SimpleScheduleTest):
+    from_json = True
+
+class JSONSimpleIntervalScheduleTest(SimpleIntervalScheduleTest):
+    from_json = True
+
+class JSONAncientScheduleTest(AncientScheduleTest):
+    from_json = True
+
+class JSONFutureScheduleTest(FutureScheduleTest):
+    from_json = True
+
+class JSONExceptionsScheduleTest(ExceptionsScheduleTest):
+    from_json = True
+
+class JSONManyExceptionsScheduleTest(ManyExceptionsScheduleTest):
+    from_json = True
+
+class JSONWeekdaysScheduleTest(WeekdaysScheduleTest):
+    from_json = True
+
+class LocalizeTest(TestCase):
+
+    zones = ['America/Montreal', 'America/St_Johns', 'Europe/London', 'Australia/Lord_Howe', 'Asia/Kolkata', 'UTC']
+
+    def _times(self, tz):
+        """Wall times around each of the zone's transitions, under each of its offsets."""
+        offsets = set(info[0] for info in getattr(tz, '_transition_info', [(datetime.timedelta(0),)]))
+        for transition in getattr(tz, '_utc_transition_times', [datetime.datetime(2013, 3, 10, 7)])[1:]:
+            for minutes in range(-90, 91, 30):
+                for offset in offsets:
+                    yield transition + offset + datetime.timedelta(minutes=minutes)
+
+    def test_matches_pytz(self):
+        for name in self.zones:
+            tz = pytz.timezone(name)
+            for value in self._times(tz):
+                for is_dst in (False, True, None):
+                    try:
+                        expected = tz.localize(value, is_dst=is_dst)
+                    except (pytz.AmbiguousTimeError, pytz.NonExistentTimeError) as e:
+                        self.assertRaises(type(e), localize, value, tz, is_dst)
+                        continue
+                    result = localize(value, tz, is_dst)
+                    self.assertEqual(result, expected)
+                    self.assertTrue(result.tzinfo is expected.tzinfo, (name, value, is_dst))
+
+    @skipIf(zoneinfo is None, "zoneinfo isn't available")
+    def test_zoneinfo(self):
+        for name in self.zones:
+            tz = pytz.timezone(name)
+            zone = zoneinfo.ZoneInfo(name)
+            for value in self._times(tz):
+                if value.year < 1970:
+                    continue
+                for is_dst in (False, True, None):
+                    try:
+                        expected = tz.localize(value, is_dst=is_dst)
+                    except (pytz.AmbiguousTimeError, pytz.NonExistentTimeError) as e:
+                        self.assertRaises(type(e), localize, value, zone, is_dst)
+                        continue
+                    result = localize(value, zone, is_dst)
+                    self.assertEqual(result.utcoffset(), expected.utcoffset(), (name, value, is_dst))
+                    self.assertTrue(result.tzinfo is zone)
+
+    @skipIf(zoneinfo is None, "zoneinfo isn't available")
+    def test_make_aware(self):
+        # pytz zones reject ambiguous and skipped times; other tzinfos are
+        # attached as they are, as they always have been
+        ambiguous = datetime.datetime(2013, 11, 3, 1, 30)
+        skipped = datetime.datetime(2013, 3, 10, 2, 30)
+        tz = pytz.timezone('America/Vancouver')
+        zone = zoneinfo.ZoneInfo('America/Vancouver')
+        for value in (ambiguous, skipped):
+            self.assertRaises((pytz.AmbiguousTimeError, pytz.NonExistentTimeError), make_aware, value, tz)
+            self.assertEqual(make_aware(value, zone), value.replace(tzinfo=zone))
+        self.assertEqual(make_aware(datetime.datetime(2013, 6, 1), tz).utcoffset(), datetime.timedelta(hours=-7))
+        self.assertEqual(make_aware(datetime.datetime.max, tz), datetime.datetime.max.replace(tzinfo=tz))
+
+    @skipIf(zoneinfo is None, "zoneinfo isn't available")
+    def test_zoneinfo_schedule(self):
+        elem = etree.fromstring(ManyExceptionsScheduleTest.data)
+        start = datetime.datetime(2013, 3, 1, tzinfo=pytz.utc)
+        end = datetime.datetime(2013, 11, 30, tzinfo=pytz.utc)
+        self.assertEqual(
+            list(Schedule.from_element(elem, zoneinfo.ZoneInfo('America/Montreal')).intervals(start, end)),
+            list(Schedule.from_element(elem, pytz.timezone('America/Montreal')).intervals(start, end)))
@@ -0,0 +1,58 @@
+# coding: utf-8
+import copy
+from unittest import TestCase
+
+from open511.converter import compiled_json_doc_to_xml
+from open511.tests.converter import load_fixture
+from open511.utils.search import SearchIndex, tokenize
+
+class TokenizeTest(TestCase):
+
+    def test_languages(self):
+        self.assertEqual(tokenize(u"Fermeture de l'autoroute jusqu’à Québec", 'fr-CA'),
+            ['fermeture', 'de', 'autoroute', 'a', 'quebec'])
+        self.assertEqual(tokenize(u"Driver's lane: CLOSED", 'en'), ['driver', 'lane', 'closed'])
+        self.assertEqual(tokenize(u"l'autoroute", 'en'), ["l'autoroute"])
+
+class SearchIndexTest(TestCase):
+
+    def setUp(self):
+        self.doc = load_fixture()
+        self.index = SearchIndex(self.doc)
+
+    def ids(self, query):
+        return [event['id'] for event, score in self.index.search(query)]
+
+    def test_search(self):
+        self.assertEqual(self.ids('highway 1'), ['drivebc.ca/DBC-11012'])
+        self.assertEqual(self.ids('"highway 99"'), ['drivebc.ca/DBC-11240'])
+        self.assertEqual(self.ids('"99 highway"'), [])
+        self.assertEqual(self.ids('sherb*'), ['quebec511.info/1788'])
+        self.assertEqual(self.ids(u'"rue jeanne*" fêtes* festival'), [])
+        self.assertEqual(self.ids(u'"rue jeanne*" festival'), ['quebec511.info/1802'])
+        self.assertEqual(len(self.ids('highway')), 3)
+        self.assertEqual(self.ids('alternating'), ['drivebc.ca/DBC-11012'])
+
+    def test_xml(self):
+        index = SearchIndex(compiled_json_doc_to_xml(copy.deepcopy(self.doc), lang='fr'))
+        results = index.search("l'aqueduc")
+        self.assertEqual([event.findtext('id') for event, score in results], ['quebec511.info/1788'])
+
+    def test_json_french(self):
+        for query in ("d'aqueduc", "l'aqueduc", 'aqueduc', u'd’aqueduc'):
+            self.assertEqual(self.ids(query), ['quebec511.info/1788'])
+        self.assertEqual(self.ids(u'"fermeture complète" sherbrooke'), ['quebec511.info/1788'])
+        index = SearchIndex(self.doc, json_lang='en')
+        self.assertEqual([event['id'] for event, score in index.search("d'aqueduc", lang='en')],
+            ['quebec511.info/1788'])
+
+    def test_incremental(self):
+        event = copy.deepcopy(self.doc['events'][0])
+        event['headline'] = 'Paving on Highway 7'
+        self.index.add(event)
+        self.assertEqual(len(self.index), 6)
+        self.assertEqual(self.ids('bridge'), [])
+        self.assertEqual(self.ids('paving'), ['drivebc.ca/DBC-11012'])
+        self.index.remove(['drivebc.ca/DBC-11012'])
+        self.assertEqual(self.ids('paving'), [])
+        self.assertFalse('paving' in self.index._postings)
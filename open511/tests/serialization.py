@@ -0,0 +1,138 @@
+import codecs
+import io
+import json
+import os
+from unittest import TestCase, skipIf
+
+from open511.utils import serialization
+from open511.utils.serialization import deserialize, sniff_format
+
+XML_DOC = b'\n<?xml version="1.0" encoding="UTF-8"?>\n<!-- comment -->\n<open511 version="v1"><events /></open511>'
+JSON_DOC = b' \n{"meta": {"version": "v1"}, "events": []}'
+
+class SniffFormatTest(TestCase):
+
+    def test_sniff(self):
+        self.assertEqual(sniff_format(XML_DOC), 'xml')
+        self.assertEqual(sniff_format(XML_DOC.decode('utf8')), 'xml')
+        self.assertEqual(sniff_format(b'\xef\xbb\xbf' + JSON_DOC), 'json')
+        self.assertEqual(sniff_format(JSON_DOC.decode('utf8')), 'json')
+        self.assertEqual(sniff_format(b'<?xml version="1.0"?><soap:Envelope><x><FEU>'), 'tmdd')
+        self.assertEqual(sniff_format(b'<open511><events><FEU>'), 'xml')
+        self.assertEqual(sniff_format(b'Not a document'), None)
+
+    def test_tmdd_fixture(self):
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'tmdd-input-1.xml'), 'rb') as f:
+            self.assertEqual(sniff_format(f.read(8192)), 'tmdd')
+
+class DeserializeTest(TestCase):
+
+    def test_inputs(self):
+        for content in (XML_DOC, XML_DOC.decode('utf8')[1:], io.BytesIO(XML_DOC), memoryview(XML_DOC)):
+            doc, doc_format = deserialize(content)
+            self.assertEqual(doc_format, 'xml')
+            self.assertEqual(doc.tag, 'open511')
+        for content in (JSON_DOC, JSON_DOC.decode('utf8'), io.BytesIO(JSON_DOC), memoryview(JSON_DOC)):
+            self.assertEqual(deserialize(content), ({'meta': {'version': 'v1'}, 'events': []}, 'json'))
+
+    def test_garbage(self):
+        self.assertRaises(Exception, deserialize, b'Not a document')
+
+    def test_utf16(self):
+        xml = XML_DOC.decode('utf8').lstrip()
+        for bom, encoding in ((codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be'),
+                (codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be')):
+            encoded = bom + xml.replace('UTF-8', encoding[:6].upper()).encode(encoding)
+            self.assertEqual(sniff_format(encoded[:9]), 'xml', encoding)
+            for content in (encoded, memoryview(encoded), io.BytesIO(encoded)):
+                doc, doc_format = deserialize(content)
+                self.assertEqual((doc.tag, doc_format), ('open511', 'xml'), encoding)
+            encoded = bom + JSON_DOC.decode('utf8').encode(encoding)
+            self.assertEqual(deserialize(encoded), ({'meta': {'version': 'v1'}, 'events': []}, 'json'))
+
+    def test_leading_whitespace(self):
+        # The rest of the document is handed on without being copied
+        loaded = []
+        original = serialization.json_loads
+        serialization.json_loads = lambda s: loaded.append(type(s)) or original(s)
+        try:
+            self.assertEqual(deserialize(JSON_DOC)[1], 'json')
+        finally:
+            serialization.json_loads = original
+        self.assertEqual(loaded, [memoryview])
+
+class BinaryFormatsTest(TestCase):
+
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'open511-events.json')) as f:
+            self.doc = json.load(f)
+
+    def _round_trip(self, dumps, doc_format):
+        for string_table in (False, True):
+            encoded = dumps(self.doc, string_table=string_table)
+            self.assertEqual(sniff_format(encoded[:10]), doc_format)
+            for content in (encoded, memoryview(encoded), io.BytesIO(encoded)):
+                self.assertEqual(deserialize(content), (self.doc, 'json'))
+        self.assertTrue(len(dumps(self.doc, string_table=True)) < len(dumps(self.doc)))
+
+    @skipIf(serialization.msgpack is None, "msgpack isn't installed")
+    def test_msgpack(self):
+        self._round_trip(serialization.msgpack_dumps, 'msgpack')
+
+    @skipIf(serialization.cbor2 is None, "cbor2 isn't installed")
+    def test_cbor(self):
+        self._round_trip(serialization.cbor_dumps, 'cbor')
+
+class JSONBackendTest(TestCase):
+
+    def setUp(self):
+        self.original = serialization.json_backend.name
+        self.environ = os.environ.pop('OPEN511_JSON_BACKEND', None)
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'open511-events.json')) as f:
+            self.doc = json.load(f)
+
+    def tearDown(self):
+        os.environ.pop('OPEN511_JSON_BACKEND', None)
+        if self.environ is not None:
+            os.environ['OPEN511_JSON_BACKEND'] = self.environ
+        serialization.set_json_backend(self.original)
+
+    def test_select(self):
+        for name in serialization.JSON_BACKENDS:
+            self.assertEqual(serialization.set_json_backend(name).name, name)
+            self.assertEqual(serialization.json_backend.name, name)
+        self.assertRaises(ValueError, serialization.set_json_backend, 'simplejson')
+
+    def test_environment(self):
+        # Without OPEN511_JSON_BACKEND, the fastest installed library is used
+        preferred = [n for n in ('orjson', 'ujson', 'json') if n in serialization.JSON_BACKENDS][0]
+        self.assertEqual(serialization.set_json_backend().name, preferred)
+        os.environ['OPEN511_JSON_BACKEND'] = 'json'
+        self.assertEqual(serialization.set_json_backend().name, 'json')
+        # An explicit name overrides the environment
+        if 'ujson' in serialization.JSON_BACKENDS:
+            self.assertEqual(serialization.set_json_backend('ujson').name, 'ujson')
+        os.environ['OPEN511_JSON_BACKEND'] = 'simplejson'
+        self.assertRaises(ValueError, serialization.set_json_backend)
+
+    def test_output(self):
+        doc = dict(self.doc, extra=[u'\xe9/" ', 1.5, 0.1, 1e-7, 1e20, -0.0, 2 ** 70, None, True])
+        outputs = {}
+        pretty_outputs = set()
+        for name in serialization.JSON_BACKENDS:
+            serialization.set_json_backend(name)
+            pretty, compact = serialization.json_dumps(self.doc), serialization.json_dumps(self.doc, compact=True)
+            self.assertTrue(isinstance(compact, bytes))
+            self.assertTrue(b'\n' in pretty and b'\n' not in compact)
+            self.assertTrue(len(compact) < len(pretty))
+            outputs[name] = (pretty, compact)
+            for content in (pretty, compact, memoryview(compact), compact.decode('utf8')):
+                self.assertEqual(serialization.json_loads(content), self.doc)
+            pretty_outputs.add(serialization.json_dumps(doc))
+            # Compact floats may be written differently, but always read back the same,
+            # and integers too wide for orjson fall back to the stdlib
+            self.assertEqual(json.loads(serialization.json_dumps(doc, compact=True).decode('utf8')), doc)
+        # Pretty output is the same from every backend, and the Open511
+        # documents themselves come out byte for byte the same either way
+        self.assertEqual(len(pretty_outputs), 1)
+        self.assertEqual(len(set(outputs.values())), 1)
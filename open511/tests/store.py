@@ -0,0 +1,134 @@
+# coding: utf-8
+import copy
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pytz
+
+from open511.converter import compiled_json_doc_to_xml
+from open511.tests.converter import load_fixture
+from open511.utils.collection import EventCollection
+from open511.utils.filters import EventFilter
+from open511.utils.store import EventStore
+
+class EventFilterTest(TestCase):
+
+    def test_from_params(self):
+        f = EventFilter.from_params({'severity': 'major,Moderate', 'updated': ['>2013-01-01', '<=2013-02-01T12:00-05:00']})
+        self.assertEqual(f.status, set(['ACTIVE']))
+        self.assertEqual(f.severity, set(['MAJOR', 'MODERATE']))
+        self.assertEqual(f.updated, [('>', datetime.datetime(2013, 1, 1, tzinfo=pytz.utc)),
+            ('<=', datetime.datetime(2013, 2, 1, 17, tzinfo=pytz.utc))])
+        self.assertEqual(EventFilter.from_params({'status': 'ALL'}).status, None)
+        self.assertRaises(ValueError, EventFilter.from_params, {'bbox': '1,2,3'})
+        self.assertRaises(ValueError, EventFilter.from_params, {'updated': '>yesterday'})
+
+    def test_dst_times(self):
+        tz = pytz.timezone('America/Vancouver')
+        # Repeated and skipped local times are taken as standard time
+        f = EventFilter.from_params({'updated': ['>2013-11-03T01:30', '<2013-03-10T02:30']}, default_timezone=tz)
+        self.assertEqual(f.updated, [('>', datetime.datetime(2013, 11, 3, 9, 30, tzinfo=pytz.utc)),
+            ('<', datetime.datetime(2013, 3, 10, 10, 30, tzinfo=pytz.utc))])
+
+    def test_naive_times(self):
+        doc = load_fixture()
+        doc['events'][0]['updated'] = '2013-06-12T12:00:00'
+        params = {'updated': '>2013-01-01', 'status': 'ALL'}
+        f = EventFilter.from_params(params)
+        self.assertFalse(f.matches(doc['events'][0]))
+        expected = [e['id'] for e in doc['events'] if f.matches(e)]
+        self.assertEqual([e['id'] for e in EventCollection(doc).query(params)], expected)
+        store = EventStore(':memory:')
+        store.upsert(doc)
+        self.assertEqual(sorted(e['id'] for e in store.query(params)), sorted(expected))
+
+    def test_matches(self):
+        event = load_fixture()['events'][0]
+        self.assertTrue(EventFilter.from_params({'road_name': 'HIGHWAY 1', 'bbox': '-123,49,-122,50'}).matches(event))
+        self.assertFalse(EventFilter.from_params({'jurisdiction': 'quebec511.info'}).matches(event))
+        self.assertFalse(EventFilter.from_params({'updated': '>2013-05-03T17:15Z'}).matches(event))
+
+class EventStoreTest(TestCase):
+
+    def setUp(self):
+        self.doc = load_fixture()
+        self.store = EventStore(default_timezone='America/Edmonton')
+        self.store.upsert(self.doc)
+
+    def tearDown(self):
+        self.store.close()
+
+    def ids(self, params):
+        return sorted(e['id'] for e in self.store.query(params))
+
+    def test_upsert(self):
+        self.assertEqual(len(self.store), 6)
+        self.assertEqual(self.store.upsert(compiled_json_doc_to_xml(copy.deepcopy(self.doc))), 0)
+        changed = copy.deepcopy(self.doc['events'][:2])
+        changed[0]['updated'] = '2013-05-04T10:15:00-07:00'
+        changed[0]['roads'] = [{'name': 'Highway 7'}]
+        self.assertEqual(self.store.upsert(changed), 1)
+        self.assertEqual(self.store.get('drivebc.ca/DBC-11012'), changed[0])
+        self.assertEqual(self.ids({'road_name': 'Highway 1'}), [])
+        self.assertEqual(self.ids({'road_name': 'highway 7'}), ['drivebc.ca/DBC-11012'])
+        self.store.delete(['drivebc.ca/DBC-11012'])
+        self.assertEqual(len(self.store), 5)
+
+    def test_upsert_xml(self):
+        changed = copy.deepcopy(self.doc)
+        changed['events'][3]['updated'] = '2013-06-21T10:00:00-04:00'
+        changed['events'][3]['severity'] = 'MAJOR'
+        self.assertEqual(self.store.upsert(compiled_json_doc_to_xml(copy.deepcopy(changed))), 1)
+        self.assertEqual(self.store.get('quebec511.info/1802'), changed['events'][3])
+        self.assertEqual(self.store.upsert(changed), 0)
+
+    def test_query(self):
+        all_events = self.doc['events']
+        for params in ({}, {'status': 'ALL'}, {'severity': 'MAJOR', 'status': 'ALL'}, {'event_type': 'construction'},
+                {'bbox': '-124,48,-122,50'}, {'jurisdiction': '511.alberta.ca'}, {'road_name': 'Rue Jeanne-Mance'},
+                {'updated': ['>=2013-02-01', '<2013-06-01T00:00Z'], 'status': 'ALL'}):
+            f = EventFilter.from_params(params)
+            self.assertEqual(self.ids(params), sorted(e['id'] for e in all_events if f.matches(e)), params)
+
+    def test_road_name_case(self):
+        event = copy.deepcopy(self.doc['events'][3])
+        event['updated'] = '2013-06-21T10:00:00-04:00'
+        event['roads'] = [{'name': u'Rue Émile-Zola'}]
+        self.store.upsert([event])
+        collection = EventCollection([event])
+        for name in (u'rue émile-zola', u'RUE ÉMILE-ZOLA'):
+            self.assertEqual(self.ids({'road_name': name}), ['quebec511.info/1802'])
+            self.assertEqual([e['id'] for e in collection.query({'road_name': name})], ['quebec511.info/1802'])
+
+    def test_upgrade(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'events.db')
+            store = EventStore(path)
+            store.upsert(self.doc)
+            # Road names as stored by the first version of the schema
+            store.conn.execute("UPDATE event_roads SET name = 'Rue Sherbrooke' WHERE name = 'rue sherbrooke'")
+            store.conn.execute('PRAGMA user_version = 0')
+            store.conn.commit()
+            store.close()
+            store = EventStore(path)
+            self.assertEqual([e['id'] for e in store.query({'road_name': 'rue sherbrooke', 'status': 'ALL'})],
+                ['quebec511.info/1788'])
+            store.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_in_effect(self):
+        # 2013-07-01 is an exception day for DBC-11012
+        self.assertEqual(self.ids({'in_effect_on': '2013-07-01'}),
+            ['511.alberta.ca/44', 'drivebc.ca/DBC-11240', 'quebec511.info/1802'])
+        self.assertEqual(self.ids({'in_effect_on': '2013-02-03T08:00,2013-02-03T08:30'}),
+            ['511.alberta.ca/44', '511.alberta.ca/52'])
+
+    def test_export(self):
+        doc = self.store.export({'severity': 'MINOR'}, 'json', serialize=False)
+        self.assertEqual([e['id'] for e in doc['events']], ['quebec511.info/1802'])
+        self.assertTrue(self.store.export({}, 'kml').startswith(b'<kml'))
@@ -0,0 +1,61 @@
+import copy
+import datetime
+from unittest import TestCase
+
+import pytz
+
+from open511.converter import compiled_json_doc_to_xml
+from open511.tests.converter import load_fixture
+from open511.utils.timeline import ActiveTimeline
+
+START = datetime.datetime(2013, 6, 28, 12, tzinfo=pytz.utc)
+
+class ActiveTimelineTest(TestCase):
+
+    def setUp(self):
+        self.doc = load_fixture()
+        self.timeline = ActiveTimeline(self.doc, start=START, default_timezone='America/Edmonton')
+
+    def expected(self, timeline):
+        """Checks every bucket with Schedule.active_within_range."""
+        result = []
+        tiny = datetime.timedelta(microseconds=1)
+        for i in range(len(timeline.counts())):
+            bucket_start = timeline.start + timeline.bucket * i
+            result.append([
+                event_id for event_id, schedule in sorted(
+                    (timeline._ids[p], s) for p, s in timeline._schedules.items())
+                if schedule and schedule.active_within_range(bucket_start + tiny, bucket_start + timeline.bucket - tiny)
+            ])
+        return result
+
+    def test_buckets(self):
+        buckets = list(self.timeline.buckets())
+        self.assertEqual(len(buckets), 7 * 24)
+        self.assertEqual([sorted(ids) for start, ids in buckets], self.expected(self.timeline))
+        # 2013-07-01 is an exception day for DBC-11012; its nightly closure is back on the 2nd
+        self.assertNotIn('drivebc.ca/DBC-11012', self.timeline.active(datetime.datetime(2013, 7, 2, 4, 30)))
+        self.assertIn('drivebc.ca/DBC-11012', self.timeline.active(datetime.datetime(2013, 7, 3, 4, 30)))
+        self.assertEqual(self.timeline.active(datetime.datetime(2014, 1, 1)), [])
+
+    def test_xml(self):
+        timeline = ActiveTimeline(compiled_json_doc_to_xml(copy.deepcopy(self.doc)), start=START,
+            default_timezone='America/Edmonton')
+        self.assertEqual(list(timeline.buckets()), list(self.timeline.buckets()))
+
+    def test_update(self):
+        event = copy.deepcopy(self.doc['events'][3])
+        event['schedule'] = {'intervals': ['2013-06-29T08:00/2013-06-29T10:00']}
+        self.timeline.update([event])
+        self.timeline.remove(['511.alberta.ca/44'])
+        self.assertEqual(len(self.timeline), 5)
+        self.assertEqual(self.timeline.active(datetime.datetime(2013, 6, 29, 12, 59)),
+            ['drivebc.ca/DBC-11240', 'quebec511.info/1802'])
+        self.assertEqual(self.timeline.active(datetime.datetime(2013, 6, 29, 14, 0)), ['drivebc.ca/DBC-11240'])
+        self.assertEqual([sorted(ids) for start, ids in self.timeline.buckets()], self.expected(self.timeline))
+
+    def test_advance(self):
+        self.timeline.advance(START + datetime.timedelta(days=2, minutes=30))
+        self.assertEqual(self.timeline.start, START + datetime.timedelta(days=2))
+        fresh = ActiveTimeline(self.doc, start=START + datetime.timedelta(days=2), default_timezone='America/Edmonton')
+        self.assertEqual(list(self.timeline.buckets()), list(fresh.buckets()))
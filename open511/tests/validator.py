@@ -0,0 +1,49 @@
+import copy
+import io
+from unittest import TestCase
+
+from lxml import etree
+
+from open511.converter import compiled_json_doc_to_xml
+from open511.tests.converter import load_fixture
+from open511.validator import validate_stream, Open511ValidationError
+
+class StreamValidationTest(TestCase):
+
+    def setUp(self):
+        self.doc = compiled_json_doc_to_xml(load_fixture(),
+            custom_namespace='http://validator.open511.org/custom-field')
+
+    def _stream(self, doc):
+        return io.BytesIO(etree.tostring(doc, pretty_print=True))
+
+    def test_valid(self):
+        self.assertEqual(validate_stream(self._stream(self.doc)), 6)
+
+    def test_errors(self):
+        doc = copy.deepcopy(self.doc)
+        doc.find('events/event[2]/status').text = 'UNKNOWN'
+        doc.find('events/event[4]/link[@rel="jurisdiction"]').set('href', '/jurisdictions/1')
+        etree.SubElement(doc, 'pagination').append(etree.Element('link', rel='up', href='/'))
+        errors = []
+        with self.assertRaises(Open511ValidationError) as cm:
+            validate_stream(self._stream(doc), on_error=errors.append)
+        # Every invalid event is reported, not just the first
+        self.assertEqual([(e.id, e.line) for e in errors], [
+            ('drivebc.ca/DBC-11240', 70), ('quebec511.info/1802', 130), (None, 1)])
+        self.assertTrue('Jurisdiction links must be absolute URLs' in errors[1].message)
+        self.assertTrue('Pagination links must be next or previous' in errors[2].message)
+        self.assertTrue('Event quebec511.info/1802 (line 130)' in str(cm.exception))
+
+    def test_invalid_envelope(self):
+        for attribute, value in (('version', None), ('version', 'v2'), ('{http://www.w3.org/XML/1998/namespace}lang', '')):
+            doc = copy.deepcopy(self.doc)
+            if value is None:
+                del doc.attrib[attribute]
+            else:
+                doc.set(attribute, value)
+            errors = []
+            with self.assertRaises(Open511ValidationError):
+                validate_stream(self._stream(doc), on_error=errors.append)
+            # Reported once, not for every event
+            self.assertEqual([(e.id, e.line) for e in errors], [(None, 1)])
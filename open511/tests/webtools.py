@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import io
+import time
+from unittest import TestCase, skipIf
+
+try:
+    import flask
+    from open511 import webtools
+    from open511.webtools.workers import WorkerPool, Overloaded, WorkerTimeout
+except ImportError:
+    flask = webtools = None
+
+from open511.tests.serialization import JSON_DOC
+
+BODY = b'<open511>' + b'<event />' * 200 + b'</open511>'
+
+def _test_app():
+    app = flask.Flask(__name__)
+
+    @app.route('/doc', methods=['GET', 'POST'])
+    @webtools.conditional
+    def doc():
+        return flask.Response(BODY, mimetype='application/xml')
+
+    @app.route('/small')
+    @webtools.conditional
+    def small():
+        return flask.Response(b'<open511 />', mimetype='application/xml')
+
+    app.after_request(webtools.compress_response)
+    return app
+
+@skipIf(webtools is None, "The web tools' requirements aren't installed")
+class ConditionalTest(TestCase):
+
+    def setUp(self):
+        self.client = _test_app().test_client()
+        self.etag = hashlib.sha1(BODY).hexdigest()
+
+    def test_etag(self):
+        resp = self.client.get('/doc')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, BODY)
+        self.assertEqual(resp.headers['ETag'], '"%s"' % self.etag)
+        self.assertEqual(resp.headers['Cache-Control'], webtools.NO_CACHE)
+        self.assertEqual(self.client.get('/doc?cacheable=1').headers['Cache-Control'],
+            'public, max-age=%d' % webtools.CONVERT_MAX_AGE)
+
+    def test_not_modified(self):
+        for method in ('GET', 'HEAD'):
+            resp = self.client.open('/doc?cacheable=1', method=method,
+                headers={'If-None-Match': '"other", "%s"' % self.etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+            self.assertEqual(resp.headers['ETag'], '"%s"' % self.etag)
+            self.assertEqual(resp.headers['Cache-Control'], 'public, max-age=%d' % webtools.CONVERT_MAX_AGE)
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        # A compressed variant's ETag matches too
+        resp = self.client.get('/doc', headers={'If-None-Match': '"%s-gzip"' % self.etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], '"%s-gzip"' % self.etag)
+        self.assertEqual(self.client.get('/doc', headers={'If-None-Match': '"other"'}).status_code, 200)
+        self.assertEqual(self.client.post('/doc', headers={'If-None-Match': '"%s"' % self.etag}).status_code, 200)
+
+    def test_gzip(self):
+        resp = self.client.get('/doc', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['ETag'], '"%s-gzip"' % self.etag)
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(resp.data)).read(), BODY)
+        # The compressed body is deterministic, so its ETag is stable
+        self.assertEqual(self.client.get('/doc', headers={'Accept-Encoding': 'gzip'}).data, resp.data)
+
+    @skipIf(webtools is None or webtools.brotli is None, "brotli isn't installed")
+    def test_brotli(self):
+        for accept in ('br', 'gzip, deflate, br', 'gzip;q=0.5, br'):
+            resp = self.client.get('/doc', headers={'Accept-Encoding': accept})
+            self.assertEqual(resp.headers['Content-Encoding'], 'br')
+            self.assertEqual(resp.headers['ETag'], '"%s-br"' % self.etag)
+            self.assertEqual(webtools.brotli.decompress(resp.data), BODY)
+        resp = self.client.get('/doc', headers={'Accept-Encoding': 'gzip, br;q=0.5'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+
+    def test_uncompressed(self):
+        for path, accept in (('/doc', 'identity'), ('/doc', None), ('/small', 'gzip, br')):
+            headers = {'Accept-Encoding': accept} if accept else {}
+            resp = self.client.get(path, headers=headers)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            self.assertEqual(resp.headers['ETag'], '"%s"' % hashlib.sha1(resp.data).hexdigest())
+
+def _wait_for_slot(pool, timeout=30):
+    deadline = time.time() + timeout
+    while not pool.slots.acquire(False):
+        if time.time() > deadline:
+            raise AssertionError("The worker pool's slots weren't released")
+        time.sleep(0.05)
+    pool.slots.release()
+
+@skipIf(webtools is None, "The web tools' requirements aren't installed")
+class WorkerPoolTest(TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(1, max_pending=1, timeout=30)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_run(self):
+        self.assertEqual(self.pool.run(abs, -1), 1)
+        self.assertEqual(self.pool.run(webtools.convert_document, JSON_DOC, 'json', True),
+            b'{"meta":{"version":"v1"},"events":[]}')
+        self.assertRaises(ZeroDivisionError, self.pool.run, divmod, 1, 0)
+
+    def test_timeout(self):
+        # Start the worker process first, so that only the job itself is timed
+        self.pool.run(abs, -1)
+        self.pool.timeout = 0.1
+        self.assertRaises(WorkerTimeout, self.pool.run, time.sleep, 1)
+        # The job still holds its slot until it's finished
+        self.assertRaises(Overloaded, self.pool.run, abs, -1)
+        _wait_for_slot(self.pool)
+        self.assertEqual(self.pool.run(abs, -1), 1)
+
+@skipIf(webtools is None, "The web tools' requirements aren't installed")
+class WorkerErrorsTest(TestCase):
+
+    def setUp(self):
+        self.client = webtools.app.test_client()
+        self.original = webtools.worker_pool, webtools.WORKER_MIN_SIZE
+        webtools.WORKER_MIN_SIZE = 0
+        webtools.worker_pool = self.pool = WorkerPool(1, max_pending=1, timeout=30)
+
+    def tearDown(self):
+        webtools.worker_pool, webtools.WORKER_MIN_SIZE = self.original
+        self.pool.shutdown()
+
+    def _convert(self):
+        return self.client.post('/convert', data={'doc_content': JSON_DOC, 'format': 'json'})
+
+    def test_pool(self):
+        resp = self._convert()
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'"version"', resp.data)
+
+    def test_overloaded(self):
+        self.pool.slots.acquire(False)
+        try:
+            resp = self._convert()
+        finally:
+            self.pool.slots.release()
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '10')
+        self.assertEqual(resp.mimetype, 'text/plain')
+
+    def test_timeout(self):
+        self.pool.timeout = 0.001
+        resp = self._convert()
+        self.assertEqual(resp.status_code, 504)
+        self.assertEqual(resp.mimetype, 'text/plain')
+        _wait_for_slot(self.pool)
@@ -0,0 +1,27 @@
+"""Sets of small non-negative integers, e.g. event positions, kept as Python
+ints with bit n set for each member n. Intersections and unions are then
+single big-integer operations."""
+import binascii
+
+def bitset(positions):
+    """Returns an int with the bits at the given positions set."""
+    positions = list(positions)
+    if not positions:
+        return 0
+    data = bytearray((max(positions) >> 3) + 1)
+    for p in positions:
+        data[p >> 3] |= 1 << (p & 7)
+    data.reverse()
+    return int(binascii.hexlify(bytes(data)), 16)
+
+def positions(bits):
+    """Yields the positions of the set bits in an int, in ascending order."""
+    digits = bin(bits)[:1:-1]
+    i = digits.find('1')
+    while i != -1:
+        yield i
+        i = digits.find('1', i + 1)
+
+def count(bits):
+    """The number of set bits."""
+    return bin(bits).count('1')
@@ -0,0 +1,266 @@
+"""
+An in-memory, indexed collection of Open511 events, for answering Open511
+API-style queries without scanning every event.
+
+    events = EventCollection(doc)
+    events.query({'severity': 'MAJOR,MODERATE', 'updated': '>2013-06-01'})
+    events.export({'road_name': 'Highway 1'}, 'atom')
+
+Sets of events are Python ints used as bitsets, bit n standing for the nth
+event added, so that combining filters is a few big-integer ANDs. Replaced
+and removed events are taken out of the indexes, and once they outnumber
+the events left, the rest are renumbered so the bitsets don't keep growing.
+"""
+from bisect import bisect_left, bisect_right
+
+import pytz
+
+from open511.converter import open511_convert
+from open511.converter.o5json import compiled_xml_to_json
+from open511.utils.filters import EventFilter
+from open511.utils.bitset import bitset, positions
+from open511.utils.geometry import bbox
+from open511.utils.schedule import Schedule
+from open511.utils.timezone import epoch_seconds, parse_datetime
+
+# Filters answered with an inverted index: filter name -> function giving
+# an event's values for it
+_INDEXED_FIELDS = {
+    'status': lambda e: [e.get('status')],
+    'severity': lambda e: [e.get('severity')],
+    'event_type': lambda e: [e.get('event_type')],
+    'jurisdiction': lambda e: [e.get('id', '').partition('/')[0]],
+    'road_name': lambda e: [road['name'].lower() for road in e.get('roads', []) if road.get('name')],
+    'area_id': lambda e: [area['id'] for area in e.get('areas', []) if area.get('id')],
+}
+
+_INFINITY = float('inf')
+
+def _timestamp(value):
+    dt = parse_datetime(value) if value else None
+    if dt is None or dt.tzinfo is None:
+        return None
+    return epoch_seconds(dt)
+
+class _SortedIndex(object):
+    """Event positions sorted on a numeric key, for range filters."""
+
+    def __init__(self):
+        self.entries = []
+
+    def extend(self, entries):
+        self.entries.extend(entries)
+        self.entries.sort()
+
+    def discard(self, positions):
+        """Removes the entries for a set of positions."""
+        self.entries = [entry for entry in self.entries if entry[1] not in positions]
+
+    def select(self, op, key):
+        """Returns a bitset of the events whose key compares to key with op."""
+        lower = bisect_left(self.entries, (key, -1))
+        upper = bisect_right(self.entries, (key, _INFINITY))
+        if op == '=':
+            selected = self.entries[lower:upper]
+        elif op == '>':
+            selected = self.entries[upper:]
+        elif op == '>=':
+            selected = self.entries[lower:]
+        elif op == '<':
+            selected = self.entries[:lower]
+        else:
+            selected = self.entries[:upper]
+        return bitset(position for _, position in selected)
+
+class EventCollection(object):
+    """Open511 events held in memory with indexes on the API filters.
+
+    Events are added from XML or JSON documents with add(); an event with the
+    same id as one already in the collection replaces it. Schedules of
+    events without a timezone field are interpreted in default_timezone."""
+
+    def __init__(self, doc=None, default_timezone='UTC'):
+        self.default_timezone = default_timezone
+        self._timezones = {}
+        self._reset()
+        if doc is not None:
+            self.add(doc)
+
+    def _reset(self):
+        self._events = []
+        self._schedules = {}
+        self._bboxes = []
+        self._by_id = {}
+        self._live = 0
+        self._index = dict((field, {}) for field in _INDEXED_FIELDS)
+        self._updated = _SortedIndex()
+        self._created = _SortedIndex()
+        self._schedule_starts = _SortedIndex()
+        self._schedule_ends = _SortedIndex()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return (self._events[p] for p in positions(self._live))
+
+    def _timezone(self, name):
+        name = name or self.default_timezone
+        tz = self._timezones.get(name)
+        if tz is None:
+            tz = self._timezones[name] = pytz.timezone(name)
+        return tz
+
+    def _schedule(self, position):
+        schedule = self._schedules.get(position)
+        if schedule is None:
+            event = self._events[position]
+            schedule = self._schedules[position] = Schedule.from_json(
+                event['schedule'], self._timezone(event.get('timezone')))
+        return schedule
+
+    def add(self, doc):
+        """Adds the events in an Open511 document: an lxml Element, a JSON
+        dict, or a list of JSON events."""
+        if getattr(doc, 'tag', None) is not None:
+            doc = compiled_xml_to_json(doc)
+        events = doc.get('events', []) if isinstance(doc, dict) else doc
+        self._add(events)
+        self._collect()
+
+    def _add(self, events):
+        postings = dict((field, {}) for field in _INDEXED_FIELDS)
+        sorted_entries = dict((index, []) for index in (
+            self._updated, self._created, self._schedule_starts, self._schedule_ends))
+        replaced = []
+        added = []
+        for event in events:
+            position = len(self._events)
+            previous = self._by_id.get(event['id'])
+            if previous is not None:
+                replaced.append(previous)
+            self._by_id[event['id']] = position
+            self._events.append(event)
+            added.append(position)
+            for field, get_values in _INDEXED_FIELDS.items():
+                for value in get_values(event):
+                    postings[field].setdefault(value, []).append(position)
+            for index, field in ((self._updated, 'updated'), (self._created, 'created')):
+                value = _timestamp(event.get(field))
+                if value is not None:
+                    sorted_entries[index].append((value, position))
+            self._bboxes.append(bbox(event['geography']) if event.get('geography') else None)
+            if event.get('schedule'):
+                start, end = self._schedule(position).bounds()
+                if start is not None:
+                    sorted_entries[self._schedule_starts].append((epoch_seconds(start), position))
+                    sorted_entries[self._schedule_ends].append(
+                        (epoch_seconds(end) if end is not None else _INFINITY, position))
+
+        for field, values in postings.items():
+            index = self._index[field]
+            for value, value_positions in values.items():
+                index[value] = index.get(value, 0) | bitset(value_positions)
+        for index, entries in sorted_entries.items():
+            index.extend(entries)
+        self._live |= bitset(added)
+        self._discard(replaced)
+
+    def remove(self, event_ids):
+        """Removes events by id. Unknown ids are ignored."""
+        self._discard([self._by_id.pop(event_id) for event_id in event_ids if event_id in self._by_id])
+        self._collect()
+
+    def _discard(self, dead):
+        """Takes the events at the given positions out of the indexes."""
+        if not dead:
+            return
+        masks = dict((field, {}) for field in _INDEXED_FIELDS)
+        for position in dead:
+            event = self._events[position]
+            for field, get_values in _INDEXED_FIELDS.items():
+                for value in get_values(event):
+                    masks[field].setdefault(value, []).append(position)
+            self._events[position] = None
+            self._bboxes[position] = None
+            self._schedules.pop(position, None)
+        for field, values in masks.items():
+            index = self._index[field]
+            for value, value_positions in values.items():
+                bits = index[value] & ~bitset(value_positions)
+                if bits:
+                    index[value] = bits
+                else:
+                    del index[value]
+        dead = set(dead)
+        for index in (self._updated, self._created, self._schedule_starts, self._schedule_ends):
+            index.discard(dead)
+        self._live &= ~bitset(dead)
+
+    def _collect(self):
+        """Renumbers the events once there are more unused positions than
+        events, keeping their order and parsed schedules."""
+        if len(self._events) - len(self._by_id) <= len(self._by_id):
+            return
+        live = list(positions(self._live))
+        events = [self._events[p] for p in live]
+        schedules = dict((new, self._schedules[old]) for new, old in enumerate(live) if old in self._schedules)
+        self._reset()
+        self._schedules = schedules
+        self._add(events)
+
+    def _select(self, f):
+        """Returns a bitset of the events that pass every indexed filter in f."""
+        bits = self._live
+        for field in _INDEXED_FIELDS:
+            values = getattr(f, field)
+            if values is not None:
+                index = self._index[field]
+                matches = 0
+                for value in values:
+                    matches |= index.get(value, 0)
+                bits &= matches
+        if f.id is not None:
+            bits &= bitset(self._by_id[i] for i in f.id if i in self._by_id)
+        for index, conditions in ((self._updated, f.updated), (self._created, f.created)):
+            for op, dt in conditions or []:
+                bits &= index.select(op, epoch_seconds(dt))
+        if f.in_effect is not None:
+            bits &= self._schedule_starts.select('<=', epoch_seconds(f.in_effect.end))
+            bits &= self._schedule_ends.select('>=', epoch_seconds(f.in_effect.start))
+        return bits
+
+    def query(self, filters=None, limit=None):
+        """Returns a list of the JSON events matching filters, in the order
+        they were added.
+
+        filters is an EventFilter, or a dict of Open511 API query parameters
+        (see EventFilter.from_params); None returns every event."""
+        if filters is None:
+            filters = EventFilter()
+        elif not isinstance(filters, EventFilter):
+            filters = EventFilter.from_params(filters, default_timezone=self._timezone(None))
+        results = []
+        for position in positions(self._select(filters)):
+            if filters.bbox is not None:
+                box = self._bboxes[position]
+                if (box is None or box[0] > filters.bbox[2] or box[2] < filters.bbox[0]
+                        or box[1] > filters.bbox[3] or box[3] < filters.bbox[1]):
+                    continue
+            if filters.in_effect is not None and not self._schedule(position).active_within_range(*filters.in_effect):
+                continue
+            results.append(self._events[position])
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+    def export(self, filters=None, output_format='json', **kwargs):
+        """Converts the events matching filters (see query) to any of the
+        converter's output formats. Keyword arguments are passed to
+        open511_convert."""
+        limit = kwargs.pop('limit', None)
+        doc = {
+            'meta': {'version': 'v1'},
+            'events': self.query(filters, limit=limit)
+        }
+        return open511_convert(doc, output_format, **kwargs)
@@ -0,0 +1,156 @@
+"""Parses and applies the event filters of the Open511 API, e.g.
+?severity=MAJOR,MODERATE&road_name=Highway 1&updated=>2013-01-01T00:00Z"""
+import datetime
+
+import pytz
+
+from open511.utils.geometry import bbox as geometry_bbox
+from open511.utils.schedule import Period, text_to_date
+from open511.utils.timezone import is_naive, localize, now, parse_datetime
+
+_OPERATORS = ('>=', '<=', '>', '<')
+
+# Filters that take a comma-separated list of acceptable values
+_LIST_FILTERS = ('id', 'jurisdiction', 'severity', 'event_type', 'area_id')
+
+def _values(value):
+    """API parameters may be given once or repeated; either way, returns a list."""
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def _split(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+def _parse_time(value, tz, end=False):
+    """Parses a datetime, or a date: the start of the day, or its end if end is True.
+    Local times repeated or skipped by a DST change are taken as standard time."""
+    dt = parse_datetime(value)
+    if dt is None:
+        d = text_to_date(value)
+        dt = datetime.datetime.combine(d, datetime.time.max if end else datetime.time.min)
+    if is_naive(dt):
+        dt = localize(dt, tz)
+    return dt
+
+def _compare(op, a, b):
+    if op == '>':
+        return a > b
+    elif op == '>=':
+        return a >= b
+    elif op == '<':
+        return a < b
+    elif op == '<=':
+        return a <= b
+    return a == b
+
+class EventFilter(object):
+    """A parsed set of Open511 API event filters. Build from request
+    parameters with EventFilter.from_params.
+
+    Every attribute is None when its filter wasn't given:
+        status, id, jurisdiction, severity, event_type, area_id - sets of values
+        road_name - a set of lowercased road names
+        bbox - a (west, south, east, north) tuple
+        updated, created - lists of (operator, aware datetime); the operator is
+            one of '=', '>', '>=', '<', '<='
+        in_effect - a Period of aware datetimes
+    """
+
+    FIELDS = ('status', 'id', 'jurisdiction', 'severity', 'event_type', 'area_id',
+        'road_name', 'bbox', 'updated', 'created', 'in_effect')
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError("Unknown filters: %s" % ', '.join(kwargs))
+
+    @classmethod
+    def from_params(cls, params, default_timezone=pytz.utc):
+        """Parses a dict of API query parameters. Values can be strings or, for
+        repeated parameters, lists of strings. Unrecognized parameters (limit,
+        format...) are ignored.
+
+        As in the API, only ACTIVE events match unless there's a status filter;
+        status=ALL matches everything. Dates and times without an offset are
+        in default_timezone. Raises ValueError for invalid values."""
+        f = cls()
+        try:
+            status = params.get('status', 'ACTIVE')
+            if status != 'ALL':
+                f.status = set(v.upper() for v in _split(status))
+            for field in _LIST_FILTERS:
+                if field in params:
+                    values = set()
+                    for value in _values(params[field]):
+                        values.update(_split(value))
+                    if field in ('severity', 'event_type'):
+                        values = set(v.upper() for v in values)
+                    setattr(f, field, values)
+            if 'road_name' in params:
+                f.road_name = set(v.strip().lower() for v in _values(params['road_name']))
+            if 'bbox' in params:
+                f.bbox = tuple(float(v) for v in _split(params['bbox']))
+                if len(f.bbox) != 4:
+                    raise ValueError("bbox needs four numbers")
+            for field in ('updated', 'created'):
+                if field in params:
+                    conditions = []
+                    for value in _values(params[field]):
+                        op = next((o for o in _OPERATORS if value.startswith(o)), '')
+                        conditions.append((op or '=', _parse_time(value[len(op):], default_timezone)))
+                    setattr(f, field, conditions)
+            if 'in_effect_on' in params:
+                value = params['in_effect_on']
+                if value == 'now':
+                    f.in_effect = Period(now(), now())
+                else:
+                    bits = _split(value)
+                    f.in_effect = Period(_parse_time(bits[0], default_timezone),
+                        _parse_time(bits[-1], default_timezone, end=True))
+        except (ValueError, TypeError, AttributeError, IndexError) as e:
+            raise ValueError("Invalid filter: %s" % e)
+        return f
+
+    def __repr__(self):
+        return 'EventFilter(%s)' % ', '.join('%s=%r' % (field, getattr(self, field))
+            for field in self.FIELDS if getattr(self, field) is not None)
+
+    def matches(self, event, schedule=None):
+        """Does a JSON event pass every filter? schedule is the event's
+        Schedule object, only needed for in_effect; None skips that check."""
+        if self.status is not None and event.get('status') not in self.status:
+            return False
+        event_id = event.get('id', '')
+        if self.id is not None and event_id not in self.id:
+            return False
+        if self.jurisdiction is not None and event_id.partition('/')[0] not in self.jurisdiction:
+            return False
+        for field in ('severity', 'event_type'):
+            values = getattr(self, field)
+            if values is not None and event.get(field) not in values:
+                return False
+        if self.area_id is not None and not any(
+                area.get('id') in self.area_id for area in event.get('areas', [])):
+            return False
+        if self.road_name is not None and not any(
+                road.get('name', '').lower() in self.road_name for road in event.get('roads', [])):
+            return False
+        for field in ('updated', 'created'):
+            conditions = getattr(self, field)
+            if conditions:
+                value = parse_datetime(event.get(field, ''))
+                # Times without an offset can't be compared, so like EventStore
+                # and EventCollection, treat them as missing
+                if value is None or value.tzinfo is None or not all(_compare(op, value, dt) for op, dt in conditions):
+                    return False
+        if self.bbox is not None:
+            geography = event.get('geography')
+            if not geography:
+                return False
+            west, south, east, north = geometry_bbox(geography)
+            if west > self.bbox[2] or east < self.bbox[0] or south > self.bbox[3] or north < self.bbox[1]:
+                return False
+        if self.in_effect is not None and schedule is not None:
+            if not schedule.active_within_range(*self.in_effect):
+                return False
+        return True
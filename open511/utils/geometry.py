@@ -0,0 +1,119 @@
+"""Helpers for GeoJSON geometries, as produced by the JSON converter."""
+
+import struct
+
+def _points(coordinates):
+    """Yields the (x, y) positions in a GeoJSON coordinates array of any depth."""
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for c in coordinates:
+            for point in _points(c):
+                yield point
+
+def bbox(geometry):
+    """Returns the (west, south, east, north) bounding box of a GeoJSON geometry."""
+    if geometry['type'] == 'GeometryCollection':
+        boxes = [bbox(g) for g in geometry['geometries']]
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+    xs = []
+    ys = []
+    for point in _points(geometry['coordinates']):
+        xs.append(point[0])
+        ys.append(point[1])
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def _segment_distance(p, a, b):
+    """The distance from point p to the segment between a and b."""
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    if dx == 0 and dy == 0:
+        t = 0.0
+    else:
+        t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / float(dx * dx + dy * dy)))
+    ex = p[0] - (a[0] + t * dx)
+    ey = p[1] - (a[1] + t * dy)
+    return (ex * ex + ey * ey) ** 0.5
+
+def simplify(coords, tolerance):
+    """Simplifies a list of positions with the Douglas-Peucker algorithm: no
+    point of the original line is further than tolerance from the result.
+    The first and last positions are always kept."""
+    if len(coords) < 3 or tolerance <= 0:
+        return list(coords)
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance = 0
+        index = None
+        for i in range(first + 1, last):
+            distance = _segment_distance(coords[i], coords[first], coords[last])
+            if distance > max_distance:
+                max_distance = distance
+                index = i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [c for c, k in zip(coords, keep) if k]
+
+def simplify_geometry(geometry, tolerance):
+    """Returns a copy of a GeoJSON geometry with its lines and rings simplified;
+    see simplify. Polygon rings keep at least four positions."""
+    t = geometry['type']
+    if t == 'LineString':
+        return {'type': t, 'coordinates': simplify(geometry['coordinates'], tolerance)}
+    elif t == 'MultiLineString':
+        return {'type': t, 'coordinates': [simplify(line, tolerance) for line in geometry['coordinates']]}
+    elif t == 'Polygon':
+        return {'type': t, 'coordinates': [_simplify_ring(ring, tolerance) for ring in geometry['coordinates']]}
+    elif t == 'MultiPolygon':
+        return {'type': t, 'coordinates': [
+            [_simplify_ring(ring, tolerance) for ring in polygon] for polygon in geometry['coordinates']]}
+    elif t == 'GeometryCollection':
+        return {'type': t, 'geometries': [simplify_geometry(g, tolerance) for g in geometry['geometries']]}
+    return geometry
+
+def _simplify_ring(ring, tolerance):
+    simplified = simplify(ring, tolerance)
+    return simplified if len(simplified) >= 4 else list(ring)
+
+def vertex_count(geometry):
+    if geometry['type'] == 'GeometryCollection':
+        return sum(vertex_count(g) for g in geometry['geometries'])
+    return sum(1 for _ in _points(geometry['coordinates']))
+
+_WKB_TYPES = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7,
+}
+
+def _wkb_positions(positions):
+    return struct.pack('<I', len(positions)) + b''.join(struct.pack('<dd', p[0], p[1]) for p in positions)
+
+def to_wkb(geometry):
+    """Encodes a GeoJSON geometry as little-endian, two-dimensional
+    Well-Known Binary. Returns bytes."""
+    t = geometry['type']
+    header = struct.pack('<BI', 1, _WKB_TYPES[t])
+    if t == 'GeometryCollection':
+        return header + struct.pack('<I', len(geometry['geometries'])) + b''.join(
+            to_wkb(g) for g in geometry['geometries'])
+    coords = geometry['coordinates']
+    if t == 'Point':
+        return header + struct.pack('<dd', coords[0], coords[1])
+    elif t == 'LineString':
+        return header + _wkb_positions(coords)
+    elif t == 'Polygon':
+        return header + struct.pack('<I', len(coords)) + b''.join(_wkb_positions(ring) for ring in coords)
+    single_type = t[5:]
+    return header + struct.pack('<I', len(coords)) + b''.join(
+        to_wkb({'type': single_type, 'coordinates': c}) for c in coords)
@@ -1,23 +1,117 @@
+import bz2
+from contextlib import closing, contextmanager
+import gzip
+import mmap
 import re
 import sys
 
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
 try:
     import urllib2
 except ImportError:
     import urllib.request as urllib2
 
-from open511.utils.serialization import deserialize
+from open511.utils import serialization
+from open511.utils.serialization import deserialize, sniff_format, SNIFF_SIZE
+
+_DECOMPRESSORS = [
+    (b'\x1f\x8b', lambda f: gzip.GzipFile(fileobj=f, mode='rb')),
+    (b'BZh', bz2.BZ2File),
+]
+if lzma:
+    _DECOMPRESSORS.append((b'\xfd7zXZ\x00', lzma.LZMAFile))
+
+class _PeekableFile(object):
+    """Minimal binary file wrapper that allows looking at the first bytes of
+    a stream that can't seek, e.g. stdin or an HTTP response."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = b''
+
+    def peek(self, size):
+        while len(self.buffer) < size:
+            data = self.f.read(size - len(self.buffer))
+            if not data:
+                break
+            self.buffer += data
+        return self.buffer[:size]
+
+    def read(self, size=-1):
+        if not self.buffer:
+            return self.f.read(size)
+        if size is None or size < 0:
+            data = self.buffer + self.f.read()
+            self.buffer = b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def _maybe_decompress(f):
+    """Given a binary file-like object with a peek() method, returns a file-like
+    object that transparently decompresses gzip, bzip2 or xz content."""
+    magic = f.peek(6)
+    for prefix, decompressor in _DECOMPRESSORS:
+        if magic.startswith(prefix):
+            return decompressor(f)
+    return f
+
+def _load_local_file(path):
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+        f.seek(0)
+        if any(head.startswith(prefix) for prefix, _ in _DECOMPRESSORS):
+            return deserialize(_maybe_decompress(_PeekableFile(f)))
+        if sniff_format(head) != 'json' or not serialization.json_backend.loads_buffers:
+            # lxml reads the file in chunks, so it's never held in memory whole;
+            # and JSON parsers that can't read a mapped file in place would
+            # only copy it
+            return deserialize(f)
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # Empty files, or things like pipes that can't be mapped
+            return deserialize(f)
+    # Decode JSON straight from the mapped pages, so that the file is
+    # never copied into a Python string
+    with closing(mapped):
+        view = memoryview(mapped)
+        try:
+            return deserialize(view)
+        finally:
+            view.release()
 
 def load_path(source):
+    """Loads and deserializes a document. source can be a local path, an HTTP(S) URL,
+    or - to read from stdin. Input compressed with gzip, bzip2 or xz is decompressed
+    as it's read.
+
+    Returns the same (document, format) tuple as deserialize."""
     if source == '-':
-        content = sys.stdin.read()
+        return deserialize(_maybe_decompress(_PeekableFile(getattr(sys.stdin, 'buffer', sys.stdin))))
     elif re.match(r'https?://', source):
-            content = urllib2.urlopen(source).read()
-    else:
-        with open(source) as f:
-            content = f.read()
+        with closing(urllib2.urlopen(source)) as resp:
+            return deserialize(_maybe_decompress(_PeekableFile(resp)))
+    return _load_local_file(source)
 
-    return deserialize(content)
+@contextmanager
+def open_path(source):
+    """Opens a document for reading without deserializing it, e.g. to parse
+    it incrementally. source is as for load_path, and compressed input is
+    likewise decompressed as it's read. Use as a context manager, which gives
+    a binary file-like object."""
+    if source == '-':
+        yield _maybe_decompress(_PeekableFile(getattr(sys.stdin, 'buffer', sys.stdin)))
+    elif re.match(r'https?://', source):
+        with closing(urllib2.urlopen(source)) as resp:
+            yield _maybe_decompress(_PeekableFile(resp))
+    else:
+        with open(source, 'rb') as f:
+            yield _maybe_decompress(_PeekableFile(f))
 
 def get_jurisdiction_settings(jurisdiction_url):
     from lxml import etree
@@ -1,13 +1,20 @@
-from collections import namedtuple
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, OrderedDict
 import datetime
 import heapq
 
 from open511.utils import timezone
+from open511.utils.timezone import localize
 
 from open511.utils import memoize_method
 
 Period = namedtuple('Period', 'start end')
 
+# Recurring schedules cache their localized daily periods in chunks of this
+# many days, keeping at most INTERVAL_CACHE_MAX_CHUNKS chunks per schedule
+INTERVAL_CACHE_CHUNK_DAYS = 32
+INTERVAL_CACHE_MAX_CHUNKS = 64
+
 
 def text_to_date(s):
     return datetime.date(*[int(x) for x in s.split('-')]) if s else None
@@ -38,9 +45,30 @@ class Schedule(object):
         tag. timezone is a tzinfo object, ideally from pytz."""
         assert root.tag == 'schedule'
         if root.xpath('intervals'):
-            return _ScheduleIntervals(root, timezone)
+            return _ScheduleIntervals(root.xpath('intervals/interval/text()'), timezone)
         elif root.xpath('recurring_schedules'):
-            return _ScheduleRecurring(root, timezone)
+            return _ScheduleRecurring(
+                [RecurringScheduleComponent.from_element(el, timezone)
+                    for el in root.xpath('recurring_schedules/recurring_schedule')],
+                [str(el.text) for el in root.xpath('exceptions/exception')],
+                timezone
+            )
+        raise NotImplementedError
+
+    @staticmethod
+    def from_json(data, timezone):
+        """Return a Schedule object based on the Open511 JSON dict for a schedule,
+        as in an event's "schedule" field. timezone is a tzinfo object, ideally
+        from pytz."""
+        if 'intervals' in data:
+            return _ScheduleIntervals(data['intervals'], timezone)
+        elif 'recurring_schedules' in data:
+            return _ScheduleRecurring(
+                [RecurringScheduleComponent.from_json(component, timezone)
+                    for component in data['recurring_schedules']],
+                [str(exception) for exception in data.get('exceptions', [])],
+                timezone
+            )
         raise NotImplementedError
 
     def to_timezone(self, dt):
@@ -78,43 +106,70 @@ class Schedule(object):
         If no time is given, uses the current time."""
         return bool(self.next_interval(after))
 
+    def bounds(self):
+        """Returns a Period from the earliest time this schedule could be in effect
+        to the latest, with an end of None if it's open-ended. Every interval
+        falls within these bounds, though the schedule needn't be in effect
+        at either end."""
+        raise NotImplementedError
+
 class _ScheduleIntervals(Schedule):
-    """An Open511 <schedule> that uses <intervals>. Create via Schedule.from_element,
-    not directly."""
+    """An Open511 <schedule> that uses <intervals>. Create via Schedule.from_element
+    or Schedule.from_json, not directly.
+
+    intervals is a list of the ISO 8601 interval strings, e.g.
+    '2013-01-01T12:00/2013-01-02T09:00'."""
 
-    def __init__(self, root, timezone):
-        self.root = root
+    def __init__(self, intervals, timezone):
         self.timezone = timezone
         self._intervals = []
-        for interval_data in root.xpath('intervals/interval/text()'):
+        for interval_data in intervals:
             start, end = interval_data.split('/')
             period = Period(
-                text_to_datetime(start).replace(tzinfo=self.timezone),
-                text_to_datetime(end).replace(tzinfo=self.timezone) if end else None
+                localize(text_to_datetime(start), self.timezone),
+                localize(text_to_datetime(end), self.timezone) if end else None
             )
             self._intervals.append(period)
         self._intervals.sort()
+        self._starts = [p.start for p in self._intervals]
+        # The latest end among the intervals up to each one, for bisecting on
+        # range_start; it stops at the first open-ended interval
+        self._max_ends = []
+        for period in self._intervals:
+            if period.end is None:
+                break
+            self._max_ends.append(max(period.end, self._max_ends[-1]) if self._max_ends else period.end)
 
     def intervals(self, range_start=datetime.datetime.min, range_end=datetime.datetime.max):
         range_start = self.to_timezone(range_start)
         range_end = self.to_timezone(range_end)
 
-        for period in self._intervals:
-            if period.start <= range_end and (period.end is None or period.end >= range_start):
+        first = bisect_left(self._max_ends, range_start)
+        last = bisect_right(self._starts, range_end)
+        for period in self._intervals[first:last]:
+            if period.end is None or period.end >= range_start:
                 yield period
 
+    def bounds(self):
+        if not self._intervals:
+            return Period(None, None)
+        ends = [p.end for p in self._intervals]
+        return Period(self._intervals[0].start, None if None in ends else max(ends))
+
 
 class _ScheduleRecurring(Schedule):
-    """An Open511 <schedule> that uses <recurring_schedules>. Create via Schedule.from_element,
-    not directly."""
+    """An Open511 <schedule> that uses <recurring_schedules>. Create via Schedule.from_element
+    or Schedule.from_json, not directly.
 
-    def __init__(self, root, timezone):
-        self.root = root
+    recurring_schedules is a list of RecurringScheduleComponents, and exceptions
+    a list of the exception strings, e.g. '2013-01-02 09:00-10:00 11:00-12:00'."""
+
+    def __init__(self, recurring_schedules, exceptions, timezone):
         self.timezone = timezone
-        self._recurring_schedules = [
-            RecurringScheduleComponent(el, timezone)
-            for el in root.xpath('recurring_schedules/recurring_schedule')
-        ]
+        self._recurring_schedules = recurring_schedules
+        self._exception_texts = exceptions
+        # chunk number -> list of the daily Periods in that chunk
+        self._chunks = OrderedDict()
 
     @property
     @memoize_method
@@ -122,8 +177,8 @@ class _ScheduleRecurring(Schedule):
         """A dict of dates -> [Period time tuples] representing exceptions
         to the base recurrence pattern."""
         ex = {}
-        for sd in self.root.xpath('exceptions/exception'):
-            bits = str(sd.text).split(' ')
+        for text in self._exception_texts:
+            bits = text.split(' ')
             date = text_to_date(bits.pop(0))
             ex.setdefault(date, []).extend([
                 _time_text_to_period(t)
@@ -131,21 +186,36 @@ class _ScheduleRecurring(Schedule):
             ])
         return ex
 
+    @property
+    @memoize_method
+    def exception_dates(self):
+        """A frozenset of the dates with exceptions."""
+        return frozenset(self.exceptions)
+
+    @memoize_method
+    def _exception_index(self):
+        """Returns (sorted list of exception dates, list of the sorted, localized
+        Periods for each of those dates), built once per schedule."""
+        dates = sorted(self.exceptions)
+        periods = [
+            sorted(
+                Period(
+                    localize(datetime.datetime.combine(exception_date, exception_time.start), self.timezone),
+                    localize(datetime.datetime.combine(exception_date, exception_time.end), self.timezone)
+                )
+                for exception_time in self.exceptions[exception_date]
+            )
+            for exception_date in dates
+        ]
+        return dates, periods
+
     def exception_periods(self, range_start=datetime.date.min, range_end=datetime.date.max):
         """Returns a list of Period tuples for each period represented in an <exception>
         that falls between range_start and range_end."""
+        dates, date_periods = self._exception_index()
         periods = []
-        for exception_date, exception_times in self.exceptions.items():
-            if exception_date >= range_start and exception_date <= range_end:
-                for exception_time in exception_times:
-                    periods.append(
-                        Period(
-                            self.timezone.localize(datetime.datetime.combine(exception_date, exception_time.start)),
-                            self.timezone.localize(datetime.datetime.combine(exception_date, exception_time.end))
-                        )
-                    )
-
-        periods.sort()
+        for day_periods in date_periods[bisect_left(dates, range_start):bisect_right(dates, range_end)]:
+            periods.extend(day_periods)
         return periods
 
     def includes(self, query):
@@ -169,16 +239,53 @@ class _ScheduleRecurring(Schedule):
         # It's not an exception. Is it within a recurring schedule?
         return any(sched.includes(query_date, query_time) for sched in self._recurring_schedules)
 
-    def _daily_periods(self, range_start, range_end):
-        """Returns an iterator of Period tuples for every day this event is in effect, between range_start
-        and range_end."""
-        specific = set(self.exceptions.keys())
-
+    def _compute_daily_periods(self, range_start, range_end):
         return heapq.merge(self.exception_periods(range_start, range_end), *[
-            sched.daily_periods(range_start=range_start, range_end=range_end, exclude_dates=specific)
+            sched.daily_periods(range_start=range_start, range_end=range_end, exclude_dates=self.exception_dates)
             for sched in self._recurring_schedules
         ])
 
+    @memoize_method
+    def _date_bounds(self):
+        """The first date this schedule could be in effect, and the last or None."""
+        dates = sorted(self.exceptions)
+        starts = [sched.start_date for sched in self._recurring_schedules] + dates[:1]
+        ends = [sched.end_date for sched in self._recurring_schedules] + dates[-1:]
+        return min(starts) if starts else None, None if None in ends else max(ends) if ends else None
+
+    def _chunk(self, index):
+        """The daily Periods for one chunk of INTERVAL_CACHE_CHUNK_DAYS days,
+        computed on first use and kept in a bounded LRU cache."""
+        try:
+            periods = self._chunks.pop(index)
+        except KeyError:
+            first = datetime.date.fromordinal(max(1, index * INTERVAL_CACHE_CHUNK_DAYS))
+            last = datetime.date.fromordinal(min(datetime.date.max.toordinal(),
+                (index + 1) * INTERVAL_CACHE_CHUNK_DAYS - 1))
+            periods = list(self._compute_daily_periods(first, last))
+        self._chunks[index] = periods
+        if len(self._chunks) > INTERVAL_CACHE_MAX_CHUNKS:
+            self._chunks.popitem(last=False)
+        return periods
+
+    def _daily_periods(self, range_start, range_end):
+        """Returns an iterator of Period tuples for every day this event is in effect, between range_start
+        and range_end."""
+        first_date, last_date = self._date_bounds()
+        if first_date is None:
+            return
+        range_start = max(range_start, first_date)
+        if last_date is not None:
+            range_end = min(range_end, last_date)
+        index = range_start.toordinal() // INTERVAL_CACHE_CHUNK_DAYS
+        last_index = range_end.toordinal() // INTERVAL_CACHE_CHUNK_DAYS
+        while index <= last_index:
+            for period in self._chunk(index):
+                period_date = period.start.date()
+                if range_start <= period_date <= range_end:
+                    yield period
+            index += 1
+
     def intervals(self, range_start=datetime.datetime.min, range_end=datetime.datetime.max):
         """Returns an iterator of Period tuples for continuous stretches of time during
         which this event is in effect, between range_start and range_end."""
@@ -212,14 +319,58 @@ class _ScheduleRecurring(Schedule):
         if current_period:
             yield current_period
 
+    def bounds(self):
+        exception_periods = self.exception_periods()
+        starts = [p.start for p in exception_periods]
+        ends = [p.end for p in exception_periods]
+        for sched in self._recurring_schedules:
+            starts.append(localize(datetime.datetime.combine(sched.start_date, sched.period.start), self.timezone))
+            if sched.end_date is None:
+                ends.append(None)
+            else:
+                ends.append(localize(datetime.datetime.combine(sched.end_date, sched.period.end), self.timezone))
+        return Period(min(starts) if starts else None, None if None in ends else max(ends) if ends else None)
+
 
 class RecurringScheduleComponent(object):
-    """Represents an individual <recurring_schedule> within a <schedule>."""
+    """Represents an individual <recurring_schedule> within a <schedule>.
+    Create via from_element or from_json."""
 
-    def __init__(self, root, timezone):
-        assert root.tag == 'recurring_schedule'
-        self.root = root
+    def __init__(self, timezone, start_date=None, end_date=None, weekdays=None, period=None):
         self.timezone = timezone
+        # Start and end dates of event recurrence, as datetime.date or None
+        self.start_date = start_date
+        self.end_date = end_date
+        # A set of integers representing the weekdays the schedule recurs on,
+        # with Monday = 0 and Sunday = 6
+        self.weekdays = set(range(7)) if weekdays is None else weekdays
+        # A Period tuple representing the daily start and end time
+        self.period = period or Period(datetime.time(0, 0), datetime.time(23, 59))
+
+    @classmethod
+    def from_element(cls, root, timezone):
+        assert root.tag == 'recurring_schedule'
+        start_time = root.findtext('daily_start_time')
+        return cls(
+            timezone,
+            start_date=text_to_date(root.findtext('start_date')),
+            end_date=text_to_date(root.findtext('end_date')),
+            weekdays=set(int(d) - 1 for d in root.xpath('days/day/text()')) if root.xpath('days') else None,
+            period=Period(text_to_time(start_time), text_to_time(root.findtext('daily_end_time')))
+                if start_time else None
+        )
+
+    @classmethod
+    def from_json(cls, data, timezone):
+        start_time = data.get('daily_start_time')
+        return cls(
+            timezone,
+            start_date=text_to_date(data.get('start_date')),
+            end_date=text_to_date(data.get('end_date')),
+            weekdays=set(int(d) - 1 for d in data['days']) if 'days' in data else None,
+            period=Period(text_to_time(start_time), text_to_time(data.get('daily_end_time')))
+                if start_time else None
+        )
 
     def includes(self, query_date, query_time=None):
         """Does this schedule include the provided time?
@@ -256,36 +407,43 @@ class RecurringScheduleComponent(object):
         while current_date <= end_date:
             if current_date.weekday() in weekdays and current_date not in exclude_dates:
                 yield Period(
-                    tz.localize(datetime.datetime.combine(current_date, period.start)),
-                    tz.localize(datetime.datetime.combine(current_date, period.end))
+                    localize(datetime.datetime.combine(current_date, period.start), tz),
+                    localize(datetime.datetime.combine(current_date, period.end), tz)
                 )
             current_date += datetime.timedelta(days=1)
 
-    @property
-    @memoize_method
-    def period(self):
-        """A Period tuple representing the daily start and end time."""
-        start_time = self.root.findtext('daily_start_time')
-        if start_time:
-            return Period(text_to_time(start_time), text_to_time(self.root.findtext('daily_end_time')))
-        return Period(datetime.time(0, 0), datetime.time(23, 59))
-
-    @property
-    def weekdays(self):
-        """A set of integers representing the weekdays the schedule recurs on,
-        with Monday = 0 and Sunday = 6."""
-        if not self.root.xpath('days'):
-            return set(range(7))
-        return set(int(d) - 1 for d in self.root.xpath('days/day/text()'))
 
-    @property
-    @memoize_method
-    def start_date(self):
-        """Start date of event recurrence, as datetime.date or None."""
-        return text_to_date(self.root.findtext('start_date'))
-
-    @property
-    @memoize_method
-    def end_date(self):
-        """End date of event recurrence, as datetime.date or None."""
-        return text_to_date(self.root.findtext('end_date'))
+class NextIntervalCache(object):
+    """Memoizes Schedule.next_interval across events with identical schedules.
+
+    Entries are keyed on (schedule key, timezone name, timestamp), where the
+    schedule key is anything hashable that identifies the schedule's content --
+    typically its serialized form. Holds at most maxsize entries (None for no
+    limit), discarding the least recently used."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def set(self, key, period):
+        self._cache.pop(key, None)
+        self._cache[key] = period
+        if self.maxsize is not None and len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def next_interval(self, schedule_key, timezone_name, after, get_schedule):
+        """Returns the next Period at or after the datetime after. get_schedule
+        is called, with no arguments, to build the Schedule on a cache miss."""
+        key = (schedule_key, timezone_name, after)
+        try:
+            period = self._cache.pop(key)
+        except KeyError:
+            period = get_schedule().next_interval(after)
+        self.set(key, period)
+        return period
@@ -0,0 +1,275 @@
+"""
+A full-text inverted index over event headlines, descriptions and road
+names, with BM25 ranking.
+
+    index = SearchIndex(doc)
+    index.search('"highway 1" bridge')     # phrase and term
+    index.search('sherb*')                  # prefix
+    index.add(updated_doc)                  # replaces events with the same id
+    index.remove(['drivebc.ca/DBC-11012'])
+
+Every term in a query must match. Text is lowercased and stripped of
+accents; French text also has its elisions (l', d', qu'...) removed, and
+English text its possessive 's.
+"""
+try:
+    unicode
+except NameError:
+    unicode = str
+
+from bisect import bisect_left
+import math
+import re
+import unicodedata
+
+from open511.utils.serialization import get_lang
+
+# Relative weight of a match in each field
+FIELD_WEIGHTS = {
+    'headline': 3.0,
+    'road': 2.0,
+    'description': 1.0,
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Positions left between two texts of the same event, so that phrases
+# can't match across them
+_TEXT_GAP = 100
+
+_WORD_RE = re.compile(r"[\w']+", re.UNICODE)
+_QUERY_RE = re.compile(r'"([^"]*)"|(\S+)', re.UNICODE)
+_FRENCH_ELISION_RE = re.compile(r"^(?:[cdjlmnst]|qu|jusqu|lorsqu|puisqu)'", re.UNICODE)
+
+def _fold(text):
+    """Lowercases text and removes accents."""
+    return u''.join(c for c in unicodedata.normalize('NFKD', unicode(text).lower())
+        if not unicodedata.combining(c))
+
+def tokenize(text, lang=None):
+    """Splits text into a list of index terms. lang is a language code like
+    'en' or 'fr-CA'; None applies the rules for every supported language."""
+    lang = (lang or '').split('-')[0].lower()
+    tokens = []
+    for word in _WORD_RE.findall(_fold(text.replace(u'’', "'"))):
+        if lang in ('fr', ''):
+            word = _FRENCH_ELISION_RE.sub('', word)
+        if lang in ('en', '') and word.endswith("'s"):
+            word = word[:-2]
+        word = word.strip("'")
+        if word:
+            tokens.append(word)
+    return tokens
+
+def _json_texts(event, lang):
+    if event.get('headline'):
+        yield 'headline', event['headline'], lang
+    if event.get('description'):
+        yield 'description', event['description'], lang
+    for road in event.get('roads', []):
+        for key in ('name', 'from', 'to'):
+            if road.get(key):
+                yield 'road', road[key], lang
+
+def _xml_texts(event):
+    for field in ('headline', 'description'):
+        for el in event.iterfind(field):
+            if el.text:
+                yield field, el.text, get_lang(el)
+    for el in event.xpath('roads/road/name|roads/road/from|roads/road/to'):
+        if el.text:
+            yield 'road', el.text, get_lang(el)
+
+class _Document(object):
+    __slots__ = ['id', 'event', 'length', 'terms']
+
+    def __init__(self, event_id, event, length, terms):
+        self.id = event_id
+        self.event = event
+        self.length = length
+        # term -> (weighted term frequency, [positions])
+        self.terms = terms
+
+class SearchIndex(object):
+    """An inverted index of Open511 events, searchable by text.
+
+    Events can be added as JSON dicts or lxml <event> elements, or from whole
+    documents. JSON has no language information, so its text is tokenized
+    as json_lang; the default, None, applies the rules for every supported
+    language, as queries without a lang do."""
+
+    def __init__(self, doc=None, json_lang=None):
+        self.json_lang = json_lang
+        self._documents = {}
+        # term -> {event id: _Document}
+        self._postings = {}
+        self._total_length = 0
+        self._sorted_terms = None
+        if doc is not None:
+            self.add(doc)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, event_id):
+        return event_id in self._documents
+
+    def add(self, doc):
+        """Indexes the events in an Open511 document (an lxml Element or JSON
+        dict) or a list of events. Events already in the index are replaced."""
+        if getattr(doc, 'tag', None) == 'open511':
+            events = doc.xpath('events/event')
+        elif getattr(doc, 'tag', None) == 'event':
+            events = [doc]
+        elif isinstance(doc, dict) and 'meta' in doc:
+            events = doc.get('events', [])
+        elif isinstance(doc, dict):
+            events = [doc]
+        else:
+            events = doc
+        for event in events:
+            self._add_event(event)
+
+    def _add_event(self, event):
+        if getattr(event, 'tag', None) is not None:
+            event_id = event.findtext('id')
+            texts = _xml_texts(event)
+        else:
+            event_id = event['id']
+            texts = _json_texts(event, self.json_lang)
+        if event_id in self._documents:
+            self._remove(event_id)
+
+        terms = {}
+        position = 0
+        for field, text, lang in texts:
+            weight = FIELD_WEIGHTS[field]
+            tokens = tokenize(text, lang)
+            for i, token in enumerate(tokens):
+                entry = terms.get(token)
+                if entry is None:
+                    entry = terms[token] = [0.0, []]
+                entry[0] += weight
+                entry[1].append(position + i)
+            position += len(tokens) + _TEXT_GAP
+        length = sum(len(entry[1]) for entry in terms.values())
+
+        document = _Document(event_id, event, length, terms)
+        self._documents[event_id] = document
+        self._total_length += length
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._sorted_terms = None
+            postings[event_id] = document
+
+    def _remove(self, event_id):
+        document = self._documents.pop(event_id)
+        self._total_length -= document.length
+        for term in document.terms:
+            postings = self._postings[term]
+            del postings[event_id]
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def remove(self, event_ids):
+        """Removes events from the index by id. Unknown ids are ignored."""
+        for event_id in event_ids:
+            if event_id in self._documents:
+                self._remove(event_id)
+
+    def _expand(self, token):
+        """Returns the index terms a query token matches: itself, or for a
+        prefix token ending in *, every term starting with it."""
+        if not token.endswith('*'):
+            return [token] if token in self._postings else []
+        prefix = token.rstrip('*')
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        terms = []
+        for i in range(bisect_left(self._sorted_terms, prefix), len(self._sorted_terms)):
+            if not self._sorted_terms[i].startswith(prefix):
+                break
+            terms.append(self._sorted_terms[i])
+        return terms
+
+    def _parse_query(self, query, lang):
+        """Returns a list of clauses, each a list of phrase positions, each a
+        list of the terms that can appear there."""
+        clauses = []
+        for phrase, word in _QUERY_RE.findall(query):
+            text = phrase if phrase else word
+            tokens = []
+            for bit in text.split():
+                prefix = bit.endswith('*')
+                bit_tokens = tokenize(bit, lang)
+                if prefix and bit_tokens:
+                    bit_tokens[-1] += '*'
+                tokens.extend(bit_tokens)
+            if tokens:
+                clauses.append([self._expand(token) for token in tokens])
+        return clauses
+
+    def _score(self, document, terms):
+        n = len(self._documents)
+        average_length = float(self._total_length) / n if n else 0
+        norm = K1 * (1 - B + B * document.length / average_length) if average_length else K1
+        score = 0.0
+        for term in terms:
+            entry = document.terms.get(term)
+            if entry is None:
+                continue
+            df = len(self._postings[term])
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            score += idf * entry[0] * (K1 + 1) / (entry[0] + norm)
+        return score
+
+    def _phrase_matches(self, document, phrase):
+        positions = set()
+        for term in phrase[0]:
+            if term in document.terms:
+                positions.update(document.terms[term][1])
+        for offset, terms in enumerate(phrase[1:], 1):
+            following = set()
+            for term in terms:
+                if term in document.terms:
+                    following.update(p - offset for p in document.terms[term][1])
+            positions &= following
+            if not positions:
+                return False
+        return bool(positions)
+
+    def search(self, query, limit=20, lang=None):
+        """Returns a list of (event, score) tuples for the events matching every
+        clause of query, best first. Clauses are words, words ending in * to
+        match any term with that prefix, or "quoted phrases". Events are
+        returned as they were added, JSON dicts or lxml elements."""
+        clauses = self._parse_query(query, lang)
+        if not clauses:
+            return []
+        candidates = None
+        for clause in clauses:
+            matching = set()
+            for term in clause[0]:
+                matching.update(self._postings[term])
+            candidates = matching if candidates is None else candidates & matching
+            if not candidates:
+                return []
+
+        all_terms = set()
+        for clause in clauses:
+            for terms in clause:
+                all_terms.update(terms)
+        results = []
+        for event_id in candidates:
+            document = self._documents[event_id]
+            if all(len(clause) == 1 or self._phrase_matches(document, clause) for clause in clauses):
+                results.append((self._score(document, all_terms), event_id))
+        results.sort(key=lambda r: (-r[0], r[1]))
+        if limit is not None:
+            results = results[:limit]
+        return [(self._documents[event_id].event, score) for score, event_id in results]
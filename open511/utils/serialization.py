@@ -1,7 +1,36 @@
+try:
+    unicode
+except NameError:
+    unicode = str
+
+from collections import namedtuple
+import codecs
 import json
+import os
+import re
 
 from lxml import etree
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
 XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
 XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
 GML_NS = NS_GML = 'http://www.opengis.net/gml'
@@ -9,6 +38,7 @@ NS_KML = 'http://www.opengis.net/kml/2.2'
 NS_PROTECTED = 'http://open511.org/namespaces/internal-field'
 NS_ATOM = "http://www.w3.org/2005/Atom"
 NS_AGE = "http://purl.org/atompub/age/1.0"
+NS_FH = "http://purl.org/syndication/history/1.0"
 NS_XHTML = 'http://www.w3.org/1999/xhtml'
 NS_GEORSS = 'http://www.georss.org/georss'
 
@@ -34,32 +64,376 @@ def get_base_open511_element(lang=None, base=None, version=None):
         elem.set('version', version)
     return elem
 
+def get_lang(tag):
+    """Returns the xml:lang in effect for an lxml element, inherited from its
+    ancestors, or None."""
+    if tag is None:
+        return None
+    lang = tag.get(XML_LANG)
+    return lang if lang else get_lang(tag.getparent())
+
 def make_link(rel, href):
     l = etree.Element('link')
     l.set('rel', rel)
     l.set('href', href)
     return l
 
+##########
+# JSON BACKENDS
+##########
+
+# loads_buffers is whether loads parses buffers like memoryviews of mapped
+# files in place; other backends copy them to bytes first
+JSONBackend = namedtuple('JSONBackend', 'name loads dumps dumps_compact loads_buffers')
+
+def _bytes_loads(loads):
+    # Most parsers only take str or bytes, not other buffers
+    def _loads(s):
+        if not isinstance(s, (bytes, unicode)):
+            s = bytes(s)
+        return loads(s)
+    return _loads
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, indent=4).encode('utf8')
+
+def _stdlib_dumps_compact(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf8')
+
+JSON_BACKENDS = {
+    'json': JSONBackend('json', _bytes_loads(json.loads), _stdlib_dumps, _stdlib_dumps_compact, False),
+}
+
+# Pretty-printed output always comes from the stdlib, so that it's the same
+# whichever library is installed: ujson writes some floats differently (1e-7
+# for 1e-07), and orjson can only indent by two spaces.
+
+if ujson is not None:
+    JSON_BACKENDS['ujson'] = JSONBackend('ujson', _bytes_loads(ujson.loads), _stdlib_dumps,
+        lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode('utf8'), False)
+
+if orjson is not None:
+    def _orjson_dumps_compact(obj):
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers wider than 64 bits
+            return _stdlib_dumps_compact(obj)
+
+    JSON_BACKENDS['orjson'] = JSONBackend('orjson',
+        lambda s: orjson.loads(s if isinstance(s, (bytes, bytearray, memoryview, unicode)) else memoryview(s)),
+        _stdlib_dumps, _orjson_dumps_compact, True)
+
+_BACKEND_PREFERENCE = ('orjson', 'ujson', 'json')
+
+def set_json_backend(name=None):
+    """Selects the JSON library used by json_loads and json_dumps.
+
+    name is one of the keys of JSON_BACKENDS; if it's not provided, the
+    OPEN511_JSON_BACKEND environment variable is consulted, then the
+    fastest installed library is used. Pretty-printed output is the same
+    from every backend; compact output may write floats differently, but
+    always deserializes to the same value."""
+    global json_backend
+    if name is None:
+        name = os.environ.get('OPEN511_JSON_BACKEND')
+    if name is None:
+        name = next(n for n in _BACKEND_PREFERENCE if n in JSON_BACKENDS)
+    try:
+        json_backend = JSON_BACKENDS[name]
+    except KeyError:
+        raise ValueError("JSON backend %s is not available" % name)
+    return json_backend
+
+set_json_backend()
+
+def json_loads(s):
+    """Parses JSON from a str, bytes, or other buffer object."""
+    return json_backend.loads(s)
+
+def json_dumps(obj, compact=False):
+    """Serializes obj to UTF-8 encoded JSON bytes. By default, the output is
+    indented for readability; with compact=True, all optional whitespace is
+    omitted."""
+    if compact:
+        return json_backend.dumps_compact(obj)
+    return json_backend.dumps(obj)
+
+##########
+# BINARY FORMATS
+##########
+
+# MessagePack and CBOR documents have the same structure as Open511 JSON.
+# Both can optionally deduplicate repeated strings, like jurisdiction URLs,
+# road names and the keys of every event: CBOR via the stringref extension
+# (http://cbor.schmorp.de/stringref), and MessagePack via an equivalent
+# scheme of our own. The first occurrence of each string is written out in
+# full, and later ones as a reference to its position among the strings
+# written so far.
+
+# The MessagePack extension type for a string reference
+MSGPACK_STRING_REF = 1
+# Shorter strings aren't worth referencing
+_MIN_REF_LENGTH = 3
+
+class _StringRef(object):
+    __slots__ = ['index']
+
+    def __init__(self, index):
+        self.index = index
+
+_NUMBERS = (int, float)
+
+def _msgpack_add_string_refs(obj, table):
+    t = type(obj)
+    if t is unicode:
+        if len(obj) >= _MIN_REF_LENGTH:
+            # table maps each string to its index, or once it's been
+            # referenced, to the reference itself
+            ref = table.get(obj)
+            if ref is None:
+                table[obj] = len(table)
+                return obj
+            if type(ref) is int:
+                ref = table[obj] = msgpack.ExtType(MSGPACK_STRING_REF, msgpack.packb(ref))
+            return ref
+        return obj
+    elif t is dict:
+        result = {}
+        for k, v in obj.items():
+            k = _msgpack_add_string_refs(k, table)
+            result[k] = _msgpack_add_string_refs(v, table)
+        return result
+    elif t is list or t is tuple:
+        if not obj or isinstance(obj[0], _NUMBERS):
+            # Coordinates and the like: skip the whole list. The decoder
+            # makes the same decision, since it sees the same first item
+            return obj
+        return [_msgpack_add_string_refs(o, table) for o in obj]
+    return obj
+
+def _msgpack_resolve_string_refs(obj, table):
+    # Must visit strings in the same order as _msgpack_add_string_refs
+    t = type(obj)
+    if t is unicode:
+        if len(obj) >= _MIN_REF_LENGTH:
+            table.append(obj)
+        return obj
+    elif t is _StringRef:
+        return table[obj.index]
+    elif t is dict:
+        result = {}
+        for k, v in obj.items():
+            k = _msgpack_resolve_string_refs(k, table)
+            result[k] = _msgpack_resolve_string_refs(v, table)
+        return result
+    elif t is list:
+        if not obj or isinstance(obj[0], _NUMBERS):
+            return obj
+        return [_msgpack_resolve_string_refs(o, table) for o in obj]
+    return obj
+
+def msgpack_dumps(obj, string_table=False):
+    """Serializes a JSON-style document to MessagePack bytes. With
+    string_table=True, repeated strings are written as references."""
+    if string_table:
+        obj = _msgpack_add_string_refs(obj, {})
+    return msgpack.packb(obj, use_bin_type=True)
+
+def msgpack_loads(s):
+    """Parses MessagePack from bytes or another buffer, resolving any string references."""
+    refs = {}
+    def ext_hook(code, data):
+        if code == MSGPACK_STRING_REF:
+            ref = refs.get(data)
+            if ref is None:
+                ref = refs[data] = _StringRef(msgpack.unpackb(data))
+            return ref
+        return msgpack.ExtType(code, data)
+    doc = msgpack.unpackb(s, raw=False, strict_map_key=False, ext_hook=ext_hook)
+    if refs:
+        doc = _msgpack_resolve_string_refs(doc, [])
+    return doc
+
+def cbor_dumps(obj, string_table=False):
+    """Serializes a JSON-style document to CBOR bytes. With string_table=True,
+    repeated strings are written as stringrefs."""
+    return cbor2.dumps(obj, string_referencing=string_table)
+
+def cbor_loads(s):
+    """Parses CBOR from bytes or another buffer."""
+    if not isinstance(s, bytes):
+        s = bytes(s)
+    return cbor2.loads(s)
+
+##########
+# DOCUMENTS
+##########
+
 def is_tmdd(doc):
     # Does a given etree Element represent a TMDD document?
-    return doc.tag != 'open511' and bool(doc.xpath('//FEU'))
+    return doc.tag != 'open511' and next(doc.iter('FEU'), None) is not None
+
+# How much of a document sniff_format looks at
+SNIFF_SIZE = 8192
+
+_XML_PROLOG = r'(?:\s+|<\?.*?\?>|<!--.*?-->|<!DOCTYPE(?:[^>\[]|\[.*?\])*>)*'
+_XML_ROOT_RE = re.compile(_XML_PROLOG + r'<([^\s/>]+)', re.S)
+_XML_ROOT_RE_BYTES = re.compile(_XML_PROLOG.encode('ascii') + br'<([^\s/>]+)', re.S)
+_TMDD_RE = re.compile(r'<FEU[\s>]')
+_TMDD_RE_BYTES = re.compile(br'<FEU[\s>]')
+
+def _leading_junk(head):
+    """Returns the number of BOM and whitespace characters at the start of head."""
+    if isinstance(head, bytes):
+        stripped = head[3:] if head.startswith(codecs.BOM_UTF8) else head
+    else:
+        stripped = head[1:] if head.startswith(u'\ufeff') else head
+    return len(head) - len(stripped.lstrip())
+
+# UTF-32 first, since its little-endian BOM starts with UTF-16's
+_WIDE_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+def _wide_encoding(head):
+    """Returns 'utf-16' or 'utf-32' if bytes start with that encoding's BOM."""
+    for bom, encoding in _WIDE_BOMS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+# A document is a map, which starts with one of these bytes...
+_MSGPACK_MAP_BYTES = frozenset(list(range(0x80, 0x90)) + [0xde, 0xdf])
+_CBOR_MAP_BYTES = frozenset(range(0xa0, 0xc0))
+# ...or in CBOR, may be wrapped in the stringref-namespace tag (256), or
+# begin with the self-describe tag (55799)
+_CBOR_TAGS = (b'\xd9\x01\x00', b'\xd9\xd9\xf7')
+
+def sniff_format(head):
+    """Guesses the format of a serialized document from its first few kilobytes,
+    without parsing it.
+
+    head is a str or bytes prefix of the document. Returns 'json', 'xml' (for Open511
+    or unrecognized XML), 'tmdd', 'msgpack', 'cbor', or None if it's none of those."""
+    if not isinstance(head, (bytes, unicode)):
+        head = bytes(head)
+    binary = isinstance(head, bytes)
+    if binary and head:
+        first_byte = bytearray(head[:1])[0]
+        if first_byte in _MSGPACK_MAP_BYTES:
+            return 'msgpack'
+        if first_byte in _CBOR_MAP_BYTES or head.startswith(_CBOR_TAGS):
+            return 'cbor'
+        encoding = _wide_encoding(head)
+        if encoding:
+            # The head may end partway through a character
+            return sniff_format(head.decode(encoding, 'replace'))
+    head = head[_leading_junk(head):]
+    first = head[:1]
+    if binary:
+        first = first.decode('ascii', 'replace')
+    if first in ('{', '['):
+        return 'json'
+    if first != '<':
+        return None
+    match = (_XML_ROOT_RE_BYTES if binary else _XML_ROOT_RE).match(head)
+    if match:
+        root_tag = match.group(1)
+        if binary:
+            root_tag = root_tag.decode('utf8', 'replace')
+        if root_tag.rpartition(':')[2] != 'open511' and (_TMDD_RE_BYTES if binary else _TMDD_RE).search(head):
+            return 'tmdd'
+    return 'xml'
+
+_UTF8_PARSER = etree.XMLParser(encoding='utf-8')
+
+class _PrefixedReader(object):
+    """Wraps a file-like object, replaying bytes that have already been read from it."""
+
+    def __init__(self, prefix, f):
+        self.prefix = prefix
+        self.f = f
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.f.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.f.read()
+            self.prefix = b''
+        else:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+def _binary_loads(doc_format, s):
+    if doc_format == 'msgpack':
+        if msgpack is None:
+            raise Exception("Reading MessagePack requires the msgpack package")
+        return msgpack_loads(s)
+    if cbor2 is None:
+        raise Exception("Reading CBOR requires the cbor2 package")
+    return cbor_loads(s)
+
+def _json_loads_bytes(s):
+    # JSON is almost always UTF-8, which every backend reads directly
+    encoding = _wide_encoding(bytes(s[:4]))
+    if encoding:
+        s = bytes(s).decode(encoding)
+    return json_loads(s)
 
 def deserialize(s):
-    s = s.strip()
-    try:
-        doc = etree.fromstring(s)
-        if is_tmdd(doc):
-            # Transparently convert the TMDD on deserialize
-            from ..converter.tmdd import tmdd_to_json
-            return (tmdd_to_json(doc), 'json')
-        return (doc, 'xml')
-    except etree.XMLSyntaxError:
-        try:
-            return (json.loads(s), 'json')
-        except ValueError:
-            raise Exception("Doesn't look like either JSON or XML")
+    """Parses an Open511 XML, JSON, MessagePack or CBOR document, or a TMDD XML document.
+
+    s can be a str, bytes (or another buffer), or a file-like object opened
+    in binary mode. Bytes and files are handed to the parser as they are,
+    without being decoded or copied first.
+
+    Returns a tuple of (document, format): format is 'xml' for an lxml Element,
+    or 'json' for a dict. TMDD, MessagePack and CBOR documents are returned as
+    Open511 JSON."""
+    if hasattr(s, 'read'):
+        head = s.read(SNIFF_SIZE)
+        doc_format = sniff_format(head)
+        if doc_format in ('msgpack', 'cbor'):
+            return (_binary_loads(doc_format, head + s.read()), 'json')
+        head = head[_leading_junk(head):]
+        if doc_format == 'json':
+            doc = _json_loads_bytes(head + s.read())
+        elif doc_format is not None and _wide_encoding(head) == 'utf-32':
+            # lxml can't detect UTF-32 in a stream, only in a string
+            doc = etree.fromstring(head + s.read())
+        elif doc_format is not None:
+            doc = etree.parse(_PrefixedReader(head, s)).getroot()
+    else:
+        head = s[:SNIFF_SIZE]
+        doc_format = sniff_format(head)
+        if doc_format in ('msgpack', 'cbor'):
+            return (_binary_loads(doc_format, s), 'json')
+        junk = _leading_junk(head if isinstance(head, (bytes, unicode)) else bytes(head))
+        if junk:
+            # Slicing bytes would copy the whole document
+            s = s[junk:] if isinstance(s, unicode) else memoryview(s)[junk:]
+        if doc_format == 'json':
+            doc = json_loads(s) if isinstance(s, unicode) else _json_loads_bytes(s)
+        elif isinstance(s, unicode) and s.startswith('<?xml'):
+            # lxml won't take text with an encoding declaration
+            doc = etree.fromstring(s.encode('utf8'), _UTF8_PARSER)
+        elif doc_format is not None:
+            doc = etree.fromstring(s)
+
+    if doc_format is None:
+        raise Exception("Doesn't look like either JSON or XML")
+    if doc_format == 'json':
+        return (doc, 'json')
+    if is_tmdd(doc):
+        # Transparently convert the TMDD on deserialize
+        from ..converter.tmdd import tmdd_to_json
+        return (tmdd_to_json(doc), 'json')
+    return (doc, 'xml')
 
-def serialize(obj):
+def serialize(obj, compact=False):
     if getattr(obj, 'tag', None):
-        return etree.tostring(obj, pretty_print=True)
-    return json.dumps(obj, indent=4)    
\ No newline at end of file
+        return etree.tostring(obj, pretty_print=not compact)
+    return json_dumps(obj, compact=compact).decode('utf8')
+    
\ No newline at end of file
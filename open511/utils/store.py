@@ -0,0 +1,268 @@
+"""
+A SQLite-backed store of Open511 events, which answers Open511 API-style
+queries without re-parsing whole documents.
+
+    store = EventStore('events.db')
+    store.upsert(doc)
+    store.query({'severity': 'MAJOR', 'bbox': '-124,48,-122,50'})
+    store.export({'road_name': 'Highway 1'}, 'kml')
+"""
+import hashlib
+import sqlite3
+
+import pytz
+
+from open511.converter import open511_convert
+from open511.converter.o5json import compiled_xml_to_json
+from open511.utils.filters import EventFilter
+from open511.utils.geometry import bbox
+from open511.utils.schedule import Schedule
+from open511.utils.serialization import json_dumps, json_loads
+from open511.utils.timezone import epoch_seconds, parse_datetime
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    pk INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    jurisdiction TEXT,
+    status TEXT,
+    severity TEXT,
+    event_type TEXT,
+    updated TEXT,
+    updated_at REAL,
+    created_at REAL,
+    schedule_start REAL,
+    schedule_end REAL,
+    digest TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_jurisdiction ON events (jurisdiction);
+CREATE INDEX IF NOT EXISTS events_status ON events (status);
+CREATE INDEX IF NOT EXISTS events_severity ON events (severity);
+CREATE INDEX IF NOT EXISTS events_event_type ON events (event_type);
+CREATE INDEX IF NOT EXISTS events_updated_at ON events (updated_at);
+CREATE INDEX IF NOT EXISTS events_schedule ON events (schedule_start, schedule_end);
+-- Names are lowercased in Python, as EventFilter and EventCollection do;
+-- SQLite's NOCASE only folds ASCII
+CREATE TABLE IF NOT EXISTS event_roads (
+    pk INTEGER NOT NULL REFERENCES events (pk),
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS event_roads_name ON event_roads (name);
+CREATE INDEX IF NOT EXISTS event_roads_pk ON event_roads (pk);
+CREATE TABLE IF NOT EXISTS event_areas (
+    pk INTEGER NOT NULL REFERENCES events (pk),
+    area_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS event_areas_area_id ON event_areas (area_id);
+CREATE INDEX IF NOT EXISTS event_areas_pk ON event_areas (pk);
+CREATE VIRTUAL TABLE IF NOT EXISTS event_bbox USING rtree (pk, west, east, south, north);
+"""
+
+# Stored as PRAGMA user_version; databases from older versions are upgraded on opening
+_SCHEMA_VERSION = 1
+
+_OPERATORS = {'=': '=', '>': '>', '>=': '>=', '<': '<', '<=': '<='}
+
+def _epoch(dt):
+    return epoch_seconds(dt) if dt is not None else None
+
+def _timestamp(value):
+    """Seconds since the epoch for an ISO datetime with an offset, or None."""
+    dt = parse_datetime(value) if value else None
+    if dt is None or dt.tzinfo is None:
+        return None
+    return epoch_seconds(dt)
+
+def _placeholders(values):
+    return ', '.join('?' * len(values))
+
+class EventStore(object):
+    """Open511 events in a SQLite database, keyed on their id.
+
+    path is a filename, or ':memory:'. Schedules of events without a timezone
+    field are interpreted in default_timezone."""
+
+    def __init__(self, path=':memory:', default_timezone='UTC'):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+        self.default_timezone = default_timezone
+        self._timezones = {}
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < _SCHEMA_VERSION:
+            self._upgrade()
+
+    def _upgrade(self):
+        # Version 0 stored road names as given, compared with NOCASE
+        with self.conn:
+            self.conn.execute('DELETE FROM event_roads')
+            for pk, content in self.conn.execute('SELECT pk, doc FROM events').fetchall():
+                self._insert_roads(pk, json_loads(content))
+            self.conn.execute('PRAGMA user_version = %d' % _SCHEMA_VERSION)
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def _timezone(self, name):
+        name = name or self.default_timezone
+        tz = self._timezones.get(name)
+        if tz is None:
+            tz = self._timezones[name] = pytz.timezone(name)
+        return tz
+
+    def _schedule(self, event):
+        if not event.get('schedule'):
+            return None
+        return Schedule.from_json(event['schedule'], self._timezone(event.get('timezone')))
+
+    def upsert(self, doc):
+        """Adds or replaces the events in an Open511 document: an lxml Element,
+        a JSON dict (e.g. from deserialize or tmdd_to_json), or a list of JSON
+        events. Events whose updated timestamp hasn't changed since they
+        were stored are skipped.
+
+        Returns the number of events written."""
+        if getattr(doc, 'tag', None) is not None:
+            # XML events are only converted to JSON if they're written
+            items = [(el.findtext('id'), el.findtext('updated'), el) for el in doc.xpath('events/event')]
+            convert = compiled_xml_to_json
+        else:
+            events = doc.get('events', []) if isinstance(doc, dict) else doc
+            items = [(event['id'], event.get('updated'), event) for event in events]
+            convert = None
+        existing = {}
+        ids = [item[0] for item in items]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            existing.update((row[0], row[1:]) for row in self.conn.execute(
+                'SELECT id, pk, updated, digest FROM events WHERE id IN (%s)' % _placeholders(chunk), chunk))
+
+        written = 0
+        with self.conn:
+            for event_id, updated, event in items:
+                previous = existing.get(event_id)
+                if previous is not None and updated is not None and updated == previous[1]:
+                    continue
+                if convert is not None:
+                    event = convert(event)
+                content = json_dumps(event, compact=True)
+                digest = hashlib.sha1(content).hexdigest()
+                if previous is not None:
+                    if digest == previous[2]:
+                        continue
+                    self._delete_pks([previous[0]])
+                pk = self._insert(event, content, digest)
+                existing[event['id']] = (pk, event.get('updated'), digest)
+                written += 1
+        return written
+
+    def _insert(self, event, content, digest):
+        schedule = self._schedule(event)
+        start, end = schedule.bounds() if schedule is not None else (None, None)
+        cursor = self.conn.execute(
+            'INSERT INTO events (id, jurisdiction, status, severity, event_type, updated, updated_at, '
+            'created_at, schedule_start, schedule_end, digest, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                event['id'], event['id'].partition('/')[0], event.get('status'), event.get('severity'),
+                event.get('event_type'), event.get('updated'), _timestamp(event.get('updated')),
+                _timestamp(event.get('created')), _epoch(start),
+                # Open-ended schedules are stored with an infinite end, to keep the index useful
+                _epoch(end) if end is not None else (float('inf') if start is not None else None),
+                digest, content.decode('utf8')))
+        pk = cursor.lastrowid
+        self._insert_roads(pk, event)
+        self.conn.executemany('INSERT INTO event_areas (pk, area_id) VALUES (?, ?)',
+            [(pk, area['id']) for area in event.get('areas', []) if area.get('id')])
+        if event.get('geography'):
+            west, south, east, north = bbox(event['geography'])
+            self.conn.execute('INSERT INTO event_bbox (pk, west, east, south, north) VALUES (?, ?, ?, ?, ?)',
+                (pk, west, east, south, north))
+        return pk
+
+    def _insert_roads(self, pk, event):
+        self.conn.executemany('INSERT INTO event_roads (pk, name) VALUES (?, ?)',
+            [(pk, road['name'].lower()) for road in event.get('roads', []) if road.get('name')])
+
+    def _delete_pks(self, pks):
+        for table in ('event_roads', 'event_areas', 'event_bbox', 'events'):
+            self.conn.execute('DELETE FROM %s WHERE pk IN (%s)' % (table, _placeholders(pks)), pks)
+
+    def delete(self, ids):
+        """Removes the events with the given ids."""
+        ids = list(ids)
+        with self.conn:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                pks = [row[0] for row in self.conn.execute(
+                    'SELECT pk FROM events WHERE id IN (%s)' % _placeholders(chunk), chunk)]
+                if pks:
+                    self._delete_pks(pks)
+
+    def get(self, event_id):
+        """Returns the JSON event with the given id, or None."""
+        row = self.conn.execute('SELECT doc FROM events WHERE id = ?', (event_id,)).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def _where(self, f):
+        clauses = []
+        args = []
+        for field, column in (('status', 'status'), ('id', 'id'), ('jurisdiction', 'jurisdiction'),
+                ('severity', 'severity'), ('event_type', 'event_type')):
+            values = getattr(f, field)
+            if values is not None:
+                values = sorted(values)
+                clauses.append('%s IN (%s)' % (column, _placeholders(values)))
+                args.extend(values)
+        if f.road_name is not None:
+            values = sorted(f.road_name)
+            clauses.append('pk IN (SELECT pk FROM event_roads WHERE name IN (%s))' % _placeholders(values))
+            args.extend(values)
+        if f.area_id is not None:
+            values = sorted(f.area_id)
+            clauses.append('pk IN (SELECT pk FROM event_areas WHERE area_id IN (%s))' % _placeholders(values))
+            args.extend(values)
+        for field in ('updated', 'created'):
+            for op, dt in getattr(f, field) or []:
+                clauses.append('%s_at %s ?' % (field, _OPERATORS[op]))
+                args.append(_epoch(dt))
+        if f.bbox is not None:
+            west, south, east, north = f.bbox
+            clauses.append('pk IN (SELECT pk FROM event_bbox WHERE west <= ? AND east >= ? AND south <= ? AND north >= ?)')
+            args.extend([east, west, north, south])
+        if f.in_effect is not None:
+            clauses.append('schedule_start <= ? AND schedule_end >= ?')
+            args.extend([_epoch(f.in_effect.end), _epoch(f.in_effect.start)])
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), args
+
+    def query(self, filters=None, limit=None, offset=0):
+        """Returns a list of the JSON events matching filters, most recently
+        updated first.
+
+        filters is an EventFilter, or a dict of Open511 API query parameters
+        (see EventFilter.from_params); None returns every event."""
+        if filters is None:
+            filters = EventFilter()
+        elif not isinstance(filters, EventFilter):
+            filters = EventFilter.from_params(filters, default_timezone=self._timezone(None))
+        where, args = self._where(filters)
+        sql = 'SELECT doc FROM events' + where + ' ORDER BY updated_at DESC, pk'
+        if filters.in_effect is None and limit is not None:
+            sql += ' LIMIT %d OFFSET %d' % (limit, offset)
+        events = (json_loads(row[0]) for row in self.conn.execute(sql, args))
+        if filters.in_effect is None:
+            return list(events)
+        # The schedule bounds only narrow things down; check the schedules themselves
+        results = [event for event in events if self._schedule(event).active_within_range(*filters.in_effect)]
+        return results[offset:offset + limit] if limit is not None else results[offset:]
+
+    def export(self, filters=None, output_format='json', **kwargs):
+        """Converts the events matching filters (see query) to any of the
+        converter's output formats. Keyword arguments are passed to
+        open511_convert."""
+        limit = kwargs.pop('limit', None)
+        doc = {
+            'meta': {'version': 'v1'},
+            'events': self.query(filters, limit=limit)
+        }
+        return open511_convert(doc, output_format, **kwargs)
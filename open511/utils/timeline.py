@@ -0,0 +1,191 @@
+"""
+Precomputed, time-bucketed sets of the events in effect, for timeline views
+like "what's in effect each hour for the next week".
+
+    timeline = ActiveTimeline(doc, start=now(), horizon=datetime.timedelta(days=7))
+    timeline.active(some_datetime)     # ids in effect during that hour
+    timeline.counts()                  # number in effect in each hour
+    timeline.update(changed_events)    # only touches the affected buckets
+
+Each event's schedule is expanded once over the horizon; each bucket holds a
+bitset (see open511.utils.bitset) over event positions.
+"""
+import datetime
+
+import pytz
+
+from open511.utils.bitset import bitset, count, positions
+from open511.utils.schedule import Schedule
+from open511.utils.timezone import is_naive, make_aware, now
+
+class ActiveTimeline(object):
+    """The events in effect during each bucket-long stretch of time from start
+    until start + horizon.
+
+    Events are JSON dicts or lxml <event> elements, added from documents with
+    update(). Schedules of events without a timezone field are interpreted in
+    default_timezone. An event is active in a bucket if any of its intervals
+    overlaps it."""
+
+    def __init__(self, doc=None, start=None, horizon=datetime.timedelta(days=7),
+            bucket=datetime.timedelta(hours=1), default_timezone='UTC'):
+        if start is None:
+            start = now()
+        if is_naive(start):
+            start = make_aware(start, pytz.utc)
+        self.start = start
+        self.bucket = bucket
+        self.default_timezone = default_timezone
+        self._buckets = [0] * int(horizon.total_seconds() // bucket.total_seconds())
+        self._ids = []
+        self._positions = {}
+        self._free = []
+        self._schedules = {}
+        # position -> list of the bucket indexes the event is active in
+        self._event_buckets = {}
+        self._timezones = {}
+        if doc is not None:
+            self.update(doc)
+
+    @property
+    def end(self):
+        return self.start + self.bucket * len(self._buckets)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _timezone(self, name):
+        name = name or self.default_timezone
+        tz = self._timezones.get(name)
+        if tz is None:
+            tz = self._timezones[name] = pytz.timezone(name)
+        return tz
+
+    def _event_schedule(self, event):
+        """Returns (id, Schedule or None) for a JSON or XML event."""
+        if getattr(event, 'tag', None) is not None:
+            schedule = event.find('schedule')
+            tz = self._timezone(event.findtext('timezone'))
+            return event.findtext('id'), Schedule.from_element(schedule, tz) if schedule is not None else None
+        if not event.get('schedule'):
+            return event['id'], None
+        return event['id'], Schedule.from_json(event['schedule'], self._timezone(event.get('timezone')))
+
+    def _expand(self, schedule, first=0, last=None):
+        """Returns the indexes of the buckets from first to last (inclusive)
+        during which schedule is in effect."""
+        if last is None:
+            last = len(self._buckets) - 1
+        if schedule is None or last < first:
+            return []
+        bucket_seconds = self.bucket.total_seconds()
+        range_start = self.start + self.bucket * first
+        range_end = self.start + self.bucket * (last + 1)
+        indexes = []
+        for period in schedule.intervals(range_start, range_end):
+            if period.end is not None and period.end <= range_start:
+                continue
+            start_index = int((period.start - self.start).total_seconds() // bucket_seconds)
+            if period.end is None:
+                end_index = last
+            else:
+                # A period ending exactly on a bucket boundary doesn't reach into the next one
+                end_seconds = (period.end - self.start).total_seconds()
+                end_index = int(-(-end_seconds // bucket_seconds)) - 1
+            for i in range(max(start_index, first, indexes[-1] + 1 if indexes else first), min(end_index, last) + 1):
+                indexes.append(i)
+        return indexes
+
+    def update(self, doc):
+        """Adds or replaces the events in an Open511 document (lxml Element or
+        JSON dict), or a list of events. Only the buckets an event was or is
+        now active in are changed."""
+        if getattr(doc, 'tag', None) == 'open511':
+            events = doc.xpath('events/event')
+        elif isinstance(doc, dict):
+            events = doc.get('events', [])
+        else:
+            events = doc
+        new_bits = {}
+        for event in events:
+            event_id, schedule = self._event_schedule(event)
+            position = self._positions.get(event_id)
+            if position is None:
+                position = self._free.pop() if self._free else len(self._ids)
+                if position == len(self._ids):
+                    self._ids.append(event_id)
+                else:
+                    self._ids[position] = event_id
+                self._positions[event_id] = position
+            else:
+                self._clear(position)
+            self._schedules[position] = schedule
+            indexes = self._expand(schedule)
+            self._event_buckets[position] = indexes
+            for i in indexes:
+                new_bits.setdefault(i, []).append(position)
+        for i, bucket_positions in new_bits.items():
+            self._buckets[i] |= bitset(bucket_positions)
+
+    def _clear(self, position):
+        mask = ~(1 << position)
+        for i in self._event_buckets.pop(position, []):
+            self._buckets[i] &= mask
+
+    def remove(self, event_ids):
+        """Removes events by id. Unknown ids are ignored."""
+        for event_id in event_ids:
+            position = self._positions.pop(event_id, None)
+            if position is not None:
+                self._clear(position)
+                self._schedules.pop(position)
+                self._ids[position] = None
+                self._free.append(position)
+
+    def advance(self, start):
+        """Moves the timeline forward to a later start, keeping the same horizon.
+        Schedules are only expanded over the newly added buckets."""
+        if is_naive(start):
+            start = make_aware(start, pytz.utc)
+        shift = int((start - self.start).total_seconds() // self.bucket.total_seconds())
+        if shift <= 0:
+            return
+        n = len(self._buckets)
+        shift = min(shift, n)
+        self._buckets = self._buckets[shift:] + [0] * shift
+        self.start += self.bucket * shift
+        new_bits = {}
+        for position, schedule in self._schedules.items():
+            indexes = [i - shift for i in self._event_buckets.get(position, []) if i >= shift]
+            added = self._expand(schedule, first=n - shift)
+            self._event_buckets[position] = indexes + added
+            for i in added:
+                new_bits.setdefault(i, []).append(position)
+        for i, bucket_positions in new_bits.items():
+            self._buckets[i] |= bitset(bucket_positions)
+
+    def bucket_index(self, when):
+        """The index of the bucket containing a datetime, or None if it's outside
+        the timeline."""
+        if is_naive(when):
+            when = make_aware(when, pytz.utc)
+        i = int((when - self.start).total_seconds() // self.bucket.total_seconds())
+        return i if 0 <= i < len(self._buckets) else None
+
+    def active_bits(self, when):
+        """The bitset of the event positions active in the bucket containing when."""
+        i = self.bucket_index(when)
+        return self._buckets[i] if i is not None else 0
+
+    def active(self, when):
+        """A list of the ids of the events active in the bucket containing when."""
+        return [self._ids[p] for p in positions(self.active_bits(when))]
+
+    def buckets(self):
+        """Yields (bucket start, list of active event ids) for every bucket."""
+        for i, bits in enumerate(self._buckets):
+            yield self.start + self.bucket * i, [self._ids[p] for p in positions(bits)]
+
+    def counts(self):
+        """A list of the number of events active in each bucket."""
+        return [count(bits) for bits in self._buckets]
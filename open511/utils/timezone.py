@@ -1,8 +1,12 @@
 # Taken from django.utils.timezone
 
+from bisect import bisect_right
+import calendar
 import datetime
+import re
 
-from pytz import utc
+from pytz import utc, FixedOffset
+from pytz.exceptions import AmbiguousTimeError, NonExistentTimeError
 
 def now():
     return datetime.datetime.utcnow().replace(tzinfo=utc)
@@ -34,7 +38,7 @@ def make_aware(value, timezone):
     """
     if hasattr(timezone, 'localize') and value not in (datetime.datetime.min, datetime.datetime.max):
         # available for pytz time zones
-        return timezone.localize(value, is_dst=None)
+        return localize(value, timezone, is_dst=None)
     else:
         # may be wrong around DST changes
         return value.replace(tzinfo=timezone)
@@ -48,4 +52,122 @@ def make_naive(value, timezone):
     if hasattr(timezone, 'normalize'):
         # available for pytz time zones
         value = timezone.normalize(value)
-    return value.replace(tzinfo=None)
\ No newline at end of file
+    return value.replace(tzinfo=None)
+
+_DATETIME_RE = re.compile(
+    r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})'
+    r'[T ](?P<hour>\d{1,2}):(?P<minute>\d{1,2})'
+    r'(?::(?P<second>\d{1,2})(?:\.(?P<microsecond>\d{1,6})\d*)?)?'
+    r'\s*(?P<tzinfo>Z|[+-]\d{2}(?::?\d{2})?)?$'
+)
+
+def parse_datetime(value):
+    """Parses an ISO 8601 date and time, like the created and updated fields
+    of an Open511 event. Returns an aware datetime if the string has an
+    offset, a naive one if it doesn't, or None if it isn't a valid datetime.
+
+    Adapted from django.utils.dateparse."""
+    match = _DATETIME_RE.match(value)
+    if not match:
+        return None
+    kw = match.groupdict()
+    if kw['microsecond']:
+        kw['microsecond'] = kw['microsecond'].ljust(6, '0')
+    tzinfo = kw.pop('tzinfo')
+    if tzinfo == 'Z':
+        tzinfo = utc
+    elif tzinfo is not None:
+        offset = 60 * int(tzinfo[1:3]) + (int(tzinfo[-2:]) if len(tzinfo) > 3 else 0)
+        tzinfo = FixedOffset(-offset if tzinfo[0] == '-' else offset)
+    kw = dict((k, int(v)) for k, v in kw.items() if v is not None)
+    return datetime.datetime(tzinfo=tzinfo, **kw)
+
+def epoch_seconds(value):
+    """Returns an aware datetime as seconds since the Unix epoch, a float."""
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+class _TransitionTable(object):
+    """The local wall-clock ranges of each of a pytz timezone's offsets, built
+    from its table of UTC transitions."""
+
+    def __init__(self, tz):
+        self.tzinfos = [tz._tzinfos[info] for info in tz._transition_info]
+        self.dst = [bool(info[1]) for info in tz._transition_info]
+        # Offset i is in effect for local times from starts[i] up to ends[i]
+        self.starts = []
+        self.ends = []
+        transitions = tz._utc_transition_times
+        for i, info in enumerate(tz._transition_info):
+            self.starts.append(_shift(transitions[i], info[0]) if i else datetime.datetime.min)
+            self.ends.append(_shift(transitions[i + 1], info[0])
+                if i + 1 < len(transitions) else datetime.datetime.max)
+
+    def localize(self, value, is_dst):
+        i = bisect_right(self.starts, value) - 1
+        candidates = [j for j in (i - 2, i - 1, i) if j >= 0 and self.starts[j] <= value < self.ends[j]]
+        if len(candidates) == 1:
+            return value.replace(tzinfo=self.tzinfos[candidates[0]])
+        if not candidates:
+            # In the gap when clocks spring forward. Like pytz, keep the wall time with
+            # the offset from before the gap, or with is_dst the one after it.
+            if is_dst is None:
+                raise NonExistentTimeError(value)
+            six_hours = datetime.timedelta(hours=6)
+            if is_dst:
+                return self.localize(value + six_hours, is_dst) - six_hours
+            return self.localize(value - six_hours, is_dst) + six_hours
+        if is_dst is None:
+            raise AmbiguousTimeError(value)
+        matching = [j for j in candidates if self.dst[j] == bool(is_dst)]
+        if len(matching) == 1:
+            return value.replace(tzinfo=self.tzinfos[matching[0]])
+        # Both or neither match is_dst: the earlier occurrence for is_dst, else the later
+        candidates = matching or candidates
+        return value.replace(tzinfo=self.tzinfos[candidates[0] if is_dst else candidates[-1]])
+
+def _shift(value, delta):
+    try:
+        return value + delta
+    except OverflowError:
+        return datetime.datetime.min if delta < datetime.timedelta(0) else datetime.datetime.max
+
+_transition_tables = {}
+
+def localize(value, tz, is_dst=False):
+    """Attaches a timezone to a naive datetime, the fast equivalent of pytz's
+    tz.localize(value, is_dst), returning the same tzinfo objects.
+
+    For pytz timezones with DST, the wall time is looked up with bisect in a
+    table built once per zone. is_dst chooses between the two readings of an
+    ambiguous time, or the offset used for a time skipped by a DST change;
+    with is_dst=None, those raise pytz's AmbiguousTimeError or
+    NonExistentTimeError.
+
+    tz can also be any other tzinfo, such as a stdlib zoneinfo.ZoneInfo:
+    ambiguous and skipped times are then resolved with the datetime's fold
+    attribute (PEP 495), with the same is_dst semantics."""
+    transitions = getattr(tz, '_utc_transition_times', None)
+    if transitions is not None:
+        table = _transition_tables.get(tz.zone)
+        if table is None:
+            table = _transition_tables[tz.zone] = _TransitionTable(tz)
+        return table.localize(value, is_dst)
+    if hasattr(tz, 'localize'):
+        # pytz's fixed-offset zones
+        return tz.localize(value)
+    first = value.replace(tzinfo=tz)
+    if not hasattr(first, 'fold'):
+        return first
+    second = value.replace(tzinfo=tz, fold=1)
+    first_offset = first.utcoffset()
+    second_offset = second.utcoffset()
+    if first_offset == second_offset:
+        return first
+    if is_dst is None:
+        raise (AmbiguousTimeError if first_offset > second_offset else NonExistentTimeError)(value)
+    if first_offset > second_offset:
+        # Ambiguous: fold=0 is the earlier reading
+        return first if is_dst else second
+    # Skipped: fold=0 uses the offset from before the gap, fold=1 the one after
+    return second if is_dst else first
@@ -3,6 +3,7 @@ try:
 except NameError:
     unicode = str
 
+from collections import namedtuple
 from copy import deepcopy
 import os
 
@@ -10,7 +11,7 @@ from lxml import etree, isoschematron
 
 from open511.converter import pluralize
 from open511.converter.o5xml import json_struct_to_xml
-from open511.utils.serialization import get_base_open511_element
+from open511.utils.serialization import get_base_open511_element, XML_BASE, XML_LANG
 
 class Open511ValidationError(Exception):
     pass
@@ -45,9 +46,15 @@ def _make_link(rel, href):
     l.set('href', href)
     return l
 
-def validate_single_item(el, version=DEFAULT_VERSION, ignore_missing_urls=False):
-    doc = get_base_open511_element(version=version)
+def _wrap_item(el, version=DEFAULT_VERSION, lang=None, base=None):
+    """Returns an <open511> document containing only el, in the right container."""
+    doc = get_base_open511_element(lang=lang, base=base, version=version)
+    container = etree.Element(pluralize(el.tag))
+    container.append(el)
+    doc.append(container)
+    return doc
 
+def validate_single_item(el, version=DEFAULT_VERSION, ignore_missing_urls=False):
     if ignore_missing_urls:
         el = deepcopy(el)
         if not el.xpath('link[rel=self]'):
@@ -55,12 +62,76 @@ def validate_single_item(el, version=DEFAULT_VERSION, ignore_missing_urls=False)
         if not el.xpath('link[rel=jurisdiction]'):
             el.append(_make_link('jurisdiction', 'http://example.com/fake/jurisdiction'))
 
-    container = etree.Element(pluralize(el.tag))
-    container.append(el)
-    doc.append(container)
-    return validate(doc)
+    return validate(_wrap_item(el, version=version))
 
 def validate_single_json_item(obj, resource_type='event',
         ignore_missing_urls=False, version=DEFAULT_VERSION):
     return validate_single_item(json_struct_to_xml(obj, root=resource_type, custom_namespace='custom'),
         version=version, ignore_missing_urls=ignore_missing_urls)
+
+StreamError = namedtuple('StreamError', 'id line message')
+
+def validate_stream(source, on_error=None):
+    """Validates an Open511 XML document as it's parsed, so that it never has
+    to fit in memory: each <event> is checked on its own, wrapped as in
+    validate_single_item, and then discarded. The rest of the document (the
+    root element, meta, pagination...) is checked once at the end.
+
+    source is a filename or a binary file-like object. on_error, if given, is
+    called with a StreamError(event id, line, message) for each invalid event
+    as it's found, and for the rest of the document with an id of None.
+
+    Returns the number of events checked, or raises Open511ValidationError
+    listing every error."""
+    messages = []
+    count = 0
+    root = None
+    envelope = None
+    depth = 0
+    for action, el in etree.iterparse(source, events=('start', 'end')):
+        if action == 'start':
+            if root is None:
+                root = el
+                envelope = dict(version=root.get('version') or DEFAULT_VERSION,
+                    lang=root.get(XML_LANG), base=root.get(XML_BASE))
+                # Invalid root attributes are reported once, by the check of
+                # the rest of the document at the end; events are then wrapped
+                # in a plain envelope, so as not to fail because of them too
+                try:
+                    doc = get_base_open511_element(**envelope)
+                    etree.SubElement(doc, 'events')
+                    validate(doc)
+                except Open511ValidationError:
+                    envelope = dict(version=DEFAULT_VERSION)
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 2 or el.tag != 'event' or el.getparent().tag != 'events':
+            continue
+        count += 1
+        try:
+            validate(_wrap_item(deepcopy(el), **envelope))
+        except Open511ValidationError as e:
+            error = StreamError(el.findtext('id'), el.sourceline, unicode(e))
+            messages.append(u"Event %s (line %s): %s" % error)
+            if on_error:
+                on_error(error)
+        # Free the event, and the ones checked before it
+        el.clear()
+        parent = el.getparent()
+        while el.getprevious() is not None and el.getprevious().tag == 'event':
+            parent.remove(el.getprevious())
+
+    if root is not None:
+        for events in root.iterfind('events'):
+            for el in events.findall('event'):
+                events.remove(el)
+        try:
+            validate(root)
+        except Open511ValidationError as e:
+            messages.append(unicode(e))
+            if on_error:
+                on_error(StreamError(None, root.sourceline, unicode(e)))
+    if messages:
+        raise Open511ValidationError("\n\n".join(messages))
+    return count
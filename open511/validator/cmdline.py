@@ -6,21 +6,44 @@ except NameError:
 import argparse
 import sys
 
-from open511.validator import validate, Open511ValidationError
-from open511.converter import json_doc_to_xml
-from open511.utils.input import load_path
+from lxml import etree
+
+from open511.validator import validate, validate_stream, Open511ValidationError
+from open511.converter import compiled_json_doc_to_xml
+from open511.utils.input import load_path, open_path
 
 def validate_cmdline():
     parser = argparse.ArgumentParser(description='Validate an Open511 document.')
     parser.add_argument('source', metavar='DOC', type=str,
         help='Document to validate: path, URL, or - to read from stdin')
+    parser.add_argument('--stream', action='store_true',
+        help="Check an XML document one event at a time as it's read, for documents too big to load whole")
     arguments = parser.parse_args()
+    if arguments.stream:
+        return _validate_stream(arguments.source)
     obj, obj_type = load_path(arguments.source)
     if obj_type == 'json':
-        obj = json_doc_to_xml(obj, custom_namespace='http://validator.open511.org/custom-field')
+        obj = compiled_json_doc_to_xml(obj, custom_namespace='http://validator.open511.org/custom-field')
     try:
         validate(obj)
     except Open511ValidationError as e:
         sys.stderr.write(unicode(e))
         sys.stderr.write("\n")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+
+def _report_stream_error(error):
+    if error.id is not None:
+        sys.stderr.write(u"Event %s (line %s): " % (error.id, error.line))
+    sys.stderr.write(error.message)
+    sys.stderr.write("\n\n")
+
+def _validate_stream(source):
+    try:
+        with open_path(source) as f:
+            count = validate_stream(f, on_error=_report_stream_error)
+    except Open511ValidationError:
+        sys.exit(1)
+    except etree.XMLSyntaxError as e:
+        sys.stderr.write(u"Couldn't parse the document as XML: %s\n" % e)
+        sys.exit(1)
+    sys.stderr.write("%d events are valid\n" % count)
@@ -4,15 +4,23 @@ except NameError:
     unicode = str
 
 import functools
+import gzip
+import hashlib
+import io
 import logging
 import os
 
 from flask import Flask, render_template, request, Response, make_response
 import requests
 
-from open511.converter import json_doc_to_xml, xml_to_json, FORMATS, FORMATS_LIST, open511_convert
-from open511.validator import validate, Open511ValidationError
-from open511.utils.serialization import deserialize, serialize
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from open511.converter import FORMATS, FORMATS_LIST
+from open511.webtools.workers import (validation_context, convert_document,
+    WorkerPool, Overloaded, WorkerTimeout)
 
 app = Flask(__name__)
 
@@ -45,13 +53,113 @@ if os.environ.get('SENTRY_DSN'):
     from raven.contrib.flask import Sentry
     sentry = Sentry(app, dsn=os.environ['SENTRY_DSN'])
  
+# Seconds to wait for a remote document
+FETCH_TIMEOUT = float(os.environ.get('OPEN511_FETCH_TIMEOUT', 30))
+
+# If OPEN511_WORKER_PROCESSES is set, parsing, validation and conversion of
+# documents larger than OPEN511_WORKER_MIN_SIZE bytes run in a pool of that
+# many processes instead of blocking this one
+if os.environ.get('OPEN511_WORKER_PROCESSES'):
+    worker_pool = WorkerPool(
+        int(os.environ['OPEN511_WORKER_PROCESSES']),
+        max_pending=int(os.environ.get('OPEN511_WORKER_MAX_PENDING', 0)) or None,
+        timeout=float(os.environ.get('OPEN511_WORKER_TIMEOUT', 30))
+    )
+else:
+    worker_pool = None
+WORKER_MIN_SIZE = int(os.environ.get('OPEN511_WORKER_MIN_SIZE', 256 * 1024))
+
+def run_job(func, doc_content, *args):
+    if worker_pool is None or len(doc_content) < WORKER_MIN_SIZE:
+        # Small documents aren't worth the trip to another process
+        return func(doc_content, *args)
+    return worker_pool.run(func, doc_content, *args)
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    return Response("The server is too busy to process this document. Please try again shortly.\n",
+        status=503, headers={'Retry-After': '10'}, mimetype='text/plain')
+
+@app.errorhandler(WorkerTimeout)
+def worker_timeout(e):
+    return Response("This document took too long to process.\n", status=504, mimetype='text/plain')
+
+NO_CACHE = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+
+# How long CDNs and browsers may cache /convert responses that ask to be cacheable
+CONVERT_MAX_AGE = int(os.environ.get('OPEN511_CONVERT_MAX_AGE', 300))
+
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+def _gzip(data):
+    # A fixed mtime keeps the output, and therefore the ETag, deterministic
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+COMPRESSORS = {'gzip': _gzip}
+if brotli:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=5)
+# In order of preference, when the client doesn't have one
+ENCODINGS = [e for e in ('br', 'gzip') if e in COMPRESSORS]
+
 def no_cache(f):
     def new_func(*args, **kwargs):
         resp = make_response(f(*args, **kwargs))
-        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0'
+        resp.headers['Cache-Control'] = NO_CACHE
+        return resp
+    return functools.update_wrapper(new_func, f)
+
+def conditional(f):
+    """Adds a strong ETag, derived from the response body, to a view's responses,
+    and answers matching If-None-Match requests with 304 Not Modified.
+
+    Responses aren't cacheable unless the request includes cacheable=1."""
+    def new_func(*args, **kwargs):
+        resp = make_response(f(*args, **kwargs))
+        if request.values.get('cacheable'):
+            resp.headers['Cache-Control'] = 'public, max-age=%d' % CONVERT_MAX_AGE
+        else:
+            resp.headers['Cache-Control'] = NO_CACHE
+        if resp.status_code != 200 or resp.is_streamed:
+            return resp
+        etag = hashlib.sha1(resp.get_data()).hexdigest()
+        resp.set_etag(etag)
+        if request.method not in ('GET', 'HEAD'):
+            return resp
+        # A client may hold any of the compressed variants of the body
+        matching = [etag] + [etag + '-' + encoding for encoding in COMPRESSORS]
+        client_etags = request.if_none_match
+        for tag in matching:
+            if client_etags.contains(tag):
+                not_modified = Response(status=304)
+                not_modified.set_etag(tag)
+                not_modified.headers['Cache-Control'] = resp.headers['Cache-Control']
+                not_modified.vary.add('Accept-Encoding')
+                return not_modified
         return resp
     return functools.update_wrapper(new_func, f)
 
+@app.after_request
+def compress_response(resp):
+    """Compresses response bodies with gzip or Brotli, as negotiated via Accept-Encoding."""
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or 'Content-Encoding' in resp.headers):
+        return resp
+    resp.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if not encoding or resp.calculate_content_length() < COMPRESS_MIN_SIZE:
+        return resp
+    resp.set_data(COMPRESSORS[encoding](resp.get_data()))
+    resp.headers['Content-Encoding'] = encoding
+    etag, weak = resp.get_etag()
+    if etag:
+        # Each encoding is a different representation, with its own ETag
+        resp.set_etag(etag + '-' + encoding, weak)
+    return resp
+
 @app.route('/', methods=['GET', 'POST'])
 @no_cache
 def validator():
@@ -66,43 +174,7 @@ def validator():
         except FetchError as e:
             ctx['fetch_error'] = unicode(e)
             return render_template('validator.html', **ctx)
-        try:
-            if not isinstance(doc_content, unicode):
-                doc_content = doc_content.decode('utf8')
-            doc, doc_format = deserialize(doc_content)
-        except Exception as e:
-            ctx.update(doc_content=doc_content, deserialize_error=unicode(e))
-            return render_template('validator.html', **ctx)
-
-        if doc_format == 'json':
-            json_doc = doc
-            try:
-                xml_doc = json_doc_to_xml(json_doc, custom_namespace='http://validator.open511.com/custom-field')
-            except Exception as e:
-                ctx.update(error=unicode(e), doc_content=doc_content)
-                return render_template('validator.html', **ctx)
-        elif doc_format == 'xml':
-            xml_doc = doc
-            try:
-                json_doc = xml_to_json(xml_doc)
-            except:
-                json_doc = 'Error generating JSON'
-        else:
-            raise NotImplementedError
-
-        try:
-            validate(xml_doc)
-            success = True
-        except Open511ValidationError as e:
-            success = False
-            error = unicode(e)
-        ctx.update(
-            success=success,
-            error=None if success else error,
-            xml_string=serialize(xml_doc),
-            json_string=serialize(json_doc),
-            doc_format=doc_format
-        )
+        ctx.update(run_job(validation_context, doc_content))
         return render_template('validator.html', **ctx)
 
 class FetchError(Exception):
@@ -114,7 +186,8 @@ def _load_document():
         if not url.startswith('http'):
             url = 'http://' + url
         try:
-            doc_content = requests.get(url, headers={'Accept': 'application/xml, application/json;q=0.9'}).content
+            doc_content = requests.get(url, headers={'Accept': 'application/xml, application/json;q=0.9'},
+                timeout=FETCH_TIMEOUT).content
         except Exception as e:
             raise FetchError(unicode(e))
     elif 'doc_content' in request.form:
@@ -126,15 +199,14 @@ def _load_document():
     return doc_content
 
 @app.route('/convert', methods=['GET', 'POST'])
-@no_cache
+@conditional
 def convert():
     doc_content = _load_document()
-    if not isinstance(doc_content, unicode):
-        doc_content = doc_content.decode('utf8')
-    doc, doc_format = deserialize(doc_content)
-
     format = request.values['format']
-    result = open511_convert(doc, format)
+    properties = request.values.get('properties')
+    if properties is not None:
+        properties = [p for p in properties.split(',') if p]
+    result = run_job(convert_document, doc_content, format, bool(request.values.get('compact')), properties)
     format_info = FORMATS[format]
     return Response(result, mimetype=format_info.content_type)
 
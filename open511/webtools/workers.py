@@ -0,0 +1,119 @@
+"""
+The CPU-heavy parts of the web tools -- parsing, validation and conversion.
+
+These can run in the web process itself, or in a pool of worker processes
+(see WorkerPool), so that a large document doesn't block the gevent hub and
+stall every other request on the same web worker. The functions here take
+and return only plain, picklable values.
+"""
+try:
+    unicode
+except NameError:
+    unicode = str
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import multiprocessing
+import threading
+
+from open511.converter import compiled_json_doc_to_xml, compiled_xml_to_json, open511_convert
+from open511.validator import validate, Open511ValidationError
+from open511.utils.serialization import deserialize, serialize
+
+def _display_text(doc_content):
+    if isinstance(doc_content, unicode):
+        return doc_content
+    return doc_content.decode('utf8', 'replace')
+
+def validation_context(doc_content):
+    """Validates a serialized document, and returns a dict of template context
+    describing the results."""
+    try:
+        doc, doc_format = deserialize(doc_content)
+    except Exception as e:
+        return dict(doc_content=_display_text(doc_content), deserialize_error=unicode(e))
+
+    if doc_format == 'json':
+        json_doc = doc
+        try:
+            xml_doc = compiled_json_doc_to_xml(json_doc, custom_namespace='http://validator.open511.com/custom-field')
+        except Exception as e:
+            return dict(error=unicode(e), doc_content=_display_text(doc_content))
+    elif doc_format == 'xml':
+        xml_doc = doc
+        try:
+            json_doc = compiled_xml_to_json(xml_doc)
+        except:
+            json_doc = 'Error generating JSON'
+    else:
+        raise NotImplementedError
+
+    try:
+        validate(xml_doc)
+        success = True
+    except Open511ValidationError as e:
+        success = False
+        error = unicode(e)
+    return dict(
+        success=success,
+        error=None if success else error,
+        xml_string=serialize(xml_doc),
+        json_string=serialize(json_doc),
+        doc_format=doc_format
+    )
+
+def convert_document(doc_content, output_format, compact=False, properties=None):
+    """Converts a serialized document, returning the serialized result.
+    properties, if given, selects the event fields in GeoJSON output."""
+    doc, doc_format = deserialize(doc_content)
+    kwargs = {}
+    if properties is not None:
+        kwargs['properties'] = properties
+    result = open511_convert(doc, output_format, compact=compact, **kwargs)
+    if not isinstance(result, bytes):
+        # Streaming formats; the result has to be picklable
+        result = b''.join(result)
+    return result
+
+class Overloaded(Exception):
+    """All worker slots are busy."""
+    pass
+
+class WorkerTimeout(Exception):
+    pass
+
+class WorkerPool(object):
+    """Runs functions from this module in a bounded pool of worker processes.
+
+    processes - the number of worker processes
+    max_pending - how many jobs can be running or queued at once; beyond that,
+        run() raises Overloaded right away rather than queueing more work
+    timeout - seconds to wait for a job before run() raises WorkerTimeout"""
+
+    def __init__(self, processes, max_pending=None, timeout=30):
+        kwargs = {}
+        if hasattr(multiprocessing, 'get_context'):
+            # Don't fork a process that has been monkeypatched by gevent
+            kwargs['mp_context'] = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(processes, **kwargs)
+        self.slots = threading.BoundedSemaphore(max_pending or processes * 2)
+        self.timeout = timeout
+
+    def run(self, func, *args):
+        if not self.slots.acquire(False):
+            raise Overloaded
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        # The slot is only freed once the job is really finished, even if
+        # we've stopped waiting for it
+        future.add_done_callback(lambda f: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise WorkerTimeout
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
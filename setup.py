@@ -29,7 +29,8 @@ setup(
     entry_points = {
         'console_scripts': [
             'open511-validate = open511.validator.cmdline:validate_cmdline',
-            'open511-convert = open511.converter.cmdline:convert_cmdline'
+            'open511-convert = open511.converter.cmdline:convert_cmdline',
+            'open511-parquet = open511.converter.cmdline:parquet_cmdline'
         ]
     },
     author = 'Michael Mulley',